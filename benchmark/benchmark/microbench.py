@@ -0,0 +1,257 @@
+"""Microbenchmarks of ``Memoized.__call__``.
+
+Unlike the macrobenchmark (``benchmark.main``), which replays the commit
+history of real repositories, this times hits and misses of one
+memoized function in isolation, over a grid of argument sizes, return
+sizes, index sizes, persistence settings, and workers.
+
+::
+
+    python -m benchmark.microbench --output results.json
+    python -m benchmark.microbench --baseline results.json  # exits with 1 on a regression
+
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import itertools
+import json
+import multiprocessing
+import platform
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import typer
+
+import charmonium.cache
+from charmonium.cache import CacheThrashingWarning, DirObjStore, FileRWLock, Memoized, MemoizedGroup
+
+# Larger than the benchmark ever stores, so nothing is evicted.
+_SIZE = 1 << 50
+
+# The benchmarked function does no work, so caching it always "thrashes".
+warnings.filterwarnings("ignore", category=CacheThrashingWarning)
+
+
+def bench_func(key: Any, payload: bytes, return_size: int) -> bytes:  # pylint: disable=unused-argument
+    """The memoized function; it does no work, so the benchmark times only the caching."""
+    return bytes(return_size)
+
+
+@dataclasses.dataclass(frozen=True)
+class Case:
+    """One point of the benchmark grid; the fields identify it in the baseline."""
+
+    kind: str  # "hit" or "miss"
+    arg_size: int
+    return_size: int
+    index_size: int
+    fine_grain_persistence: bool
+    fine_grain_eviction: bool
+    workers: int
+    parallelism: str  # "thread" or "process"
+
+    def label(self) -> str:
+        return (
+            f"{self.kind:<4s} arg={self.arg_size:<8d} ret={self.return_size:<8d} "
+            f"index={self.index_size:<8d} fgp={self.fine_grain_persistence:d} "
+            f"fge={self.fine_grain_eviction:d} {self.parallelism}={self.workers}"
+        )
+
+
+def open_group(
+    path: Path, fine_grain_persistence: bool, fine_grain_eviction: bool
+) -> MemoizedGroup:
+    return MemoizedGroup(
+        obj_store=DirObjStore(path),
+        lock=FileRWLock(path / ".lock"),
+        size=_SIZE,
+        fine_grain_persistence=fine_grain_persistence,
+        fine_grain_eviction=fine_grain_eviction,
+    )
+
+
+def open_func(group: MemoizedGroup) -> Memoized[Any, bytes]:
+    # A fixed name, so that every process and group shares the same entries.
+    return Memoized(bench_func, group=group, name="benchmark.microbench.bench_func")
+
+
+def prefill(path: Path, index_size: int) -> None:
+    """Store ``index_size`` small entries, in one commit."""
+    group = open_group(path, False, False)
+    func = open_func(group)
+    for i in range(index_size):
+        func(("prefill", i), b"", 0)
+    group.commit()
+
+
+def percentile(sorted_values: Sequence[int], fraction: float) -> int:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def latency_stats(latencies_ns: Iterable[int], elapsed_ns: int) -> Dict[str, float]:
+    """Summarize per-call latencies, and throughput over ``elapsed_ns`` of wall time."""
+    sorted_latencies = sorted(latencies_ns)
+    return {
+        "calls": len(sorted_latencies),
+        "mean_ns": sum(sorted_latencies) / len(sorted_latencies),
+        "p50_ns": percentile(sorted_latencies, 0.50),
+        "p90_ns": percentile(sorted_latencies, 0.90),
+        "p99_ns": percentile(sorted_latencies, 0.99),
+        "max_ns": sorted_latencies[-1],
+        "calls_per_sec": len(sorted_latencies) / (elapsed_ns / 1e9),
+    }
+
+
+def _time_calls(func: Memoized[Any, bytes], case: Case, worker: int, calls: int) -> Tuple[List[int], int]:
+    """Time ``calls`` calls from one worker; returns the latencies and the elapsed time."""
+    payload = bytes(case.arg_size)
+    run = f"{time.time_ns()}-{worker}"
+    if case.kind == "hit":
+        func(("hit", run), payload, case.return_size)
+    latencies = []
+    start = time.perf_counter_ns()
+    for i in range(calls):
+        key = ("hit", run) if case.kind == "hit" else ("miss", run, i)
+        call_start = time.perf_counter_ns()
+        func(key, payload, case.return_size)
+        latencies.append(time.perf_counter_ns() - call_start)
+    elapsed = time.perf_counter_ns() - start
+    return latencies, elapsed
+
+
+def _process_worker(args: Tuple[Path, Case, int, int]) -> Tuple[List[int], int]:
+    path, case, worker, calls = args
+    group = open_group(path, case.fine_grain_persistence, case.fine_grain_eviction)
+    result = _time_calls(open_func(group), case, worker, calls)
+    group.commit()
+    return result
+
+
+def run_case(path: Path, case: Case, calls: int) -> Dict[str, float]:
+    if case.parallelism == "process" and case.workers > 1:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(case.workers) as pool:
+            results = pool.map(
+                _process_worker, [(path, case, worker, calls) for worker in range(case.workers)]
+            )
+    else:
+        # Threads share one group, as the threads of an application would.
+        group = open_group(path, case.fine_grain_persistence, case.fine_grain_eviction)
+        func = open_func(group)
+        results = [([], 0)] * case.workers
+
+        def thread_worker(worker: int) -> None:
+            results[worker] = _time_calls(func, case, worker, calls)
+
+        threads = [threading.Thread(target=thread_worker, args=(worker,)) for worker in range(case.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        group.commit()
+    return latency_stats(
+        itertools.chain.from_iterable(latencies for latencies, _ in results),
+        max(elapsed for _, elapsed in results),
+    )
+
+
+def run_grid(
+    cases: Sequence[Case], calls: int, verbose: bool = True
+) -> List[Dict[str, Any]]:
+    results = []
+    for index_size, group_cases in itertools.groupby(
+        sorted(cases, key=lambda case: case.index_size), key=lambda case: case.index_size
+    ):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir)
+            prefill(path, index_size)
+            for case in group_cases:
+                stats = run_case(path, case, calls)
+                results.append({**dataclasses.asdict(case), **stats})
+                if verbose:
+                    print(
+                        f"{case.label()} p50={stats['p50_ns'] / 1e3:9.1f}us p99={stats['p99_ns'] / 1e3:9.1f}us",
+                        file=sys.stderr,
+                    )
+    return results
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "charmonium.cache": charmonium.cache.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def _case_key(result: Mapping[str, Any]) -> Tuple[Any, ...]:
+    return tuple(result[field.name] for field in dataclasses.fields(Case))
+
+
+def compare(
+    baseline: Sequence[Mapping[str, Any]],
+    current: Sequence[Mapping[str, Any]],
+    tolerance: float,
+    statistic: str = "p50_ns",
+) -> List[Tuple[Mapping[str, Any], float]]:
+    """The current results whose ``statistic`` is more than ``1 + tolerance`` times the baseline's, with the ratio."""
+    baseline_by_case = {_case_key(result): result for result in baseline}
+    regressions = []
+    for result in current:
+        old = baseline_by_case.get(_case_key(result))
+        if old is not None and old[statistic] > 0:
+            ratio = result[statistic] / old[statistic]
+            if ratio > 1 + tolerance:
+                regressions.append((result, ratio))
+    return regressions
+
+
+def main(
+    output: Optional[Path] = typer.Option(None, help="Write the results as JSON here (default: stdout)."),
+    baseline: Optional[Path] = typer.Option(None, help="Compare against results previously written by --output."),
+    tolerance: float = typer.Option(0.25, help="The relative slowdown of the median which counts as a regression."),
+    calls: int = typer.Option(200, help="Calls per worker per case."),
+    arg_size: List[int] = typer.Option([16, 1 << 20], help="Bytes of the argument (repeatable)."),
+    return_size: List[int] = typer.Option([16, 1 << 20], help="Bytes of the return value (repeatable)."),
+    index_size: List[int] = typer.Option([1, 1000, 10000], help="Entries in the index before timing (repeatable; up to 1000000 is reasonable)."),
+    workers: List[int] = typer.Option([1, 4], help="Concurrent workers (repeatable)."),
+    parallelism: List[str] = typer.Option(["thread", "process"], help="'thread' and/or 'process'."),
+    fine_grain: List[str] = typer.Option(["00", "10", "11"], help="fine_grain_persistence and fine_grain_eviction as two bits, e.g. '10' (repeatable)."),
+) -> None:
+    cases = [
+        Case(kind, arg, ret, index, fgp == "1", fge == "1", worker_count, parallel)
+        for kind, arg, ret, index, (fgp, fge), worker_count, parallel in itertools.product(
+            ["hit", "miss"], arg_size, return_size, index_size, fine_grain, workers, parallelism
+        )
+        # With one worker, threads and processes are the same case.
+        if worker_count > 1 or parallel == parallelism[0]
+    ]
+    results = run_grid(cases, calls)
+    document = {"environment": environment(), "results": results}
+    if output is not None:
+        output.write_text(json.dumps(document, indent=2))
+    else:
+        print(json.dumps(document, indent=2))
+
+    if baseline is not None:
+        baseline_document = json.loads(baseline.read_text())
+        regressions = compare(baseline_document["results"], results, tolerance)
+        for result, ratio in regressions:
+            case = Case(**{field.name: result[field.name] for field in dataclasses.fields(Case)})
+            print(f"REGRESSION {case.label()} median is {ratio:.2f}x the baseline", file=sys.stderr)
+        if regressions:
+            raise typer.Exit(1)
+        print(f"No regressions against {baseline} (baseline charmonium.cache {baseline_document['environment']['charmonium.cache']})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    typer.run(main)
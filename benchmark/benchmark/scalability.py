@@ -0,0 +1,178 @@
+"""Throughput of many processes sharing one cache directory.
+
+Each of N processes opens its own :py:class:`~charmonium.cache.MemoizedGroup`
+on the same :py:class:`~charmonium.cache.DirObjStore` and calls one
+memoized function, hitting a pre-filled key with probability
+``--hit-ratio`` and missing on a fresh key otherwise. This is the
+workload which index and locking changes should be judged on.
+
+::
+
+    python -m benchmark.scalability --processes 1 --processes 8 --processes 64 --output scalability.json
+
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import itertools
+import json
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import typer
+
+from charmonium.cache import DirObjStore, FileRWLock, MemoizedGroup
+from charmonium.cache.metrics import Histogram, global_metrics
+
+from .microbench import environment, latency_stats, open_func
+
+# Larger than the benchmark ever stores, so nothing is evicted.
+_SIZE = 1 << 50
+
+# The lock which serializes index writes between processes, and the one between threads of a process.
+_LOCK_EVENTS = ("index_lock_writer", "write_lock")
+
+PERSISTENCE_MODES = {
+    # Commit once, when the worker is done.
+    "coarse": {},
+    # Commit from a background thread every second.
+    "interval": {"persistence_interval": 1.0},
+    # Read and write the index at every call.
+    "fine": {"fine_grain_persistence": True},
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class Case:
+    processes: int
+    hit_ratio: float
+    persistence: str
+
+
+def _open_group(path: Path, persistence: str) -> MemoizedGroup:
+    return MemoizedGroup(
+        obj_store=DirObjStore(path),
+        lock=FileRWLock(path / ".lock"),
+        size=_SIZE,
+        **PERSISTENCE_MODES[persistence],  # type: ignore
+    )
+
+
+def _worker(
+    path: Path,
+    case: Case,
+    worker: int,
+    calls: int,
+    warm_keys: int,
+    return_size: int,
+    barrier: Any,
+    results: Any,
+) -> None:
+    group = _open_group(path, case.persistence)
+    func = open_func(group)
+    rng = random.Random(worker)
+    # Load the index before the barrier, so that the first call is not an outlier.
+    func(("warm", 0), b"", 0)
+    global_metrics.reset()
+    latencies = []
+    barrier.wait()
+    start = time.perf_counter_ns()
+    for i in range(calls):
+        if rng.random() < case.hit_ratio:
+            key: Tuple[Any, ...] = ("warm", rng.randrange(warm_keys))
+            size = 0
+        else:
+            key = ("miss", worker, i, time.time_ns())
+            size = return_size
+        call_start = time.perf_counter_ns()
+        func(key, b"", size)
+        latencies.append(time.perf_counter_ns() - call_start)
+    group.commit()
+    elapsed = time.perf_counter_ns() - start
+    histograms, counters = global_metrics.snapshot()
+    results.put((
+        latencies,
+        elapsed,
+        {event: histograms.get(("", f"{event}_wait"), Histogram()) for event in _LOCK_EVENTS},
+        {event: counters.get(("", f"{event}_contended"), 0) for event in _LOCK_EVENTS},
+    ))
+
+
+def run_case(path: Path, case: Case, calls: int, warm_keys: int, return_size: int) -> Dict[str, Any]:
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(case.processes)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=_worker,
+            args=(path, case, worker, calls, warm_keys, return_size, barrier, results),
+        )
+        for worker in range(case.processes)
+    ]
+    for process in processes:
+        process.start()
+    # Drain the queue before joining, so that no worker blocks on a full pipe.
+    worker_results = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"A worker exited with {process.exitcode}")
+
+    stats: Dict[str, Any] = latency_stats(
+        itertools.chain.from_iterable(latencies for latencies, _, _, _ in worker_results),
+        max(elapsed for _, elapsed, _, _ in worker_results),
+    )
+    for event in _LOCK_EVENTS:
+        wait = Histogram()
+        for _, _, waits, _ in worker_results:
+            wait.merge(waits[event])
+        stats[f"{event}_wait_total_ns"] = wait.total_ns
+        stats[f"{event}_wait_p99_ns"] = wait.quantile(0.99)
+        stats[f"{event}_acquisitions"] = wait.count
+        # Only counts contention between threads of a process; waiting on other processes shows in the wait.
+        stats[f"{event}_contended"] = sum(contended[event] for _, _, _, contended in worker_results)
+    return stats
+
+
+def main(
+    output: Optional[Path] = typer.Option(None, help="Write the results as JSON here (default: stdout)."),
+    processes: List[int] = typer.Option([1, 2, 4, 8, 16, 32, 64], help="Concurrent processes (repeatable)."),
+    hit_ratio: List[float] = typer.Option([0.0, 0.5, 0.9, 1.0], help="Fraction of calls which hit (repeatable)."),
+    persistence: List[str] = typer.Option(list(PERSISTENCE_MODES), help=f"One of {', '.join(PERSISTENCE_MODES)} (repeatable)."),
+    calls: int = typer.Option(200, help="Calls per process per case."),
+    warm_keys: int = typer.Option(1000, help="Entries to pre-fill, which the hits are drawn from."),
+    return_size: int = typer.Option(1024, help="Bytes returned by each miss."),
+) -> None:
+    results = []
+    for case in itertools.starmap(Case, itertools.product(processes, hit_ratio, persistence)):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir)
+            group = _open_group(path, "coarse")
+            func = open_func(group)
+            for i in range(warm_keys):
+                func(("warm", i), b"", 0)
+            group.commit()
+            stats = run_case(path, case, calls, warm_keys, return_size)
+        results.append({**dataclasses.asdict(case), **stats})
+        print(
+            f"processes={case.processes:<3d} hit_ratio={case.hit_ratio:<4.2f} {case.persistence:<8s} "
+            f"{stats['calls_per_sec']:9.0f} calls/s p99={stats['p99_ns'] / 1e3:9.1f}us "
+            f"index write lock wait={stats['index_lock_writer_wait_total_ns'] / 1e9:.3f}s "
+            f"(p99={stats['index_lock_writer_wait_p99_ns'] / 1e3:.1f}us)",
+            file=sys.stderr,
+        )
+    document = json.dumps({"environment": environment(), "results": results}, indent=2)
+    if output is not None:
+        output.write_text(document)
+    else:
+        print(document)
+
+
+if __name__ == "__main__":
+    typer.run(main)
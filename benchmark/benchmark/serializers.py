@@ -0,0 +1,277 @@
+"""Benchmark :py:class:`~charmonium.cache.Pickler` implementations on representative payloads.
+
+Each pickler is timed dumping and loading each payload, and the size of
+its output is recorded. A pickler which cannot round-trip a payload
+(e.g. a DataFrame-only format given an ndarray) is skipped for that
+payload.
+
+With ``--samples``, the payloads are instead the values recorded by
+:py:class:`~charmonium.cache.RecordingPickler`, one directory per
+function, and a pickler is recommended for each function::
+
+    python -m benchmark.serializers --samples .cache-samples
+
+"""
+
+from __future__ import annotations
+
+import bz2
+import dataclasses
+import io
+import lzma
+import pickle
+import sys
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import typer
+
+from charmonium.cache import CompressedPickler, Pickler
+
+
+class ProtocolPickler(Pickler):
+    """The standard library's pickle with a specific protocol."""
+
+    def __init__(self, protocol: int) -> None:
+        self.protocol = protocol
+
+    def loads(self, buffer: bytes) -> Any:
+        return pickle.loads(buffer)
+
+    def dumps(self, obj: Any) -> bytes:
+        return pickle.dumps(obj, protocol=self.protocol)
+
+
+class FormatPickler(Pickler):
+    """A type-specific serializer, given as functions which write to and read from a binary file."""
+
+    def __init__(
+        self,
+        dump: Callable[[Any, io.BytesIO], Any],
+        load: Callable[[io.BytesIO], Any],
+        accepts: Callable[[Any], bool],
+    ) -> None:
+        self.dump = dump
+        self.load = load
+        self.accepts = accepts
+
+    def loads(self, buffer: bytes) -> Any:
+        return self.load(io.BytesIO(buffer))
+
+    def dumps(self, obj: Any) -> bytes:
+        if not self.accepts(obj):
+            raise TypeError(f"Cannot serialize {type(obj)}")
+        buffer = io.BytesIO()
+        self.dump(obj, buffer)
+        return buffer.getvalue()
+
+
+def numpy_picklers() -> Dict[str, Pickler]:
+    try:
+        import numpy as np  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return {}
+    return {
+        "numpy.save": FormatPickler(
+            lambda obj, file: np.save(file, obj, allow_pickle=False),
+            lambda file: np.load(file, allow_pickle=False),
+            lambda obj: isinstance(obj, np.ndarray) and obj.dtype != object,
+        ),
+    }
+
+
+def pandas_picklers() -> Dict[str, Pickler]:
+    try:
+        import pandas as pd  # type: ignore # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return {}
+    is_df = lambda obj: isinstance(obj, pd.DataFrame)  # noqa: E731
+    return {
+        "pandas.parquet": FormatPickler(lambda df, file: df.to_parquet(file), pd.read_parquet, is_df),
+        "pandas.feather": FormatPickler(lambda df, file: df.to_feather(file), pd.read_feather, is_df),
+        "pandas.excel": FormatPickler(lambda df, file: df.to_excel(file), pd.read_excel, is_df),
+    }
+
+
+def default_picklers() -> Dict[str, Pickler]:
+    """Every pickler which is installed, by name."""
+    picklers: Dict[str, Pickler] = {
+        f"pickle{protocol}": ProtocolPickler(protocol)
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1)
+    }
+    codecs: Dict[str, Any] = {"zlib": zlib, "bz2": bz2, "lzma": lzma}
+    for codec_name, module_name in [("lz4", "lz4.frame"), ("zstd", "zstd"), ("blosc", "blosc")]:
+        try:
+            codecs[codec_name] = __import__(module_name, fromlist=["compress"])
+        except ImportError:
+            pass
+    for codec_name, codec in codecs.items():
+        picklers[f"pickle{pickle.HIGHEST_PROTOCOL}+{codec_name}"] = CompressedPickler(
+            ProtocolPickler(pickle.HIGHEST_PROTOCOL), codec
+        )
+    for module_name in ["cloudpickle", "dill"]:
+        try:
+            picklers[module_name] = __import__(module_name)
+        except ImportError:
+            pass
+    picklers.update(numpy_picklers())
+    picklers.update(pandas_picklers())
+    return picklers
+
+
+def default_payloads() -> Dict[str, Any]:
+    """Payloads like the return values of typical data pipelines."""
+    payloads: Dict[str, Any] = {
+        "nested dict": {
+            f"key{i}": {"name": f"item {i}", "values": list(range(i % 50)), "weight": i / 7}
+            for i in range(10000)
+        },
+        "many small objects": [(i, f"label {i}", float(i)) for i in range(100000)],
+        "bytes": bytes(range(256)) * 4096,
+    }
+    try:
+        import numpy as np  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        pass
+    else:
+        rng = np.random.default_rng(42)
+        payloads["ndarray random"] = rng.standard_normal((1000, 1000))
+        payloads["ndarray integers"] = rng.integers(0, 10, (1000, 1000))
+    try:
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        pass
+    else:
+        size = 100000
+        payloads["DataFrame"] = pd.DataFrame(
+            {
+                "A": np.random.default_rng(42).standard_normal(size),
+                "B": [1] * size,
+                "C": [f"row {i % 100}" for i in range(size)],
+            }
+        )
+    return payloads
+
+
+def _equal(left: Any, right: Any) -> bool:
+    if hasattr(left, "equals"):
+        return bool(left.equals(right))
+    if type(left).__module__ == "numpy":
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        return bool(np.array_equal(left, right))
+    return bool(left == right)
+
+
+@dataclasses.dataclass
+class Measurement:
+    pickler: str
+    payload: str
+    dump_ns: int
+    load_ns: int
+    size: int
+
+
+def measure(pickler: Pickler, obj: Any, repeat: int = 3) -> Optional[Tuple[int, int, int]]:
+    """The fastest of ``repeat`` dumps and loads (in ns) and the size, or None if ``pickler`` cannot round-trip ``obj``."""
+    dump_ns = load_ns = sys.maxsize
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            buffer = pickler.dumps(obj)
+            dump_ns = min(dump_ns, time.perf_counter_ns() - start)
+            start = time.perf_counter_ns()
+            loaded = pickler.loads(buffer)
+            load_ns = min(load_ns, time.perf_counter_ns() - start)
+        if not _equal(obj, loaded):
+            return None
+    except Exception:  # pylint: disable=broad-except
+        return None
+    return dump_ns, load_ns, len(buffer)
+
+
+def benchmark(
+    picklers: Mapping[str, Pickler],
+    payloads: Mapping[str, Any],
+    repeat: int = 3,
+) -> List[Measurement]:
+    measurements = []
+    for payload_name, obj in payloads.items():
+        for pickler_name, pickler in picklers.items():
+            result = measure(pickler, obj, repeat)
+            if result is not None:
+                measurements.append(Measurement(pickler_name, payload_name, *result))
+    return measurements
+
+
+def cost(measurement: Measurement, loads_per_dump: float, ns_per_byte: float) -> float:
+    """Expected time of storing a value once, loading it ``loads_per_dump`` times, and moving its bytes to and from storage."""
+    return (
+        measurement.dump_ns
+        + loads_per_dump * measurement.load_ns
+        + (1 + loads_per_dump) * ns_per_byte * measurement.size
+    )
+
+
+def recommend(
+    measurements: Iterable[Measurement],
+    payloads: Sequence[str],
+    loads_per_dump: float = 1.0,
+    ns_per_byte: float = 1.0,
+) -> Optional[str]:
+    """The pickler with the least total :py:func:`cost` over ``payloads``, among those which handled all of them."""
+    totals: Dict[str, float] = {}
+    handled: Dict[str, int] = {}
+    for measurement in measurements:
+        if measurement.payload in payloads:
+            totals[measurement.pickler] = totals.get(measurement.pickler, 0) + cost(measurement, loads_per_dump, ns_per_byte)
+            handled[measurement.pickler] = handled.get(measurement.pickler, 0) + 1
+    candidates = [pickler for pickler, count in handled.items() if count == len(payloads)]
+    return min(candidates, key=totals.__getitem__, default=None)
+
+
+def load_samples(directory: Path, pickler: Pickler = pickle) -> Dict[str, Dict[str, Any]]:
+    """The values recorded by :py:class:`~charmonium.cache.RecordingPickler`, by function (subdirectory) and sample."""
+    return {
+        function_dir.name: {
+            f"{function_dir.name}/{sample.stem}": pickler.loads(sample.read_bytes())
+            for sample in sorted(function_dir.glob("*.sample"))
+        }
+        for function_dir in sorted(directory.iterdir())
+        if function_dir.is_dir()
+    }
+
+
+def print_table(measurements: Sequence[Measurement]) -> None:
+    print(f"{'payload':<24s} {'pickler':<20s} {'dump':>10s} {'load':>10s} {'size':>12s}")
+    for measurement in measurements:
+        print(
+            f"{measurement.payload[:24]:<24s} {measurement.pickler:<20s} "
+            f"{measurement.dump_ns / 1e6:8.1f}ms {measurement.load_ns / 1e6:8.1f}ms {measurement.size:12d}"
+        )
+
+
+def main(
+    samples: Optional[Path] = typer.Option(None, help="A directory of RecordingPickler directories, one per function."),
+    repeat: int = typer.Option(3, help="Time the fastest of this many dumps and loads."),
+    loads_per_dump: float = typer.Option(1.0, help="Expected hits per miss, which weights the load time."),
+    ns_per_byte: float = typer.Option(1.0, help="Storage cost per byte written or read (1.0 is about 1 GB/s)."),
+) -> None:
+    picklers = default_picklers()
+    if samples is None:
+        payloads = default_payloads()
+        measurements = benchmark(picklers, payloads, repeat)
+        print_table(measurements)
+        for payload in payloads:
+            print(f"{payload}: {recommend(measurements, [payload], loads_per_dump, ns_per_byte)}")
+    else:
+        for function, function_samples in load_samples(samples).items():
+            measurements = benchmark(picklers, function_samples, repeat)
+            print_table(measurements)
+            print(f"{function}: {recommend(measurements, list(function_samples), loads_per_dump, ns_per_byte)}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
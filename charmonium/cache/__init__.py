@@ -1,10 +1,11 @@
+from typing import TYPE_CHECKING, Any
+
 from .helpers import (
     FileContents as FileContents,
     TTLInterval as TTLInterval
 )
 from .memoize import (
     DEFAULT_MEMOIZED_GROUP as DEFAULT_MEMOIZED_GROUP,
-    DEFAULT_FREEZE_CONFIG as DEFAULT_FREEZE_CONFIG,
     CacheThrashingWarning as CacheThrashingWarning,
     Memoized as Memoized,
     MemoizedGroup as MemoizedGroup,
@@ -14,12 +15,20 @@ from .memoize import (
 from .obj_store import (
     DirObjStore as DirObjStore,
     ObjStore as ObjStore,
+    RedisObjStore as RedisObjStore,
+    S3ObjStore as S3ObjStore,
+    TieredObjStore as TieredObjStore,
 )
 from .pathlike import (
     PathLike as PathLike,
     pathlike_from as pathlike_from,
 )
-from .pickler import Pickler as Pickler
+from .pickler import (
+    CompressedPickler as CompressedPickler,
+    Pickler as Pickler,
+    RecordingPickler as RecordingPickler,
+)
+from .prometheus import PrometheusExporter as PrometheusExporter
 from .replacement_policies import (
     GDSize as GDSize,
     ReplacementPolicy as ReplacementPolicy,
@@ -28,13 +37,29 @@ from .rw_lock import (
     FileRWLock as FileRWLock,
     Lock as Lock,
     NaiveRWLock as NaiveRWLock,
+    RedisRWLock as RedisRWLock,
     RWLock as RWLock,
+    TimedLock as TimedLock,
+    TimedRWLock as TimedRWLock,
 )
 from .util import (
     Future as Future,
     with_attr as with_attr,
 )
 
+if TYPE_CHECKING:
+    from .memoize import DEFAULT_FREEZE_CONFIG as DEFAULT_FREEZE_CONFIG
+
+
+def __getattr__(name: str) -> Any:
+    # DEFAULT_FREEZE_CONFIG is constructed lazily, so that importing this package does not import charmonium.freeze.
+    if name == "DEFAULT_FREEZE_CONFIG":
+        from .memoize import _default_freeze_config  # pylint: disable=import-outside-toplevel
+
+        return _default_freeze_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 __author__ = "Samuel Grayson"
 __email__ = "sam+dev@samgrayson.me"
 __license__ = "MPL-2.0"
@@ -0,0 +1,420 @@
+"""The ``cache`` command: inspect and maintain a cache directory, e.g. from cron.
+
+It reads the index with :py:class:`OpaquePickler`, which substitutes
+placeholders for classes outside of charmonium.cache and the standard
+library, so it never imports (or runs) user code.
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import copyreg
+import importlib
+import io
+import json
+import pickle
+import random
+import sys
+from pathlib import Path
+from typing import Any, Callable, Iterable, Mapping, Optional, Sequence
+
+from .memoize import DEFAULT_OBJ_STORE_PATH, MemoizedGroup
+from .obj_store import DirObjStore, ObjStore, get_many
+from .replacement_policies import Entry
+from .rw_lock import FileRWLock
+from .util import format_size, parse_size
+
+_SAFE_MODULES = {"collections", "copyreg", "datetime", "_codecs"}
+_SAFE_BUILTINS = {
+    "bool",
+    "bytearray",
+    "bytes",
+    "complex",
+    "dict",
+    "float",
+    "frozenset",
+    "int",
+    "list",
+    "object",
+    "range",
+    "set",
+    "slice",
+    "str",
+    "tuple",
+}
+
+
+class Opaque:
+    """Stands in for an object of a class which the CLI does not import.
+
+    It records how it was constructed, so it pickles back to the same
+    object of the original class.
+
+    """
+
+    _opaque_module = ""
+    _opaque_name = ""
+    _opaque_reduce: tuple[Any, ...]
+    _opaque_state: Any
+    _opaque_listitems: list[Any]
+    _opaque_dictitems: dict[Any, Any]
+
+    def __new__(cls, *args: Any, **kwargs: Any) -> Opaque:
+        self = object.__new__(cls)
+        # Unpickling calls __new__ alone for NEWOBJ, and the class itself for REDUCE.
+        self._opaque_reduce = (
+            (copyreg.__newobj_ex__, (cls, args, kwargs))  # type: ignore
+            if kwargs
+            else (copyreg.__newobj__, (cls, *args))  # type: ignore
+        )
+        self._opaque_state = None
+        self._opaque_listitems = []
+        self._opaque_dictitems = {}
+        return self
+
+    def __init__(self, *args: Any) -> None:
+        self._opaque_reduce = (type(self), args)
+
+    def __setstate__(self, state: Any) -> None:
+        self._opaque_state = state
+
+    def append(self, item: Any) -> None:
+        self._opaque_listitems.append(item)
+
+    def extend(self, items: Iterable[Any]) -> None:
+        self._opaque_listitems.extend(items)
+
+    def __setitem__(self, key: Any, val: Any) -> None:
+        self._opaque_dictitems[key] = val
+
+    def __reduce_ex__(self, protocol: Any) -> tuple[Any, ...]:
+        return (
+            *self._opaque_reduce,
+            self._opaque_state,
+            iter(self._opaque_listitems) if self._opaque_listitems else None,
+            iter(self._opaque_dictitems.items()) if self._opaque_dictitems else None,
+        )
+
+    def __repr__(self) -> str:
+        return f"<opaque {self._opaque_module}.{self._opaque_name}>"
+
+
+_opaque_classes: dict[tuple[str, str], type[Opaque]] = {}
+
+
+def _opaque_class(module: str, name: str) -> type[Opaque]:
+    if (module, name) not in _opaque_classes:
+        _opaque_classes[(module, name)] = type(
+            name.rpartition(".")[2],
+            (Opaque,),
+            {"_opaque_module": module, "_opaque_name": name},
+        )
+    return _opaque_classes[(module, name)]
+
+
+def _is_safe(module: str, name: str) -> bool:
+    return (
+        module == "charmonium.cache"
+        or module.startswith("charmonium.cache.")
+        or module in _SAFE_MODULES
+        or (module in {"builtins", "__builtin__"} and name in _SAFE_BUILTINS)
+    )
+
+
+class _Module:
+    """Stands in for a module which the CLI does not import; it pickles as ``importlib.import_module(name)``."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+def _getattr(obj: Any, name: str) -> Any:
+    """Unpickles ``getattr``, as :py:meth:`_Pickler.reducer_override` uses it to refer to classes."""
+    if isinstance(obj, _Module):
+        if _is_safe(obj.name, name):
+            return getattr(importlib.import_module(obj.name), name)
+        else:
+            return _opaque_class(obj.name, name)
+    elif isinstance(obj, type) and issubclass(obj, Opaque) and obj is not Opaque:
+        return _opaque_class(obj._opaque_module, f"{obj._opaque_name}.{name}")  # pylint: disable=protected-access
+    else:
+        return _opaque_class("builtins", "getattr")(obj, name)
+
+
+class _Unpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str) -> Any:
+        if (module, name) == ("importlib", "import_module"):
+            return _Module
+        elif (module, name) == ("builtins", "getattr"):
+            return _getattr
+        elif _is_safe(module, name):
+            return super().find_class(module, name)
+        else:
+            return _opaque_class(module, name)
+
+
+class _Pickler(pickle.Pickler):
+    def reducer_override(self, obj: Any) -> Any:
+        # Saving a class by name would look up (and so import) its module; refer to it through getattr instead.
+        if isinstance(obj, type) and issubclass(obj, Opaque) and obj is not Opaque:
+            # pylint: disable=protected-access
+            parent, _, name = obj._opaque_name.rpartition(".")
+            return getattr, (_opaque_class(obj._opaque_module, parent) if parent else _Module(obj._opaque_module), name)
+        elif isinstance(obj, _Module):
+            return importlib.import_module, (obj.name,)
+        else:
+            return NotImplemented
+
+
+class OpaquePickler:
+    """A :py:class:`~charmonium.cache.Pickler` which never imports user code.
+
+    Objects of other classes load as :py:class:`Opaque` placeholders,
+    and dump back as the original.
+
+    """
+
+    def loads(self, buffer: bytes) -> Any:
+        return _Unpickler(io.BytesIO(buffer)).load()
+
+    def dumps(self, obj: Any) -> bytes:
+        buffer = io.BytesIO()
+        _Pickler(buffer, protocol=pickle.DEFAULT_PROTOCOL).dump(obj)
+        return buffer.getvalue()
+
+
+def _detect_index_shards(obj_store: ObjStore) -> int:
+    if 0 in obj_store:
+        return 1
+    for key in obj_store:
+        # Index headers live at small keys (see MemoizedGroup._shard_key).
+        if key < (1 << 48):
+            return max(key >> 32, 1)
+    return 1
+
+
+def _open_group(args: argparse.Namespace, writable: bool, size: Optional[int] = None) -> MemoizedGroup:
+    obj_store = DirObjStore(args.dir)
+    return MemoizedGroup(
+        obj_store=obj_store,
+        lock=FileRWLock(args.lock if args.lock is not None else Path(args.dir) / ".lock"),
+        pickler=OpaquePickler(),
+        index_shards=args.index_shards or _detect_index_shards(obj_store),
+        # Writing the index evicts down to the size, so only evict when asked.
+        size=size if size is not None else sys.maxsize,
+        persist_access_times=False,
+        read_only=not writable,
+    )
+
+
+def _entries(group: MemoizedGroup) -> list[tuple[Any, Entry]]:
+    # pylint: disable=protected-access
+    group._index_read(random.randint(0, 2**64 - 1))
+    return list(group._index.items())
+
+
+def _func_names(group: MemoizedGroup) -> dict[Any, str]:
+    """Map frozen names (the second level of the index) back to names."""
+    # pylint: disable=protected-access
+    return {
+        group._freeze(name): name
+        for name in {*group.time_saved.keys(), *group.time_cost.keys()}
+    }
+
+
+def _func_name(names: Mapping[Any, str], key: tuple[Any, ...]) -> str:
+    return names.get(key[1], f"<unknown {key[1]}>")
+
+
+def _output(args: argparse.Namespace, obj: Any, lines: Callable[[], Iterable[str]]) -> None:
+    if args.json:
+        print(json.dumps(obj, indent=2))
+    else:
+        for line in lines():
+            print(line)
+
+
+def _stats(args: argparse.Namespace) -> int:
+    group = _open_group(args, writable=False)
+    entries = _entries(group)
+    names = _func_names(group)
+    functions: dict[str, dict[str, Any]] = {
+        name: {"entries": 0, "bytes": 0} for name in names.values()
+    }
+    for key, entry in entries:
+        function = functions.setdefault(_func_name(names, key), {"entries": 0, "bytes": 0})
+        function["entries"] += 1
+        function["bytes"] += entry.data_size
+    for name, function in functions.items():
+        function["time_saved"] = group.time_saved.get(name, None)
+        function["time_cost"] = group.time_cost.get(name, None)
+        for field in ["time_saved", "time_cost"]:
+            function[field] = function[field].total_seconds() if function[field] is not None else 0.0
+    stats: dict[str, Any] = {
+        "entries": len(entries),
+        "bytes": sum(entry.data_size for _, entry in entries),
+        "index_shards": group._index_shards,  # pylint: disable=protected-access
+        "functions": functions,
+    }
+
+    def lines() -> Iterable[str]:
+        yield f"{args.dir}: {stats['entries']} entries, {format_size(stats['bytes'])}, {stats['index_shards']} index shard(s)"
+        width = max([len("function"), *map(len, functions)])
+        yield f"{'function':<{width}} {'entries':>8} {'size':>11} {'saved':>10} {'cost':>10}"
+        for name, function in sorted(functions.items(), key=lambda item: -item[1]["bytes"]):
+            yield (
+                f"{name:<{width}} {function['entries']:>8} {format_size(function['bytes']):>11} "
+                f"{function['time_saved']:>9.1f}s {function['time_cost']:>9.1f}s"
+            )
+
+    _output(args, stats, lines)
+    return 0
+
+
+def _ls(args: argparse.Namespace) -> int:
+    group = _open_group(args, writable=False)
+    entries = _entries(group)
+    names = _func_names(group)
+    if args.sort == "largest":
+        entries.sort(key=lambda item: -item[1].data_size)
+        scores: Mapping[Any, float] = {}
+    else:
+        try:
+            scores = group._replacement_policy.scores()  # pylint: disable=protected-access
+        except NotImplementedError:
+            print("The replacement policy does not rank entries", file=sys.stderr)
+            return 1
+        entries = [item for item in entries if item[0] in scores]
+        entries.sort(key=lambda item: scores[item[0]])
+    listing: list[dict[str, Any]] = [
+        {
+            "function": _func_name(names, key),
+            "bytes": entry.data_size,
+            "function_time": entry.function_time,
+            **({"score": scores[key]} if key in scores else {}),
+        }
+        for key, entry in entries[: args.number]
+    ]
+
+    def lines() -> Iterable[str]:
+        for item in listing:
+            yield (
+                f"{format_size(item['bytes']):>11} {item['function_time']:>9.1f}s "
+                + (f"{item['score']:>12.4g} " if "score" in item else "")
+                + item["function"]
+            )
+
+    _output(args, listing, lines)
+    return 0
+
+
+def _evict(args: argparse.Namespace) -> int:
+    group = _open_group(args, writable=True, size=parse_size(args.size))
+    before = len(_entries(group))
+    # pylint: disable=protected-access
+    group._evict(random.randint(0, 2**64 - 1))
+    # Commit before deleting the objects, so the index never refers to deleted objects.
+    group.commit()
+    group._delete_doomed()
+    after = len(group._index)
+    _output(args, {"evicted": before - after}, lambda: [f"Evicted {before - after} entries"])
+    return 0
+
+
+def _remove_orphans(args: argparse.Namespace) -> int:
+    group = _open_group(args, writable=True)
+    removed = group.remove_orphans()
+    _output(args, {"removed": removed}, lambda: [f"Removed {removed} orphans"])
+    return 0
+
+
+def _verify(args: argparse.Namespace) -> int:
+    group = _open_group(args, writable=args.fix)
+    entries = _entries(group)
+    names = _func_names(group)
+    # pylint: disable=protected-access
+    expected = {
+        group._freeze(key): (key, entry) for key, entry in entries if entry.obj_store
+    }
+    # One listing is much cheaper than a lookup per entry.
+    present = set(group._obj_store)
+    bad = {obj_key: "missing" for obj_key in expected if obj_key not in present}
+    if args.deep:
+        obj_keys = [obj_key for obj_key in expected if obj_key not in bad]
+        pickler = OpaquePickler()
+        for start in range(0, len(obj_keys), 256):
+            batch = obj_keys[start : start + 256]
+            for obj_key, value_ser in zip(batch, get_many(group._obj_store, batch, None)):
+                if value_ser is None:
+                    bad[obj_key] = "missing"
+                    continue
+                try:
+                    pickler.loads(value_ser)
+                except Exception:  # pylint: disable=broad-except
+                    bad[obj_key] = "corrupt"
+    if args.fix and bad:
+        with group._memory_lock:
+            for obj_key in bad:
+                key, entry = expected[obj_key]
+                group._deleter((key, entry))
+                del group._index[key]
+        group.commit()
+    problems = [
+        {"function": _func_name(names, expected[obj_key][0]), "obj_key": f"{obj_key:032x}", "problem": problem}
+        for obj_key, problem in bad.items()
+    ]
+
+    def lines() -> Iterable[str]:
+        for problem in problems:
+            yield f"{problem['problem']:>8} {problem['obj_key']} {problem['function']}"
+        yield f"{len(expected)} objects checked, {len(problems)} {'removed from the index' if args.fix else 'bad'}"
+
+    _output(args, {"checked": len(expected), "problems": problems, "fixed": args.fix}, lines)
+    return 1 if problems and not args.fix else 0
+
+
+def _compact(args: argparse.Namespace) -> int:
+    group = _open_group(args, writable=True)
+    group.compact()
+    _output(args, {"compacted": True}, lambda: ["Compacted the index"])
+    return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="cache",
+        description="Inspect and maintain a charmonium.cache directory (a DirObjStore) without importing the code which filled it.",
+    )
+    parser.add_argument("--dir", default=DEFAULT_OBJ_STORE_PATH, help="the cache directory (default: %(default)s)")
+    parser.add_argument("--lock", default=None, help="the index lock file (default: DIR/.lock)")
+    parser.add_argument("--index-shards", type=int, default=None, help="the index_shards of the group (default: detected)")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of text")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("stats", help="show the size of the index and per-function entries, bytes, and time saved").set_defaults(func=_stats)
+
+    ls_parser = subparsers.add_parser("ls", help="list the largest or coldest entries")
+    ls_parser.add_argument("sort", choices=["largest", "coldest"])
+    ls_parser.add_argument("-n", "--number", type=int, default=20)
+    ls_parser.set_defaults(func=_ls)
+
+    evict_parser = subparsers.add_parser("evict", help="evict entries until the cache fits in SIZE")
+    evict_parser.add_argument("size", help='e.g. "100 GiB"')
+    evict_parser.set_defaults(func=_evict)
+
+    subparsers.add_parser("remove-orphans", help="delete objects which the index does not refer to").set_defaults(func=_remove_orphans)
+
+    verify_parser = subparsers.add_parser("verify", help="check that the objects of the index exist (exit 1 if not)")
+    verify_parser.add_argument("--deep", action="store_true", help="also check that each object unpickles (assumes the default pickler)")
+    verify_parser.add_argument("--fix", action="store_true", help="remove entries with bad objects from the index")
+    verify_parser.set_defaults(func=_verify)
+
+    subparsers.add_parser("compact", help="rewrite the index as one snapshot per shard").set_defaults(func=_compact)
+
+    args = parser.parse_args(argv)
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
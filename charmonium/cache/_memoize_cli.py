@@ -0,0 +1,299 @@
+"""The ``memoize`` command: memoize a shell command (see docsrc/cli.rst).
+
+The command is keyed on its path, contents, arguments, stdin, working
+directory, output paths, and input files. Its stdout, stderr, and output files are stored in a
+MemoizedGroup, and restored on a hit. The input and output files are
+learned by tracing the command with strace, where available, or
+listed explicitly with ``--input`` and ``--output``.
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import codecs
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Iterable, Optional, Sequence
+
+from .helpers import FILE_COMPARISONS, FileContents
+from .memoize import DEFAULT_OBJ_STORE_PATH, Memoized, MemoizedGroup
+from .obj_store import DirObjStore
+from .replacement_policies import REPLACEMENT_POLICIES
+from .rw_lock import FileRWLock
+
+# Files under these are part of the system, not inputs of the command.
+DEFAULT_IGNORE = ("/proc", "/sys", "/dev", "/usr", "/lib", "/lib32", "/lib64", "/bin", "/sbin", "/etc", "/run")
+
+_SYSCALL = re.compile(
+    r"^(?:\[pid\s+)?(?P<pid>\d+)\]?\s+(?P<call>open|openat|openat2|creat)\((?P<args>.*?)"
+    r"(?:\)\s+=\s+(?P<ret>-?\d+)|\s+<unfinished \.\.\.>$)"
+)
+_RESUMED = re.compile(
+    r"^(?:\[pid\s+)?(?P<pid>\d+)\]?\s+<\.\.\. (?P<call>\w+) resumed>(?P<args>.*?)\)\s+=\s+(?P<ret>-?\d+)"
+)
+_PATH = re.compile(r'"((?:[^"\\]|\\.)*)"')
+_WRITE_FLAGS = ("O_WRONLY", "O_RDWR", "O_CREAT", "O_TRUNC", "O_APPEND")
+
+
+class CommandFailed(Exception):
+    """The command exited with a nonzero status, so its results are not stored."""
+
+    def __init__(self, returncode: int, stdout: bytes, stderr: bytes) -> None:
+        super().__init__(f"Command exited with {returncode}")
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class CommandResult:
+    """What a command produced; unpickling restores its output files (see FileContents)."""
+
+    def __init__(
+        self,
+        stdout: bytes,
+        stderr: bytes,
+        outputs: tuple[FileContents, ...],
+        inputs: tuple[str, ...],
+    ) -> None:
+        self.stdout = stdout
+        self.stderr = stderr
+        self.outputs = outputs
+        self.inputs = inputs
+
+
+class _Precomputed:
+    """An argument which does not change the key, to store a result computed by an earlier call."""
+
+    def __init__(self, result: Optional[CommandResult]) -> None:
+        self.result = result
+
+    def __cache_key__(self) -> None:
+        return None
+
+
+class _Options:
+    """Options which affect how a command is run, but not its key."""
+
+    def __init__(
+        self,
+        trace: bool,
+        inputs: Sequence[str],
+        ignore: Sequence[str],
+        comparison: str,
+    ) -> None:
+        self.trace = trace
+        self.inputs = inputs
+        self.ignore = tuple(str(Path(prefix).resolve()) for prefix in ignore)
+        self.comparison = comparison
+
+    def __cache_key__(self) -> None:
+        return None
+
+
+def parse_strace(
+    lines: Iterable[str], cwd: Path
+) -> tuple[set[Path], set[Path]]:
+    """The files which were successfully opened for reading and for writing, according to ``strace -f``."""
+    reads: set[Path] = set()
+    writes: set[Path] = set()
+    unfinished: dict[str, tuple[str, str]] = {}
+    for line in lines:
+        match = _SYSCALL.match(line)
+        if match and match.group("ret") is None:
+            unfinished[match.group("pid")] = (match.group("call"), match.group("args"))
+            continue
+        elif match:
+            call, args, ret = match.group("call"), match.group("args"), match.group("ret")
+        else:
+            match = _RESUMED.match(line)
+            if not match or match.group("pid") not in unfinished:
+                continue
+            call, args = unfinished.pop(match.group("pid"))
+            args += match.group("args")
+            ret = match.group("ret")
+        path_match = _PATH.search(args)
+        if int(ret) < 0 or not path_match:
+            continue
+        path = cwd / os.fsdecode(codecs.escape_decode(path_match.group(1).encode())[0])
+        if call == "creat" or any(flag in args for flag in _WRITE_FLAGS):
+            writes.add(path)
+        else:
+            reads.add(path)
+    return reads, writes
+
+
+def _execute(
+    command: Sequence[str], stdin: Optional[bytes], trace: bool
+) -> tuple[int, bytes, bytes, Optional[tuple[set[Path], set[Path]]]]:
+    strace = shutil.which("strace") if trace else None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        trace_path = Path(tmp_dir) / "trace"
+        prefix = [strace, "-f", "-qq", "-e", "trace=open,openat,openat2,creat", "-o", str(trace_path), "--"] if strace else []
+        if stdin is not None:
+            proc = subprocess.run(
+                [*prefix, *command], input=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
+            )
+        else:
+            proc = subprocess.run(
+                [*prefix, *command], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
+            )
+        traced = (
+            parse_strace(trace_path.read_text(errors="surrogateescape").splitlines(), Path.cwd())
+            if strace and trace_path.exists()
+            else None
+        )
+    return proc.returncode, proc.stdout, proc.stderr, traced
+
+
+def _run_command(
+    command: tuple[str, ...],
+    stdin: Optional[bytes],
+    key: Optional[str],
+    cwd: str,
+    outputs: tuple[str, ...],
+    inputs: tuple[FileContents, ...],
+    options: _Options,
+    precomputed: _Precomputed,
+) -> CommandResult:
+    # pylint: disable=unused-argument
+    if precomputed.result is not None:
+        return precomputed.result
+    returncode, stdout, stderr, traced = _execute(command, stdin, options.trace)
+    if returncode != 0:
+        raise CommandFailed(returncode, stdout, stderr)
+    explicit_inputs = {str(Path(path).resolve()) for path in options.inputs}
+    output_paths = {Path(path) for path in outputs}
+    found_inputs = set(explicit_inputs)
+    if traced is not None:
+        reads, writes = traced
+        ignored = [Path(prefix) for prefix in options.ignore]
+        found_outputs = {path.resolve() for path in writes if path.is_file()}
+        output_paths |= {path for path in found_outputs if not any(path.is_relative_to(prefix) for prefix in ignored)}
+        found_inputs |= {
+            str(path.resolve())
+            for path in reads
+            if path.is_file()
+            and path.resolve() not in found_outputs
+            and not any(path.resolve().is_relative_to(prefix) for prefix in ignored)
+        }
+    return CommandResult(
+        stdout,
+        stderr,
+        tuple(FileContents(path, options.comparison) for path in sorted(output_paths)),
+        tuple(sorted(found_inputs)),
+    )
+
+
+def _inputs_record(
+    obj_store: Path, cwd: str, command: Sequence[str], stdin: Optional[bytes], key: Optional[str]
+) -> Path:
+    digest = hashlib.sha256(
+        json.dumps([cwd, list(command), key, hashlib.sha256(stdin or b"").hexdigest()]).encode()
+    ).hexdigest()
+    # The DirObjStore ignores dot-files.
+    return obj_store / ".memoize-inputs" / f"{digest}.json"
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="memoize",
+        description="Run a command, or restore its stdout, stderr, and output files, if its command, arguments, stdin, and input files have not changed.",
+    )
+    parser.add_argument("--obj-store", default=DEFAULT_OBJ_STORE_PATH, help="the cache directory (default: %(default)s)")
+    parser.add_argument("--env", action="append", default=[], help="an environment variable whose value is part of the key (repeatable)")
+    parser.add_argument("--key", default=None, help="an extra key to look up")
+    parser.add_argument("--ver", default=None, help="an extra version to match")
+    parser.add_argument("--comparison", choices=sorted(FILE_COMPARISONS), default="crc32", help="how to tell if a file changed (default: %(default)s)")
+    parser.add_argument("--replacement", choices=sorted(REPLACEMENT_POLICIES), default="gdsize")
+    parser.add_argument("--max-size", default="1 GiB", help="the size of the cache (default: %(default)s)")
+    parser.add_argument("--input", action="append", default=[], help="an input file, in addition to those traced (repeatable)")
+    parser.add_argument("--output", action="append", default=[], help="an output file, in addition to those traced (repeatable)")
+    parser.add_argument("--ignore", action="append", default=list(DEFAULT_IGNORE), help="a directory whose traced files are neither inputs nor outputs (repeatable)")
+    parser.add_argument("--no-trace", dest="trace", action="store_false", help="do not trace; only use --input and --output")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("missing command")
+    if args.trace and not shutil.which("strace") and not (args.input or args.output):
+        print(
+            "memoize: strace is not available, so input and output files are not traced; list them with --input and --output",
+            file=sys.stderr,
+        )
+
+    executable = shutil.which(command[0]) or command[0]
+    obj_store = Path(args.obj_store)
+    group = MemoizedGroup(
+        obj_store=DirObjStore(obj_store),
+        lock=FileRWLock(obj_store / ".lock"),
+        replacement_policy=args.replacement,
+        size=args.max_size,
+    )
+    env = tuple((var, os.environ.get(var)) for var in sorted(args.env))
+    memoized = Memoized(
+        _run_command,
+        group=group,
+        # The command is looked up by its path, and matched by its contents, the --env variables, and --ver.
+        name=str(Path(executable).resolve()) if Path(executable).exists() else executable,
+        extra_func_state=lambda func: (env, args.ver, FileContents(executable, args.comparison).__cache_ver__()),
+    )
+    stdin = None if sys.stdin is None or sys.stdin.isatty() else sys.stdin.buffer.read()
+    options = _Options(args.trace, args.input, args.ignore, args.comparison)
+    # Relative paths in the command mean different files in a different directory.
+    cwd = str(Path.cwd())
+    outputs = tuple(sorted({str(Path(path).resolve()) for path in args.output}))
+    record = _inputs_record(obj_store, cwd, command, stdin, args.key)
+    recorded = json.loads(record.read_text()) if record.exists() else []
+    input_paths = sorted({*recorded, *(str(Path(path).resolve()) for path in args.input)})
+
+    def arguments(paths: Sequence[str], precomputed: Optional[CommandResult]) -> tuple[Any, ...]:
+        return (
+            tuple(command),
+            stdin,
+            args.key,
+            cwd,
+            outputs,
+            tuple(FileContents(path, args.comparison) for path in paths),
+            options,
+            _Precomputed(precomputed),
+        )
+
+    def call(paths: Sequence[str], precomputed: Optional[CommandResult]) -> CommandResult:
+        return memoized(*arguments(paths, precomputed))
+
+    # Checking for a hit hashes every input again, so only do it when it is printed.
+    hit = memoized.would_hit(*arguments(input_paths, None)) if args.verbose else None
+    try:
+        result = call(input_paths, None)
+    except CommandFailed as exc:
+        sys.stdout.buffer.write(exc.stdout)
+        sys.stdout.flush()
+        sys.stderr.buffer.write(exc.stderr)
+        sys.exit(exc.returncode)
+    if list(result.inputs) != input_paths:
+        # The command read different files than last time; key it by those, so the next run hits.
+        # The entry just stored under the old files would never be looked up again.
+        memoized.clear_entry(*arguments(input_paths, None))
+        record.parent.mkdir(parents=True, exist_ok=True)
+        record.write_text(json.dumps(list(result.inputs)))
+        call(result.inputs, result)
+    sys.stdout.buffer.write(result.stdout)
+    sys.stdout.flush()
+    sys.stderr.buffer.write(result.stderr)
+    if args.verbose:
+        print(f"memoize: {'hit' if hit else 'miss'} {' '.join(command)}", file=sys.stderr)
+        memoized.log_usage_report()
+    group.commit()
+
+
+if __name__ == "__main__":
+    main()
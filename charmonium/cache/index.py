@@ -142,7 +142,172 @@ class Index(Generic[Key, Val]):
         else:
             return False
 
-    def update(self, other: Index[Key, Val]) -> None:
+    def update(self, other: Union[Index[Key, Val], FlatIndex[Key, Val]]) -> None:
+        if other.schema != self.schema:
+            raise ValueError(f"Schema mismatch {self.schema} != {other.schema}")
+        for key, val in other.items():
+            if key not in self:
+                self[key] = val
+
+
+_MISSING = object()
+
+
+class FlatIndex(Generic[Key, Val]):
+    """Same interface and semantics as :py:class:`Index`, stored as one flat mapping.
+
+    ``Index`` nests a dict per level of the schema. ``FlatIndex``
+    maps the whole key-tuple to the value, so lookups, iteration, and
+    pickling don't recurse or allocate a dict per level.
+
+    The invalidation at MATCH levels uses two secondary maps:
+    ``_matches[prefix]`` is the current key at the MATCH level after
+    ``prefix``, and ``_members[prefix + (key,)]`` is the set of
+    key-tuples under that MATCH key. These are not pickled; they are
+    rebuilt at the first mutation after unpickling.
+
+    Unlike ``Index``, overwriting an existing key-tuple does not call
+    the deleter on the old value.
+
+    """
+
+    def __init__(
+        self,
+        schema: tuple[IndexKeyType, ...],
+        deleter: Optional[Callable[[tuple[tuple[Key, ...], Val]], None]] = None,
+    ) -> None:
+        self.schema = schema
+        self._data: dict[tuple[Key, ...], Val] = {}
+        self._deleter = deleter
+        self._init_secondary()
+
+    def _init_secondary(self) -> None:
+        self._match_levels = tuple(
+            level
+            for level, key_type in enumerate(self.schema)
+            if key_type == IndexKeyType.MATCH
+        )
+        self._matches: Optional[dict[tuple[Key, ...], Key]] = None
+        self._members: dict[tuple[Key, ...], set[tuple[Key, ...]]] = {}
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {
+            "schema": self.schema,
+            "_data": self._data,
+        }
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.schema = state["schema"]
+        self._data = state["_data"]
+        self._deleter = None
+        self._init_secondary()
+
+    def _ensure_secondary(self) -> dict[tuple[Key, ...], Key]:
+        if self._matches is None:
+            self._matches = {}
+            for keys in self._data:
+                for level in self._match_levels:
+                    self._matches[keys[:level]] = keys[level]
+                    self._members.setdefault(keys[: level + 1], set()).add(keys)
+        return self._matches
+
+    def _check_len(self, keys: tuple[Key, ...]) -> None:
+        if len(keys) != len(self.schema):
+            raise ValueError(
+                f"Keys {keys} should be the same len as schema ({len(self.schema)})"
+            )
+
+    def _forget(self, keys: tuple[Key, ...]) -> None:
+        """Remove keys from the secondary maps."""
+        matches = self._ensure_secondary()
+        for level in self._match_levels:
+            members = self._members.get(keys[: level + 1])
+            if members is not None:
+                members.discard(keys)
+                if not members:
+                    del self._members[keys[: level + 1]]
+                    if matches.get(keys[:level], _MISSING) == keys[level]:
+                        del matches[keys[:level]]
+
+    def _invalidate(self, prefix: tuple[Key, ...]) -> None:
+        """Delete every entry under prefix, calling the deleter."""
+        for keys in self._members.pop(prefix, set()):
+            val = self._data.pop(keys)
+            self._forget(keys)
+            if self._deleter:
+                self._deleter((keys, val))
+
+    def items(self) -> Iterable[tuple[tuple[Key, ...], Val]]:
+        return self._data.items()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_or(self, keys: tuple[Key, ...], thunk: Callable[[], Val]) -> Val:
+        if keys not in self:
+            self[keys] = thunk()
+        return self._data[keys]
+
+    def __setitem__(self, keys: tuple[Key, ...], val: Val) -> None:
+        self._check_len(keys)
+        matches = self._ensure_secondary()
+        for level in self._match_levels:
+            prefix = keys[:level]
+            matched = matches.get(prefix, _MISSING)
+            if matched is not _MISSING and matched != keys[level]:
+                self._invalidate(prefix + (cast(Key, matched),))
+            matches[prefix] = keys[level]
+            self._members.setdefault(keys[: level + 1], set()).add(keys)
+        self._data[keys] = val
+
+    def __delitem__(self, keys: tuple[Key, ...]) -> None:
+        self._check_len(keys)
+        if keys in self._data:
+            del self._data[keys]
+            self._forget(keys)
+
+    def __getitem__(self, keys: tuple[Key, ...]) -> Val:
+        self._check_len(keys)
+        return self._data[keys]
+
+    def get(self, keys: tuple[Key, ...], default: _T) -> Union[Val, _T]:
+        self._check_len(keys)
+        return self._data.get(keys, default)
+
+    def __contains__(self, keys: tuple[Key, ...]) -> bool:
+        self._check_len(keys)
+        return keys in self._data
+
+    def filter(
+        self, predicate: Callable[[tuple[Key, ...], Val], bool]
+    ) -> FlatIndex[Key, Val]:
+        """A new FlatIndex (without a deleter) of the items for which predicate is True."""
+        ret = FlatIndex[Key, Val](self.schema)
+        ret._data = {  # pylint: disable=protected-access
+            keys: val for keys, val in self._data.items() if predicate(keys, val)
+        }
+        return ret
+
+    def subset(self, keys: Iterable[tuple[Key, ...]]) -> FlatIndex[Key, Val]:
+        """A new FlatIndex (without a deleter) of the items whose key-tuples are in keys.
+
+        Unlike :py:meth:`filter`, this takes time proportional to ``len(keys)``.
+
+        """
+        ret = FlatIndex[Key, Val](self.schema)
+        ret._data = {  # pylint: disable=protected-access
+            keys: self._data[keys] for keys in keys if keys in self._data
+        }
+        return ret
+
+    def update(self, other: Union[Index[Key, Val], FlatIndex[Key, Val]]) -> None:
+        """Bring in the items of other that are not in self.
+
+        As in :py:meth:`Index.update`, when an item of other conflicts
+        with self at a MATCH level, other wins, and the items of self
+        which it replaces are passed to the deleter.
+
+        """
         if other.schema != self.schema:
             raise ValueError(f"Schema mismatch {self.schema} != {other.schema}")
         for key, val in other.items():
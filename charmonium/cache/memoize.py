@@ -1,24 +1,25 @@
 from __future__ import annotations
 
 import atexit
-import contextlib
+import collections
 import copy
 import dataclasses
 import datetime
-import json
 import logging
 import os
 import pickle
 import random
 import sys
 import threading
+import time
 import warnings
+import weakref
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     DefaultDict,
     Generic,
-    Generator,
     Mapping,
     Optional,
     Tuple,
@@ -27,45 +28,74 @@ from typing import (
     cast,
 )
 
-import bitmath  # type: ignore
-from charmonium.freeze import freeze, Config as FreezeConfig, global_config
-
-from .index import Index, IndexKeyType
-from .obj_store import DirObjStore, ObjStore
+from .index import FlatIndex, Index, IndexKeyType
+from .metrics import global_metrics, global_sampler
+from .obj_store import DirObjStore, ObjStore, delete_many
 from .pickler import Pickler
 from .replacement_policies import REPLACEMENT_POLICIES, Entry, ReplacementPolicy
-from .rw_lock import FileRWLock, Lock, RWLock
+from .rw_lock import FileRWLock, Lock, RedisRWLock, RWLock, TimedLock, TimedRWLock
 from .util import (
     Constant,
     FuncParams,
     FuncReturn,
     Future,
     GetAttr,
+    format_duration,
     identity,
     none_tuple,
+    parse_size,
 )
 
+if TYPE_CHECKING:
+    import bitmath  # type: ignore
+    from charmonium.freeze import Config as FreezeConfig
+
 BYTE_ORDER: str = "big"
 
 __version__ = "1.4.1"
 
-DEFAULT_FREEZE_CONFIG = copy.deepcopy(global_config)
-DEFAULT_FREEZE_CONFIG.use_hash = True
-DEFAULT_FREEZE_CONFIG.ignore_classes.update(
-    {
-        ("charmonium.cache.memoize", "Memoized"),
-        ("charmonium.cache.memoize", "MemoizedGroup"),
-    }
-)
-DEFAULT_FREEZE_CONFIG.ignore_attributes.update(
-    {
-        ("charmonium.cache.memoize", "Memoized", "group"),
-        ("charmonium.cache.memoize", "Memoized", "_use_obj_store"),
-        ("charmonium.cache.memoize", "Memoized", "_use_metadata_size"),
-        ("charmonium.cache.memoize", "Memoized", "_my_pickler"),
-        ("charmonium.cache.memoize", "Memoized", "_extra_func_state"),
-    }
-)
+# charmonium.freeze is imported on first use, to keep `import charmonium.cache` fast.
+# DEFAULT_FREEZE_CONFIG is constructed by the module-level __getattr__ below.
+DEFAULT_FREEZE_CONFIG: FreezeConfig
+
+
+def _default_freeze_config() -> FreezeConfig:
+    global DEFAULT_FREEZE_CONFIG  # pylint: disable=global-statement
+    if "DEFAULT_FREEZE_CONFIG" not in globals():
+        from charmonium.freeze import global_config  # pylint: disable=import-outside-toplevel
+
+        config = copy.deepcopy(global_config)
+        config.use_hash = True
+        config.ignore_classes.update(
+            {
+                ("charmonium.cache.memoize", "Memoized"),
+                ("charmonium.cache.memoize", "MemoizedGroup"),
+            }
+        )
+        config.ignore_attributes.update(
+            {
+                ("charmonium.cache.memoize", "Memoized", "group"),
+                ("charmonium.cache.memoize", "Memoized", "_use_obj_store"),
+                ("charmonium.cache.memoize", "Memoized", "_use_metadata_size"),
+                ("charmonium.cache.memoize", "Memoized", "_my_pickler"),
+                ("charmonium.cache.memoize", "Memoized", "_extra_func_state"),
+            }
+        )
+        DEFAULT_FREEZE_CONFIG = config
+    return DEFAULT_FREEZE_CONFIG
+
+
+def __getattr__(name: str) -> Any:
+    if name == "DEFAULT_FREEZE_CONFIG":
+        return _default_freeze_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _dumps(obj: Any) -> str:
+    # json is only needed when logging is enabled.
+    import json  # pylint: disable=import-outside-toplevel
+
+    return json.dumps(obj)
 
 
 def memoize(
@@ -95,40 +125,100 @@ if perf_logger_file:
     perf_logger.propagate = False
 
 
-@contextlib.contextmanager
-def perf_ctx(event: str, call_id: int) -> Generator[None, None, None]:
-    if perf_logger.isEnabledFor(logging.DEBUG):
-        start = datetime.datetime.now()
-    yield
+def _perf_event(name: str, event: str, call_id: int, duration_ns: int) -> None:
+    """Aggregate a duration into :py:data:`global_metrics`, and log it individually at DEBUG level."""
+    global_metrics.observe(name, event, duration_ns)
+    if global_sampler.active:
+        global_sampler.event(call_id, event, duration_ns)
     if perf_logger.isEnabledFor(logging.DEBUG):
         perf_logger.debug(
-            json.dumps(
+            _dumps(
                 {
                     "event": event,
-                    "duration": (datetime.datetime.now() - start).total_seconds(),
+                    "duration": duration_ns / 1e9,
                     "call_id": call_id,
                 }
             )
         )
 
 
+class perf_ctx:  # pylint: disable=invalid-name
+    """Time the body with :py:func:`time.perf_counter_ns` (see :py:func:`_perf_event`).
+
+    This is a class rather than a ``contextlib.contextmanager``,
+    because a generator costs more than the events it measures.
+
+    """
+
+    __slots__ = ("event", "call_id", "name", "start")
+
+    def __init__(self, event: str, call_id: int, name: str = "") -> None:
+        self.event = event
+        self.call_id = call_id
+        self.name = name
+        self.start = 0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        _perf_event(self.name, self.event, self.call_id, time.perf_counter_ns() - self.start)
+
+
+@dataclasses.dataclass
+class _IndexShard:
+    """The persistence-state of one shard of a MemoizedGroup's index."""
+
+    key: int
+    lock: RWLock
+    version: int = 0
+    loaded: bool = False
+    # Index keys which were stored, accessed, or deleted since the last write.
+    touched: set[Any] = dataclasses.field(default_factory=set)
+    # As of the last read, the (version, obj_key) of the snapshot and of the deltas after it.
+    snapshot: Optional[tuple[int, int]] = None
+    deltas: tuple[tuple[int, int], ...] = ()
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.touched)
+
+
 @dataclasses.dataclass
 class MemoizedGroup:
     """A MemoizedGroup holds the memoization for multiple functions."""
 
     # pylint: disable=too-many-instance-attributes
 
-    _index: Index[Any, Entry]
+    _index: FlatIndex[Any, Entry]
     _obj_store: ObjStore
     _replacement_policy: ReplacementPolicy
-    _size: bitmath.Bitmath
+    _size: int
+    _function_quotas: dict[str, int]
+    _function_reservations: dict[str, int]
     _index_lock: RWLock
     _memory_lock: Lock
+    _write_lock: Lock
+    _pending: collections.deque[tuple[str, datetime.timedelta, datetime.timedelta, Optional[tuple[Any, Entry]]]]
+    _doomed: list[int]
     _fine_grain_persistence: bool
     _fine_grain_eviction: bool
+    _persist_access_times: bool
+    _read_only: bool
+    _persistence_interval: Optional[datetime.timedelta]
+    _persistence_entries: Optional[int]
     _index_key: int
+    _index_shards: int
+    _index_deltas: int
+    _shard_lock: Optional[Callable[[int], RWLock]]
     _extra_system_state: Callable[[], Any]
-    _version: int
+    _shards: list[_IndexShard]
+    _name_shards: dict[str, int]
+    _func_names: dict[Any, str]
+    _new_entries: int
+    _last_write: float
+    _persister: Optional[threading.Thread]
+    _persist_event: threading.Event
     _pickler: Pickler
     time_cost: dict[str, datetime.timedelta]
     time_saved: dict[str, datetime.timedelta]
@@ -138,13 +228,28 @@ class MemoizedGroup:
         return {
             slot: getattr(self, slot)
             for slot in self.__dict__
-            if slot not in {"__weakref__", "_index", "_memory_lock", "_version"}
+            if slot
+            not in {
+                "__weakref__",
+                "_index",
+                "_memory_lock",
+                "_write_lock",
+                "_pending",
+                "_doomed",
+                "_shards",
+                "_name_shards",
+                "_func_names",
+                "_new_entries",
+                "_last_write",
+                "_persister",
+                "_persist_event",
+            }
         }
 
     def __setstate__(self, state: Mapping[str, Any]) -> Any:
         for attr_name, attr_val in state.items():
             setattr(self, attr_name, attr_val)
-        self._index = Index[Any, Entry](
+        self._index = FlatIndex[Any, Entry](
             (
                 IndexKeyType.MATCH,  # system state
                 IndexKeyType.LOOKUP,  # func name
@@ -154,22 +259,53 @@ class MemoizedGroup:
             ),
             self._deleter,
         )
-        self._version = 0
-        self._memory_lock = threading.RLock()
-        self._index_read(random.randint(0, 2**64 - 1))
+        # Each shard of the index is read lazily, at the first lookup, so that defining memoized functions is cheap.
+        self._shards = [
+            _IndexShard(
+                key=self._shard_key(shard),
+                lock=TimedRWLock(self._make_shard_lock(shard), "index_lock"),
+            )
+            for shard in range(self._index_shards)
+        ]
+        self._name_shards = {}
+        # Frozen names back to names, to label metrics of entries by their function.
+        self._func_names = {}
+        self._new_entries = 0
+        self._last_write = time.monotonic()
+        # Locks are always taken in this order: _write_lock, then a shard's lock, then _memory_lock.
+        # _memory_lock guards structural changes to the in-memory state; lookups do not take it.
+        # All three are timed, to tell contention from I/O (see charmonium.cache.metrics).
+        self._memory_lock = TimedLock(threading.RLock(), "memory_lock")
+        self._write_lock = TimedLock(threading.Lock(), "write_lock")
+        self._pending = collections.deque()
+        self._doomed = []
+        self._persist_event = threading.Event()
+        self._persister = None
+        _commit_on_excepthook(self)
+        _fork_groups[:] = [group_ref for group_ref in _fork_groups if group_ref() is not None]
+        _fork_groups.append(weakref.ref(self))
 
     def __init__(
         self,
         *,
         obj_store: Optional[ObjStore] = None,
         replacement_policy: Union[str, ReplacementPolicy] = "gdsize",
-        size: Union[int, str, bitmath.Bitmath] = bitmath.KiB(100),
+        size: Union[int, str, bitmath.Bitmath] = "100 KiB",
+        function_quotas: Optional[Mapping[str, Union[int, str, bitmath.Bitmath]]] = None,
+        function_reservations: Optional[Mapping[str, Union[int, str, bitmath.Bitmath]]] = None,
         pickler: Pickler = pickle,
         lock: Optional[RWLock] = None,
+        index_shards: int = 1,
+        shard_lock: Optional[Callable[[int], RWLock]] = None,
+        index_deltas: int = 32,
         fine_grain_persistence: bool = False,
         fine_grain_eviction: bool = False,
+        persist_access_times: bool = True,
+        read_only: bool = False,
+        persistence_interval: Optional[Union[float, datetime.timedelta]] = None,
+        persistence_entries: Optional[int] = None,
         extra_system_state: Callable[[], Any] = Constant(None),
-        freeze_config: FreezeConfig = DEFAULT_FREEZE_CONFIG,
+        freeze_config: Optional[FreezeConfig] = None,
         temporary: bool = False,
     ) -> None:
         """Construct a memoized group. Use with :py:function:Memoized.
@@ -177,12 +313,21 @@ class MemoizedGroup:
         :param obj_store: The object store to use for return values.
         :param replacement_policy: See policies submodule for options. You can pass an object conforming to the ReplacementPolicy protocol or one of REPLACEMENT_POLICIES.
         :param size: The size as an int (in bytes), as a string (e.g. "3 MiB"), or as a `bitmath.Bitmath`_.
+        :param function_quotas: A mapping from :py:attr:`Memoized.name` to the maximum size that function's entries may occupy. A function over its quota has its own entries evicted first.
+        :param function_reservations: A mapping from :py:attr:`Memoized.name` to a size that is reserved for that function. A function's entries are not evicted to make room for others while it occupies no more than its reservation. The reservations must sum to no more than ``size``.
         :param pickler: A de/serialization to use on the index, conforming to the Pickler protocol.
         :param lock: A ReadersWriterLock to achieve exclusion. If the lock is wrong but the obj_store is atomic, then the memoization is still *correct*, but it may not be able to borrow values that another machine computed. Defaults to a FileRWLock.
+        :param index_shards: Split the index into this many shards, each with its own lock and version. Functions are assigned to shards by a hash of :py:attr:`Memoized.name`. Processes using functions in different shards do not contend when reading or writing the index; only eviction (which is global) reads every shard.
+        :param shard_lock: A callable from the shard number to the RWLock for that shard. Defaults to a FileRWLock (or RedisRWLock) next to ``lock``, suffixed by the shard number, if ``lock`` is one, and to ``lock`` itself otherwise. Ignored if ``index_shards`` is 1.
+        :param index_deltas: Each write of the index stores only the entries which changed, as a delta, so that readers which are already up-to-date only load what changed since their version. After this many deltas, the next write compacts them into a full snapshot. 0 writes a full snapshot every time.
         :param fine_grain_persistence: De/serialize the index at every access. This is useful if you need to update the cache for multiple simultaneous processes, but it compromises performance in the single-process case.
         :param fine_grain_eviction: Maintain the cache's size through eviction at every access (rather than just the de/serialization points). This is useful if the caches size would not otherwise fit in memory, but it compromises performance if not needed.
+        :param persist_access_times: Record cache hits (for the replacement policy and ``time_saved``) in the index. Set this to False for read-mostly usage; then a process which only hits never has to write the index.
+        :param read_only: Never write to the obj_store or take the lock; a miss calls the function without storing its result. The index is read without the lock (writers store the index header last, so a reader sees a complete version), unless it keeps changing during the read. This is useful for a cache pre-populated by another process on a shared, read-only volume.
+        :param persistence_interval: "Medium-grain" persistence; commit the index from a background thread when it has changed and this many seconds (or this `datetime.timedelta`) have passed since the last commit.
+        :param persistence_entries: "Medium-grain" persistence; commit the index from a background thread once this many new entries have been stored since the last commit.
         :param extra_system_state: A callable that returns "extra" system state. If the system state changes, the cache is dumped.
-        :param freeze_config: A charmonium.freeze.Config object. This config determines how objects and functions get hashed.
+        :param freeze_config: A charmonium.freeze.Config object. This config determines how objects and functions get hashed. Defaults to ``DEFAULT_FREEZE_CONFIG``.
         :param temporary: Whether the cache should be cleared at the end of the process; This is useful for tests.
 
         .. _`bitmath.Bitmath`: https://pypi.org/project/bitmath/
@@ -198,21 +343,54 @@ class MemoizedGroup:
             if isinstance(replacement_policy, str)
             else replacement_policy
         )
-        self._size = (
-            size
-            if isinstance(size, bitmath.Bitmath)
-            else bitmath.Byte(size)
-            if isinstance(size, int)
-            else bitmath.parse_string(size)
-        )
+        self._size = parse_size(size)
+        self._function_quotas = {
+            name: parse_size(quota)
+            for name, quota in (function_quotas or {}).items()
+        }
+        self._function_reservations = {
+            name: parse_size(reservation)
+            for name, reservation in (function_reservations or {}).items()
+        }
+        if sum(self._function_reservations.values()) > self._size:
+            raise ValueError(
+                f"function_reservations sum to more than the size of the cache ({self._size} bytes)"
+            )
         self._pickler = pickler
         self._index_lock = lock if lock is not None else FileRWLock(DEFAULT_LOCK_PATH)
         self._fine_grain_persistence = fine_grain_persistence
         self._fine_grain_eviction = fine_grain_eviction
+        self._read_only = read_only
+        if self._read_only and temporary:
+            raise ValueError("A read_only group cannot be temporary, because it would clear the obj_store")
+        self._persist_access_times = persist_access_times and not read_only
+        self._persistence_interval = (
+            persistence_interval
+            if persistence_interval is None
+            or isinstance(persistence_interval, datetime.timedelta)
+            else datetime.timedelta(seconds=persistence_interval)
+        )
+        self._persistence_entries = persistence_entries
         self._extra_system_state = extra_system_state
         self._index_key = 0
+        if index_shards < 1:
+            raise ValueError(f"index_shards must be at least 1, not {index_shards}")
+        if index_shards > 1:
+            try:
+                # Filtering out every entry is cheap, and tells whether the policy can be split by shard.
+                self._replacement_policy.filter(lambda key, entry: False)
+            except NotImplementedError as exc:
+                raise ValueError(
+                    f"{type(self._replacement_policy).__name__} does not support sharded indexes (index_shards > 1)"
+                ) from exc
+        self._index_shards = index_shards
+        self._shard_lock = shard_lock
+        self._index_deltas = index_deltas
+        # None means DEFAULT_FREEZE_CONFIG, which is resolved at the first hash.
         self._freeze_config = freeze_config
-        assert self._freeze_config.hasher is not None, "Hashing must be enabled in freeze_config"
+        assert (
+            self._freeze_config is None or self._freeze_config.hasher is not None
+        ), "Hashing must be enabled in freeze_config"
         self.time_cost = DefaultDict[str, datetime.timedelta](datetime.timedelta)
         self.time_saved = DefaultDict[str, datetime.timedelta](datetime.timedelta)
         self.temporary = temporary
@@ -220,21 +398,81 @@ class MemoizedGroup:
         if self.temporary:
             atexit.register(self._obj_store.clear)
             # atexit handlers are run in the opposite order they are registered.
-        atexit.register(self._index_write, 0)
-        # TODO: atexit log report
+        if not self._read_only:
+            atexit.register(self._index_write, 0)
+
+    def _freeze(self, obj: Any) -> Any:
+        from charmonium.freeze import freeze  # pylint: disable=import-outside-toplevel
+
+        if self._freeze_config is None:
+            self._freeze_config = _default_freeze_config()
+        return freeze(obj, self._freeze_config)
+
+    def _shard_key(self, shard: int) -> int:
+        if self._index_shards == 1:
+            return self._index_key
+        else:
+            # The number of shards is part of the key, so that changing it does not mix index layouts.
+            return self._index_key + (self._index_shards << 32) + shard
+
+    def _make_shard_lock(self, shard: int) -> RWLock:
+        if self._index_shards == 1:
+            return self._index_lock
+        elif self._shard_lock is not None:
+            return self._shard_lock(shard)
+        elif isinstance(self._index_lock, FileRWLock):
+            return FileRWLock(f"{self._index_lock.path}.{shard}")
+        elif isinstance(self._index_lock, RedisRWLock):
+            return self._index_lock.with_name(f"{self._index_lock.name}.{shard}")
+        else:
+            return self._index_lock
+
+    def _shard_of_key(self, key: tuple[Any, ...]) -> int:
+        # key[1] is the frozen name of the function.
+        return cast(int, key[1]) % self._index_shards if self._index_shards > 1 else 0
+
+    def _shard_of_name(self, name: str) -> int:
+        if self._index_shards == 1:
+            return 0
+        if name not in self._name_shards:
+            self._name_shards[name] = cast(int, self._freeze(name)) % self._index_shards
+        return self._name_shards[name]
+
+    def _mark_dirty(self, key: tuple[Any, ...]) -> None:
+        self._shards[self._shard_of_key(key)].touched.add(key)
+
+    @property
+    def _dirty(self) -> bool:
+        return any(shard.dirty for shard in self._shards)
+
+    def _delete_doomed(self) -> None:
+        """Delete the objects of deleted and evicted entries, in one bulk operation.
+
+        The deleter and eviction only collect obj_keys (under the
+        memory lock); this deletes them, outside of it.
+
+        """
+        if not self._doomed:
+            # Checked without the lock, so that hits do not take it.
+            return
+        with self._memory_lock:
+            doomed, self._doomed = self._doomed, []
+        if doomed:
+            delete_many(self._obj_store, doomed)
 
     def _deleter(self, item: tuple[Any, Entry]) -> None:
         with self._memory_lock:
             key, entry = item
-            if entry.obj_store:
-                obj_key = cast(int, freeze(key, self._freeze_config))
-                del self._obj_store[obj_key]
+            if entry.obj_store and not self._read_only:
+                obj_key = cast(int, self._freeze(key))
+                self._doomed.append(obj_key)
             else:
                 obj_key = None
             self._replacement_policy.invalidate(key, entry)
+            self._mark_dirty(key)
         if ops_logger.isEnabledFor(logging.DEBUG):
             ops_logger.debug(
-                json.dumps(
+                _dumps(
                     {
                         "pid": os.getpid(),
                         "tid": threading.get_native_id(),
@@ -248,8 +486,8 @@ class MemoizedGroup:
     def refresh(self) -> None:
         """Refresh the this cache from storage
 
-        Note: This happens automatically at function import-time if
-        fine_grain_persistence is enabled, after function call.
+        Note: This happens automatically at the first lookup, and
+        before every lookup if fine_grain_persistence is enabled.
 
         """
         self._index_read(random.randint(0, 2**64 - 1))
@@ -260,75 +498,388 @@ class MemoizedGroup:
         Note: This happens automatically at function import-time if
         fine_grain_persistence is enabled, after function call.
 
+        This is a no-op if nothing has changed since the last commit,
+        or if the group is read_only.
+
         """
         self._index_write(random.randint(0, 2**64 - 1))
 
-    def _index_read(self, call_id: int) -> None:
-        with self._memory_lock, self._index_lock.reader:
-            self._index_read_nolock(call_id)
+    def compact(self) -> None:
+        """Rewrite every shard of the index as one snapshot, deleting its deltas.
+
+        Writes normally compact a shard after ``index_deltas``
+        deltas; this does it now, e.g. before copying the cache.
+
+        """
+        if self._read_only:
+            raise ValueError("Cannot compact a read_only group")
+        call_id = random.randint(0, 2**64 - 1)
+        self._ensure_index_loaded(call_id)
+        with self._memory_lock:
+            self._drain_pending()
+        with perf_ctx("index_write", call_id), self._write_lock:
+            for shard in range(self._index_shards):
+                self._index_write_shard(call_id, shard, compact=True)
+        self._delete_doomed()
+
+    def _shard_range(self, shard: Optional[int]) -> range:
+        return range(self._index_shards) if shard is None else range(shard, shard + 1)
+
+    def _index_read(self, call_id: int, shard: Optional[int] = None) -> None:
+        """Read one shard of the index, or every shard if shard is None."""
+        for this_shard in self._shard_range(shard):
+            if self._read_only:
+                self._index_read_lock_free(call_id, this_shard)
+            else:
+                with self._shards[this_shard].lock.reader:
+                    self._index_read_nolock(call_id, this_shard)
+
+    def _index_read_lock_free(self, call_id: int, shard: int, tries: int = 3) -> None:
+        for _ in range(tries):
+            try:
+                self._index_read_nolock(call_id, shard)
+            except (KeyError, EOFError, pickle.UnpicklingError):
+                # A writer compacted the snapshot or deltas away between reading the header and the blobs,
+                # or the obj_store does not replace objects atomically.
+                # Nothing has been merged yet, so just read the new header.
+                pass
+            else:
+                return
+        # The index kept changing under us, so wait for the writers.
+        with self._shards[shard].lock.reader:
+            self._index_read_nolock(call_id, shard)
+
+    def _ensure_index_loaded(self, call_id: int, shard: Optional[int] = None) -> None:
+        for this_shard in self._shard_range(shard):
+            if not self._shards[this_shard].loaded:
+                # Two threads may both read the shard; the second merge is a no-op.
+                self._index_read(call_id, this_shard)
+
+    def _index_read_nolock(self, call_id: int, shard: int) -> None:
+        """Read one shard of the index, while the caller holds that shard's lock.
 
-    def _index_read_nolock(self, call_id: int) -> None:
-        current_version = self._version
+        The blobs are fetched and unpickled before taking the memory
+        lock; only the merge holds it.
+
+        """
+        index_shard = self._shards[shard]
+        current_version = index_shard.version
+        version = 0
+        snapshot_info: Optional[tuple[int, int]] = None
+        deltas: Tuple[Tuple[int, int], ...] = ()
+        snapshot: Optional[Tuple[Any, ...]] = None
+        delta_states: list[Tuple[Any, ...]] = []
         with perf_ctx("index_read", call_id):
-            if self._index_key in self._obj_store:
-                other_version, other_index, other_rp, other_tc, other_ts = cast(
-                    Tuple[
-                        int,
-                        Index[Any, Entry],
-                        ReplacementPolicy,
-                        DefaultDict[str, datetime.timedelta],
-                        DefaultDict[str, datetime.timedelta],
-                    ],
-                    self._pickler.loads(self._obj_store[self._index_key]),
-                )
-                # TODO: catch the case where this is unpicklable or does not exist.
-                if other_version > current_version:
-                    self._version = other_version
-                    self._index.update(other_index)
-                    self._replacement_policy.update(other_rp)
-                    self.time_cost = other_tc
-                    self.time_saved = other_ts
+            header_ser = self._obj_store.get(index_shard.key, None)
+            if header_ser is not None:
+                # TODO: catch the case where this is unpicklable.
+                header = cast(Tuple[Any, ...], self._pickler.loads(header_ser))
+                if len(header) == 5:
+                    # A full index, written by a version without deltas.
+                    version = header[0]
+                    if version > current_version:
+                        snapshot = header
+                else:
+                    version, snapshot_version, snapshot_key, deltas = cast(
+                        Tuple[int, int, int, Tuple[Tuple[int, int], ...]], header
+                    )
+                    snapshot_info = (snapshot_version, snapshot_key)
+                    if version > current_version:
+                        if snapshot_version > current_version:
+                            snapshot = self._pickler.loads(self._obj_store[snapshot_key])
+                        delta_states = [
+                            self._pickler.loads(self._obj_store[delta_key])
+                            for delta_version, delta_key in deltas
+                            if delta_version > current_version
+                        ]
+            with self._memory_lock:
+                if version > index_shard.version:
+                    if snapshot is not None:
+                        self._merge_snapshot(snapshot)
+                    for delta_state in delta_states:
+                        self._merge_delta(index_shard, delta_state)
+                    index_shard.version = version
+                if version >= index_shard.version:
+                    index_shard.snapshot, index_shard.deltas = snapshot_info, deltas
+                index_shard.loaded = True
+        deltas_read = len(delta_states)
         if ops_logger.isEnabledFor(logging.DEBUG):
             ops_logger.debug(
-                json.dumps(
+                _dumps(
                     {
                         "pid": os.getpid(),
                         "tid": threading.get_native_id(),
                         "event": "index_read",
+                        "shard": shard,
                         "old_version": current_version,
-                        "self._version": self._version,
+                        "self._version": index_shard.version,
+                        "deltas_read": deltas_read,
                         "call_id": call_id,
                     }
                 )
             )
 
+    def _merge_snapshot(self, snapshot: Tuple[Any, ...]) -> None:
+        _, other_index, other_rp, other_tc, other_ts = cast(
+            Tuple[
+                int,
+                Union[Index[Any, Entry], FlatIndex[Any, Entry]],
+                ReplacementPolicy,
+                Mapping[str, datetime.timedelta],
+                Mapping[str, datetime.timedelta],
+            ],
+            snapshot,
+        )
+        # The policy goes first, so entries which the index rejects get invalidated from it.
+        self._replacement_policy.update(other_rp)
+        self._index.update(other_index)
+        self.time_cost.update(other_tc)
+        self.time_saved.update(other_ts)
+
+    def _merge_delta(self, index_shard: _IndexShard, delta: Tuple[Any, ...]) -> None:
+        changed, deleted, other_tc, other_ts = cast(
+            Tuple[
+                FlatIndex[Any, Entry],
+                Tuple[Any, ...],
+                Mapping[str, datetime.timedelta],
+                Mapping[str, datetime.timedelta],
+            ],
+            delta,
+        )
+        self._index.update(changed)
+        for key, _ in changed.items():
+            entry = self._index.get(key, None)
+            if entry is not None:
+                # Deltas do not carry the policy's state; count the peer's store or access as an access now.
+                self._replacement_policy.access(key, entry)
+        for key in deleted:
+            entry = self._index.get(key, None)
+            if entry is not None and key not in index_shard.touched:
+                # The peer already deleted the object.
+                del self._index[key]
+                self._replacement_policy.invalidate(key, entry)
+        self.time_cost.update(other_tc)
+        self.time_saved.update(other_ts)
+
     def _index_write(self, call_id: int) -> None:
-        with perf_ctx("index_write", call_id), self._memory_lock, self._index_lock.writer:
-            self._index_read_nolock(call_id)
-            self._evict(call_id)
-            self._version += 1
-            self._obj_store[self._index_key] = self._pickler.dumps(
-                (
-                    self._version,
-                    self._index,
-                    self._replacement_policy,
-                    self.time_cost,
-                    self.time_saved,
+        if self._read_only:
+            return
+        with self._memory_lock:
+            self._drain_pending()
+            if not self._dirty:
+                # Avoid taking the writer lock when there is nothing to write.
+                return
+        # Eviction needs every shard. Read them now, before holding any writer lock,
+        # so that two processes writing different shards cannot deadlock.
+        self._ensure_index_loaded(call_id)
+        with perf_ctx("index_write", call_id), self._write_lock:
+            # Only the dirty shards get written, but eviction may dirty other shards.
+            written: set[int] = set()
+            while True:
+                to_write = [
+                    shard
+                    for shard, index_shard in enumerate(self._shards)
+                    if index_shard.dirty and shard not in written
+                ]
+                if not to_write:
+                    break
+                for shard in to_write:
+                    self._index_write_shard(call_id, shard)
+                    written.add(shard)
+            with self._memory_lock:
+                self._new_entries = 0
+                self._last_write = time.monotonic()
+        # Now that the index no longer refers to them.
+        self._delete_doomed()
+
+    def _index_write_shard(self, call_id: int, shard: int, compact: bool = False) -> None:
+        index_shard = self._shards[shard]
+        with index_shard.lock.writer:
+            self._index_read_nolock(call_id, shard)
+            with self._memory_lock:
+                self._evict(call_id)
+                version = index_shard.version + 1
+                compact = (
+                    compact
+                    or index_shard.snapshot is None
+                    or len(index_shard.deltas) >= self._index_deltas
                 )
-            )
+                touched, index_shard.touched = index_shard.touched, set()
+                if compact:
+                    # A snapshot refers to the live index, so it has to be pickled under the lock.
+                    blob = self._pickler.dumps(self._shard_state(shard, version))
+                else:
+                    # A delta is a copy, so it can be pickled after releasing the lock.
+                    delta_state = self._delta_state(shard, touched)
+            try:
+                if not compact:
+                    blob = self._pickler.dumps(delta_state)
+                blob_key = cast(
+                    int, self._freeze(("charmonium.cache index", index_shard.key, version))
+                )
+                self._obj_store[blob_key] = blob
+                old_blob_keys = []
+                if compact:
+                    if index_shard.snapshot is not None:
+                        old_blob_keys.append(index_shard.snapshot[1])
+                    old_blob_keys.extend(delta_key for _, delta_key in index_shard.deltas)
+                    snapshot = (version, blob_key)
+                    deltas: tuple[tuple[int, int], ...] = ()
+                else:
+                    assert index_shard.snapshot is not None
+                    snapshot = index_shard.snapshot
+                    deltas = index_shard.deltas + ((version, blob_key),)
+                # The header is written last, so readers never see blobs that do not exist yet.
+                self._obj_store[index_shard.key] = self._pickler.dumps(
+                    (version, *snapshot, deltas)
+                )
+            except BaseException:
+                with self._memory_lock:
+                    index_shard.touched |= touched
+                raise
+            with self._memory_lock:
+                index_shard.version = version
+                index_shard.snapshot, index_shard.deltas = snapshot, deltas
+            delete_many(self._obj_store, old_blob_keys)
         if ops_logger.isEnabledFor(logging.DEBUG):
             ops_logger.debug(
-                json.dumps(
+                _dumps(
                     {
                         "pid": os.getpid(),
                         "tid": threading.get_native_id(),
                         "event": "index_write",
-                        "self._version": self._version,
+                        "shard": shard,
+                        "compact": compact,
+                        "self._version": index_shard.version,
                         "call_id": call_id,
                     }
                 )
             )
 
+    def _shard_state(self, shard: int, version: int) -> tuple[Any, ...]:
+        """The full state of one shard, as (version, index, replacement_policy, time_cost, time_saved)."""
+        if self._index_shards == 1:
+            return (
+                version,
+                self._index,
+                self._replacement_policy,
+                self.time_cost,
+                self.time_saved,
+            )
+        else:
+            def in_shard(key: Any, entry: Entry) -> bool:  # pylint: disable=unused-argument
+                return self._shard_of_key(key) == shard
+
+            return (
+                version,
+                self._index.filter(in_shard),
+                self._replacement_policy.filter(in_shard),
+                *self._shard_times(shard),
+            )
+
+    def _delta_state(self, shard: int, touched: set[Any]) -> tuple[Any, ...]:
+        """The changes to one shard since the last write, as (changed, deleted, time_cost, time_saved)."""
+        return (
+            self._index.subset(touched),
+            tuple(key for key in touched if key not in self._index),
+            *(dict(times) for times in self._shard_times(shard)),
+        )
+
+    def _shard_times(
+        self, shard: int
+    ) -> tuple[Mapping[str, datetime.timedelta], Mapping[str, datetime.timedelta]]:
+        if self._index_shards == 1:
+            return self.time_cost, self.time_saved
+        else:
+            return (
+                {
+                    name: time_cost
+                    for name, time_cost in self.time_cost.items()
+                    if self._shard_of_name(name) == shard
+                },
+                {
+                    name: time_saved
+                    for name, time_saved in self.time_saved.items()
+                    if self._shard_of_name(name) == shard
+                },
+            )
+
+    def _record(
+        self,
+        name: str,
+        saved: datetime.timedelta = datetime.timedelta(),
+        cost: datetime.timedelta = datetime.timedelta(),
+        accessed: Optional[tuple[Any, Entry]] = None,
+    ) -> None:
+        """Record the bookkeeping of a call without taking the memory lock.
+
+        It gets applied to ``time_saved``, ``time_cost``, and the
+        replacement policy by :py:meth:`_drain_pending`, before the
+        index is evicted or written.
+
+        """
+        self._pending.append((name, saved, cost, accessed))
+        if len(self._pending) >= 1024:
+            with self._memory_lock:
+                self._drain_pending()
+
+    def _drain_pending(self) -> None:
+        """Apply the recorded bookkeeping, while the caller holds the memory lock."""
+        while self._pending:
+            name, saved, cost, accessed = self._pending.popleft()
+            self.time_saved[name] += saved
+            self.time_cost[name] += cost
+            if accessed is not None:
+                key, entry = accessed
+                if key in self._index:
+                    self._replacement_policy.access(key, entry)
+                    self._mark_dirty(key)
+
+    def _stored_entry(self, key: tuple[Any, ...]) -> None:
+        self._mark_dirty(key)
+        self._new_entries += 1
+        # A forked child inherits the parent's persister, but not its thread.
+        if (self._persister is None or not self._persister.is_alive()) and (
+            self._persistence_interval is not None or self._persistence_entries is not None
+        ):
+            self._persister = threading.Thread(
+                target=self._persist_loop, name="charmonium.cache persister", daemon=True
+            )
+            self._persister.start()
+        if self._persistence_entries is not None and self._new_entries >= self._persistence_entries:
+            self._persist_event.set()
+
+    def _persist_loop(self) -> None:
+        while True:
+            with self._memory_lock:
+                remaining = (
+                    self._persistence_interval.total_seconds()
+                    - (time.monotonic() - self._last_write)
+                    if self._persistence_interval is not None
+                    else None
+                )
+            if remaining is None or remaining > 0:
+                self._persist_event.wait(remaining)
+            self._persist_event.clear()
+            with self._memory_lock:
+                due = (
+                    self._persistence_interval is not None
+                    and time.monotonic() - self._last_write
+                    >= self._persistence_interval.total_seconds()
+                ) or (
+                    self._persistence_entries is not None
+                    and self._new_entries >= self._persistence_entries
+                )
+                if due and not self._dirty:
+                    # Nothing to write; restart the interval.
+                    self._last_write = time.monotonic()
+            if due:
+                try:
+                    self._index_write(random.randint(0, 2**64 - 1))
+                except Exception:  # pylint: disable=broad-except
+                    # There is no caller to propagate to; the next commit will try again.
+                    ops_logger.exception("Background index write failed")
+
     def _system_state(self) -> Any:
         """Functions are deterministic with (global state, function-specific state, args key, args version).
 
@@ -336,8 +887,7 @@ class MemoizedGroup:
           - Package version
 
         """
-        with self._memory_lock:
-            return (__version__,) + none_tuple(self._extra_system_state())
+        return (__version__,) + none_tuple(self._extra_system_state())
 
     def evict(self) -> None:
         """If the size of the cache is greater than ``self._size``, use ``self._replacement_policy``.
@@ -348,45 +898,81 @@ class MemoizedGroup:
 
         """
         self._evict(random.randint(0, 2**64 - 1))
+        self._delete_doomed()
 
     def _evict(self, call_id: int) -> None:
+        """Evict entries from the index; the caller deletes their objects with :py:meth:`_delete_doomed`."""
+        if self._read_only:
+            return
+        self._ensure_index_loaded(call_id)
         with self._memory_lock:
-            total_size: bitmath.Bitmath = bitmath.Byte(0)
+            self._drain_pending()
+            total_size = 0
+            # Memoized functions are identified by their frozen name, which is the second level of the index.
+            func_sizes = DefaultDict[Any, int](int)
 
             for key, entry in self._index.items():
                 # heapq.heappush(heap, (self._eval_func(entry), key, entry))
                 total_size += entry.data_size
+                func_sizes[key[1]] += entry.data_size
+
+            for func, quota in self._frozen_names(self._function_quotas).items():
+                while func_sizes[func] > quota:
+                    key, entry = self._replacement_policy.evict(
+                        lambda key, entry: key[1] == func,  # pylint: disable=cell-var-from-loop
+                        # Evicting for one function's quota should not age the rest of the cache.
+                        age=False,
+                    )
+                    total_size -= entry.data_size
+                    func_sizes[func] -= entry.data_size
+                    self._evict_entry(key, entry, total_size, call_id)
 
+            reservations = self._frozen_names(self._function_reservations)
             while total_size > self._size:
-                key, entry = self._replacement_policy.evict()
-                if entry.obj_store:
-                    obj_key = cast(int, freeze(key, self._freeze_config))
-                    assert (
-                        obj_key in self._obj_store
-                    ), "Replacement policy tried to evict something that wasn't there"
-                    del self._obj_store[obj_key]
-                else:
-                    obj_key = None
-                total_size -= entry.data_size
-                if ops_logger.isEnabledFor(logging.DEBUG):
-                    ops_logger.debug(
-                        json.dumps(
-                            {
-                                "pid": os.getpid(),
-                                "tid": threading.get_native_id(),
-                                "event": "evict",
-                                "key": key,
-                                "obj_key": obj_key,
-                                "entry.data_size": entry.data_size.bytes,
-                                "new_total_size": (total_size - entry.data_size).bytes,
-                                "call_id": call_id,
-                            }
-                        )
+                key, entry = self._replacement_policy.evict(
+                    (
+                        lambda key, entry: func_sizes[key[1]]
+                        > reservations.get(key[1], 0)
                     )
-                del self._index[key]
+                    if reservations
+                    else None
+                )
+                total_size -= entry.data_size
+                func_sizes[key[1]] -= entry.data_size
+                self._evict_entry(key, entry, total_size, call_id)
 
-    def remove_orphans(self) -> None:
-        """Remove data in the objstore that are not referenced by the index.
+    def _frozen_names(self, sizes: Mapping[str, int]) -> dict[Any, int]:
+        return {self._freeze(name): size for name, size in sizes.items()}
+
+    def _evict_entry(
+        self, key: Any, entry: Entry, total_size: int, call_id: int
+    ) -> None:
+        global_metrics.increment(self._func_names.get(key[1], ""), "evictions")
+        if entry.obj_store:
+            obj_key = cast(int, self._freeze(key))
+            self._doomed.append(obj_key)
+        else:
+            obj_key = None
+        self._mark_dirty(key)
+        if ops_logger.isEnabledFor(logging.DEBUG):
+            ops_logger.debug(
+                _dumps(
+                    {
+                        "pid": os.getpid(),
+                        "tid": threading.get_native_id(),
+                        "event": "evict",
+                        "key": key,
+                        "obj_key": obj_key,
+                        "entry.data_size": entry.data_size,
+                        "new_total_size": total_size,
+                        "call_id": call_id,
+                    }
+                )
+            )
+        del self._index[key]
+
+    def remove_orphans(self) -> int:
+        """Remove data in the objstore that are not referenced by the index, and return how many.
 
         Orphans can accumulate if there are multiple processes. They
         might generate orphans if they crash or if there is a bug in
@@ -400,24 +986,104 @@ class MemoizedGroup:
         keep. I recommend calling this before you fork off processes.
 
         """
+        if self._read_only:
+            raise ValueError("Cannot remove orphans from a read_only group")
+        # Read every shard, to learn which snapshot and delta blobs are current.
+        self._index_read(random.randint(0, 2**64 - 1))
         with self._memory_lock:
             found_obj_keys = {
-                entry.value for _, entry in self._index.items() if entry.obj_store
+                cast(int, self._freeze(key))
+                for key, entry in self._index.items()
+                if entry.obj_store
             }
-            for obj_key in self._obj_store:
-                if obj_key not in found_obj_keys:
-                    if ops_logger.isEnabledFor(logging.DEBUG):
-                        ops_logger.debug(
-                            json.dumps(
-                                {
-                                    "pid": os.getpid(),
-                                    "tid": threading.get_native_id(),
-                                    "event": "remove_orphan",
-                                    "obj_key": obj_key,
-                                }
-                            )
-                        )
-                    del self._obj_store[obj_key]
+            for index_shard in self._shards:
+                found_obj_keys.add(index_shard.key)
+                if index_shard.snapshot is not None:
+                    found_obj_keys.add(index_shard.snapshot[1])
+                found_obj_keys.update(delta_key for _, delta_key in index_shard.deltas)
+            orphans = [obj_key for obj_key in self._obj_store if obj_key not in found_obj_keys]
+        if ops_logger.isEnabledFor(logging.DEBUG):
+            for obj_key in orphans:
+                ops_logger.debug(
+                    _dumps(
+                        {
+                            "pid": os.getpid(),
+                            "tid": threading.get_native_id(),
+                            "event": "remove_orphan",
+                            "obj_key": obj_key,
+                        }
+                    )
+                )
+        delete_many(self._obj_store, orphans)
+        return len(orphans)
+
+
+_excepthook_groups: list[weakref.ref[MemoizedGroup]] = []
+
+
+def _commit_on_excepthook(group: MemoizedGroup) -> None:
+    """Commit ``group`` before the process crashes from an uncaught exception."""
+    if not _excepthook_groups:
+        prev_excepthook = sys.excepthook
+
+        def excepthook(*args: Any) -> None:
+            for group_ref in _excepthook_groups:
+                live_group = group_ref()
+                if live_group is not None:
+                    try:
+                        live_group.commit()
+                    except Exception:  # pylint: disable=broad-except
+                        # Don't hide the original exception.
+                        pass
+            prev_excepthook(*args)
+
+        sys.excepthook = excepthook
+    _excepthook_groups[:] = [
+        group_ref for group_ref in _excepthook_groups if group_ref() is not None
+    ]
+    _excepthook_groups.append(weakref.ref(group))
+
+
+_fork_groups: list[weakref.ref[MemoizedGroup]] = []
+_forking: list[MemoizedGroup] = []
+
+
+def _before_fork() -> None:
+    """Wait for background index writes, so a forked child does not inherit their locks held by a thread it does not have."""
+    # pylint: disable=protected-access
+    for group_ref in list(_fork_groups):
+        group = group_ref()
+        if group is None:
+            continue
+        group._write_lock.__enter__()
+        group._memory_lock.__enter__()
+        _forking.append(group)
+
+
+def _after_fork_in_parent() -> None:
+    # pylint: disable=protected-access
+    while _forking:
+        group = _forking.pop()
+        group._memory_lock.__exit__(None, None, None)
+        group._write_lock.__exit__(None, None, None)
+
+
+def _after_fork_in_child() -> None:
+    # pylint: disable=protected-access
+    while _forking:
+        group = _forking.pop()
+        group._memory_lock.__exit__(None, None, None)
+        group._write_lock.__exit__(None, None, None)
+        # The persister did not survive the fork (see _stored_entry); it may have been waiting on this event.
+        group._persist_event = threading.Event()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(
+        before=_before_fork,
+        after_in_parent=_after_fork_in_parent,
+        after_in_child=_after_fork_in_child,
+    )
 
 
 DEFAULT_MEMOIZED_GROUP = Future[MemoizedGroup].create(
@@ -494,16 +1160,32 @@ class Memoized(Generic[FuncParams, FuncReturn]):
         # functools.update_wrapper(self, self.func)
 
     def log_usage_report(self) -> None:
-        with self.group._memory_lock:  # pylint: disable=protected-access
+        # pylint: disable=protected-access
+        self.group._ensure_index_loaded(
+            random.randint(0, 2**64 - 1), self.group._shard_of_name(self.name)
+        )
+        with self.group._memory_lock:
+            self.group._drain_pending()
             tc = self.group.time_cost[self.name]
             ts = self.group.time_saved[self.name]
         print(
             f"Caching {self.name}: "
-            f"cost {tc.total_seconds():.1f}s, "
-            f"saved {ts.total_seconds():.1f}s, "
-            f"net saved {(ts - tc).total_seconds():.1f}s",
+            f"cost {format_duration(tc.total_seconds())}, "
+            f"saved {format_duration(ts.total_seconds())}, "
+            f"net saved {format_duration((ts - tc).total_seconds())}",
             file=sys.stderr,
         )
+        histograms, counters = global_metrics.snapshot()
+        lock_reports = [
+            f"{lock} waited {format_duration(histograms[('', f'{lock}_wait')].total_ns / 1e9)} "
+            f"over {counters.get(('', f'{lock}_acquisitions'), 0)} acquisitions "
+            f"({counters.get(('', f'{lock}_contended'), 0)} contended)"
+            for lock in ["index_lock_reader", "index_lock_writer", "write_lock", "memory_lock"]
+            if ("", f"{lock}_wait") in histograms
+        ]
+        if lock_reports:
+            # The locks are shared by every function (and every group) in this process.
+            print(f"Caching locks (all functions): {', '.join(lock_reports)}", file=sys.stderr)
 
     @property
     def _pickler(self) -> Pickler:
@@ -575,54 +1257,46 @@ class Memoized(Generic[FuncParams, FuncReturn]):
         **kwargs: FuncParams.kwargs,
     ) -> tuple[Entry, FuncReturn]:
 
-        start = datetime.datetime.now()
-        value = self.func(*args, **kwargs)
+        start = time.perf_counter_ns()
+        try:
+            value = self.func(*args, **kwargs)
+        except BaseException:
+            global_sampler.discard(call_id)
+            raise
 
-        mid = datetime.datetime.now()
+        mid = time.perf_counter_ns()
 
-        if self._use_obj_store:
+        if self.group._read_only:  # pylint: disable=protected-access
+            # The value will not be stored, so don't bother serializing it.
+            stored_value = value
+            data_size = 0
+        elif self._use_obj_store:
             stored_value = None
             value_ser = self._pickler.dumps(value)
-            data_size = bitmath.Byte(len(value_ser))
+            data_size = len(value_ser)
+            global_metrics.increment(self.name, "bytes_stored", data_size)
             # Group is a "friend class", hence pylint disable
 
-            with perf_ctx("obj_store", call_id):
+            with perf_ctx("obj_store", call_id, self.name):
                 self.group._obj_store[  # pylint: disable=protected-access
                     obj_key
                 ] = value_ser
         else:
             stored_value = value
-            data_size = bitmath.Byte(0)
+            data_size = 0
 
-        stop = datetime.datetime.now()
+        stop = time.perf_counter_ns()
 
         # TODO: cache stdout?
 
-        if perf_logger.isEnabledFor(logging.DEBUG):
-            perf_logger.debug(
-                json.dumps(
-                    {
-                        "event": "serialize",
-                        "call_id": call_id,
-                        "duration": (stop - mid).total_seconds(),
-                    }
-                )
-            )
-            perf_logger.debug(
-                json.dumps(
-                    {
-                        "event": "inner_function",
-                        "call_id": call_id,
-                        "duration": (mid - start).total_seconds(),
-                    }
-                )
-            )
+        _perf_event(self.name, "serialize", call_id, stop - mid)
+        _perf_event(self.name, "inner_function", call_id, mid - start)
 
         return (
             Entry(
                 data_size=data_size,
-                function_time=mid - start,
-                serialization_time=stop - mid,
+                function_time=(mid - start) / 1e9,
+                serialization_time=(stop - mid) / 1e9,
                 value=stored_value,
                 obj_store=self._use_obj_store,
             ),
@@ -634,7 +1308,7 @@ class Memoized(Generic[FuncParams, FuncReturn]):
         return self.func
 
     def _try_unpickle(self, value_ser: bytes, call_id: int) -> Tuple[bool, Optional[FuncReturn]]:
-        with perf_ctx("deserialize", call_id):
+        with perf_ctx("deserialize", call_id, self.name):
             try:
                 value = cast(FuncReturn, self._pickler.loads(value_ser))
             except (EOFError, pickle.UnpicklingError):
@@ -645,8 +1319,9 @@ class Memoized(Generic[FuncParams, FuncReturn]):
     def __call__(
         self, *args: FuncParams.args, **kwargs: FuncParams.kwargs
     ) -> FuncReturn:
-        call_start = datetime.datetime.now()
+        call_start = time.perf_counter_ns()
         call_id = random.randint(0, 2**64 - 1)
+        sampled = global_sampler.start(call_id)
 
         key, entry, obj_key, value_ser = self._would_hit(call_id, *args, **kwargs)
 
@@ -661,7 +1336,7 @@ class Memoized(Generic[FuncParams, FuncReturn]):
 
         if ops_logger.isEnabledFor(logging.DEBUG):
             ops_logger.debug(
-                json.dumps(
+                _dumps(
                     {
                         "pid": os.getpid(),
                         "tid": threading.get_native_id(),
@@ -684,50 +1359,69 @@ class Memoized(Generic[FuncParams, FuncReturn]):
             assert entry is not None
             assert value is not None
 
-        with self.group._memory_lock:
-            if hit:
-                # Update time_saved
-                self.group.time_saved[self.name] += entry.function_time
-                self.group._replacement_policy.access(key, entry)
-            else:
-                # Do the store
-                if self._use_metadata_size:
-                    if not self._use_obj_store:
-                        entry.data_size += bitmath.Byte(
-                            len(self.group._pickler.dumps(entry))
-                        )
-                    entry.data_size += bitmath.Byte(len(self.group._pickler.dumps(key)))
+        if hit:
+            # A hit does not take the memory lock; the access and time_saved are applied later.
+            self.group._record(
+                self.name,
+                saved=datetime.timedelta(seconds=entry.function_time),
+                accessed=(key, entry) if self.group._persist_access_times else None,
+            )
+        elif not self.group._read_only:
+            # Do the store
+            if self._use_metadata_size:
+                if not self._use_obj_store:
+                    entry.data_size += len(self.group._pickler.dumps(entry))
+                entry.data_size += len(self.group._pickler.dumps(key))
+            with self.group._memory_lock:
                 self.group._index[key] = entry
                 self.group._replacement_policy.add(key, entry)
+                self.group._stored_entry(key)
 
-            # Update time_cost
-            if self.group._fine_grain_eviction:
-                self.group._evict(call_id)
+        if self.group._fine_grain_eviction:
+            self.group._evict(call_id)
 
-            if self.group._fine_grain_persistence:
-                self.group._index_write(call_id)
+        if self.group._fine_grain_persistence:
+            self.group._index_write(call_id)
 
-            call_stop = datetime.datetime.now()
-            time_cost_inevitable = (
-                datetime.timedelta(seconds=0) if hit else entry.function_time
-            )
-            # time-cost is the overhead of caching, so  it should exclud ethe overhead of the function.
-            self.group.time_cost[self.name] += (
-                call_stop - call_start - time_cost_inevitable
+        # Objects of entries which this call replaced or evicted.
+        self.group._delete_doomed()
+
+        # Update time_cost
+        call_stop = time.perf_counter_ns()
+        time_cost_inevitable = 0 if hit else int(entry.function_time * 1e9)
+        # time-cost is the overhead of caching, so  it should exclud ethe overhead of the function.
+        self.group._record(
+            self.name,
+            cost=datetime.timedelta(microseconds=(call_stop - call_start - time_cost_inevitable) / 1e3),
+        )
+        global_metrics.increment(self.name, "hits" if hit else "misses")
+        if hit and value_ser is not None:
+            global_metrics.increment(self.name, "bytes_read", len(value_ser))
+        global_metrics.observe(self.name, "outer_function", call_stop - call_start)
+        if sampled:
+            global_sampler.finish(
+                call_id,
+                self.name,
+                hit,
+                call_stop - call_start,
+                args,
+                kwargs,
+                (len(value_ser) if value_ser is not None else None) if hit else entry.data_size,
             )
 
-            tc = self.group.time_cost[self.name]
-            ts = self.group.time_saved[self.name]
+        # These may not include the most recent calls, which is fine for a warning.
+        tc = self.group.time_cost.get(self.name, datetime.timedelta())
+        ts = self.group.time_saved.get(self.name, datetime.timedelta())
 
         if perf_logger.isEnabledFor(logging.DEBUG):
             perf_logger.debug(
-                json.dumps(
+                _dumps(
                     {
                         "name": self.name,
                         "event": "outer_function",
                         "call_id": call_id,
                         "hit": hit,
-                        "duration": (call_stop - call_start).total_seconds(),
+                        "duration": (call_stop - call_start) / 1e9,
                     }
                 )
             )
@@ -751,7 +1445,7 @@ class Memoized(Generic[FuncParams, FuncReturn]):
 
         """
 
-        call_start = datetime.datetime.now()
+        call_start = time.perf_counter_ns()
         call_id = random.randint(0, 2**64 - 1)
         key, entry, obj_key, value_ser = self._would_hit(call_id, *args, **kwargs)
         hit, value = False, None
@@ -761,16 +1455,16 @@ class Memoized(Generic[FuncParams, FuncReturn]):
                     hit, value = self._try_unpickle(value_ser, call_id)
             else:
                 hit, value = True, cast(FuncReturn, entry.value)
-        call_stop = datetime.datetime.now()
+        call_stop = time.perf_counter_ns()
         if perf_logger.isEnabledFor(logging.DEBUG):
             perf_logger.debug(
-                json.dumps(
+                _dumps(
                     {
                         "name": self.name,
                         "event": "outer_function",
                         "call_id": call_id,
                         "hit": hit,
-                        "duration": (call_stop - call_start).total_seconds(),
+                        "duration": (call_stop - call_start) / 1e9,
                     }
                 )
             )
@@ -782,7 +1476,7 @@ class Memoized(Generic[FuncParams, FuncReturn]):
         would_hit = entry is not None and (not entry.obj_store or value_ser is not None)
         if ops_logger.isEnabledFor(logging.DEBUG):
             ops_logger.debug(
-                json.dumps(
+                _dumps(
                     {
                         "pid": os.getpid(),
                         "tid": threading.get_native_id(),
@@ -805,7 +1499,10 @@ class Memoized(Generic[FuncParams, FuncReturn]):
         call_id = random.randint(0, 2**64 - 1)
         key, entry, obj_key, value_ser = self._would_hit(call_id, *args, **kwargs)
         if entry is not None:
+            with self.group._memory_lock:
+                del self.group._index[key]
             self.group._deleter((key, entry))
+            self.group._delete_doomed()
         assert not self.would_hit(*args, **kwargs)
 
     def _would_hit(
@@ -813,26 +1510,32 @@ class Memoized(Generic[FuncParams, FuncReturn]):
     ) -> Tuple[Tuple[Any, ...], Optional[Entry], int, Optional[bytes]]:
         # pylint: disable=protected-access
 
-        with perf_ctx("hash", call_id):
+        with perf_ctx("hash", call_id, self.name):
             # Note that the system state and name or so small already, it isn't worth hashing them.
             # They are also used by other Memoized functions in the same MemoizedGroup.
             # We will only hash the potentially large key items that are used exclusively by this Memoized function.
             key = (
                 # Group is a friend class, hence type ignore
-                freeze(
-                    self.group._system_state(), self.group._freeze_config
-                ),  # pylint: disable=protected-access
-                freeze(self.name, self.group._freeze_config),
-                freeze(self._func_state(), self.group._freeze_config),
-                freeze(self._args2key(*args, **kwargs), self.group._freeze_config),
-                freeze(self._args2ver(*args, **kwargs), self.group._freeze_config),
+                self.group._freeze(self.group._system_state()),
+                self.group._freeze(self.name),
+                self.group._freeze(self._func_state()),
+                self.group._freeze(self._args2key(*args, **kwargs)),
+                self.group._freeze(self._args2ver(*args, **kwargs)),
             )
-            obj_key = cast(int, freeze(key, self.group._freeze_config))
-        with self.group._memory_lock:
-            if self.group._fine_grain_persistence:
-                self.group._index_read(call_id)
-            entry = self.group._index.get(key, None)
-        value_ser = self.group._obj_store.get(obj_key, None) if self._use_obj_store else None
+            obj_key = cast(int, self.group._freeze(key))
+        self.group._func_names[key[1]] = self.name
+        shard = self.group._shard_of_key(key)
+        if self.group._fine_grain_persistence:
+            self.group._index_read(call_id, shard)
+        else:
+            self.group._ensure_index_loaded(call_id, shard)
+        # This is a single dict lookup, which is atomic, so it does not need the memory lock.
+        entry = self.group._index.get(key, None)
+        if self._use_obj_store:
+            with perf_ctx("obj_load", call_id, self.name):
+                value_ser = self.group._obj_store.get(obj_key, None)
+        else:
+            value_ser = None
         return (
             key,
             entry,
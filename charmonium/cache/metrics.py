@@ -0,0 +1,432 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import itertools
+import os
+import sys
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Any, Mapping, Optional, Sequence, TextIO, Union
+
+from .util import ellipsize, format_duration
+
+perf_logger = logging.getLogger("charmonium.cache.perf")
+sample_logger = logging.getLogger("charmonium.cache.samples")
+
+# The overhead of a call, in the order it happens; see Memoized.__call__.
+REPORT_EVENTS = ("hash", "obj_load", "deserialize", "serialize", "obj_store")
+
+# Group-level events, which are shared by every function.
+REPORT_GROUP_EVENTS = (
+    "index_read",
+    "index_write",
+    "index_lock_reader_wait",
+    "index_lock_writer_wait",
+    "write_lock_wait",
+    "memory_lock_wait",
+)
+
+# Buckets are powers of two nanoseconds, so bucket 63 (about 292 years) is plenty.
+N_BUCKETS = 64
+
+
+class Histogram:
+    """A count, sum, max, and power-of-two histogram of durations in nanoseconds.
+
+    Observing is a few integer operations, so it can stay on in production.
+
+    """
+
+    __slots__ = ("count", "total_ns", "max_ns", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        # buckets[i] counts durations in [2**(i-1), 2**i) ns.
+        self.buckets = [0] * N_BUCKETS
+
+    def observe(self, duration_ns: int) -> None:
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        self.buckets[min(max(duration_ns, 0).bit_length(), N_BUCKETS - 1)] += 1
+
+    def merge(self, other: Histogram) -> None:
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+        for bucket, count in enumerate(other.buckets):
+            self.buckets[bucket] += count
+
+    def copy(self) -> Histogram:
+        histogram = Histogram()
+        histogram.merge(self)
+        return histogram
+
+    def quantile(self, quantile: float) -> int:
+        """An upper bound (within a factor of 2) on the ``quantile`` duration in nanoseconds."""
+        target = quantile * self.count
+        cumulative = 0
+        for bucket, count in enumerate(self.buckets):
+            cumulative += count
+            if count and cumulative >= target:
+                return min(1 << bucket, self.max_ns)
+        return self.max_ns
+
+    def compact(self) -> list[Any]:
+        """``[count, total_ns, max_ns, {bucket: count}]``, omitting empty buckets."""
+        return [
+            self.count,
+            self.total_ns,
+            self.max_ns,
+            {bucket: count for bucket, count in enumerate(self.buckets) if count},
+        ]
+
+
+class _Buffer:
+    """One thread's observations since they were last merged into the totals of a :py:class:`Metrics`."""
+
+    __slots__ = ("lock", "thread", "histograms", "counters", "events")
+
+    def __init__(self) -> None:
+        # Only contended while the totals are being merged.
+        self.lock = threading.Lock()
+        self.thread = threading.current_thread()
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        self.counters: dict[tuple[str, str], int] = {}
+        self.events = 0
+
+
+_all_metrics: weakref.WeakSet[Metrics] = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for metrics in list(_all_metrics):
+        metrics._after_fork_in_child()  # pylint: disable=protected-access
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class Metrics:
+    """Per-function counters and duration histograms, aggregated in memory.
+
+    Durations come from :py:func:`time.perf_counter_ns`. Both are
+    keyed by ``(function name, event)``; group-level events (e.g.
+    ``index_read``) use the function name ``""``.
+
+    Each thread records into its own buffer, so that threads do not
+    contend on every event; a thread drains its buffer into the totals
+    every ``drain_events`` events, and :py:meth:`snapshot` merges
+    every buffer.
+
+    The totals are cumulative. Every ``flush_interval`` seconds
+    (checked when a thread drains its buffer, and at exit), they are
+    logged as one line of JSON at INFO level to the
+    ``charmonium.cache.perf`` logger, if it is enabled for INFO.
+
+    """
+
+    def __init__(self, flush_interval: float = 60.0, drain_events: int = 256) -> None:
+        self.flush_interval = flush_interval
+        self.drain_events = drain_events
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        self.counters: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._buffers: list[_Buffer] = []
+        self._last_flush = time.monotonic()
+        _all_metrics.add(self)
+
+    def _after_fork_in_child(self) -> None:
+        # Other threads of the parent may have held these; those threads are gone.
+        self._lock = threading.Lock()
+        for buffer in self._buffers:
+            buffer.lock = threading.Lock()
+
+    def _buffer(self) -> _Buffer:
+        buffer: Optional[_Buffer] = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = _Buffer()
+            with self._lock:
+                self._buffers.append(buffer)
+        return buffer
+
+    def observe(self, name: str, event: str, duration_ns: int) -> None:
+        buffer = self._buffer()
+        with buffer.lock:
+            histogram = buffer.histograms.get((name, event))
+            if histogram is None:
+                histogram = buffer.histograms[(name, event)] = Histogram()
+            histogram.observe(duration_ns)
+            buffer.events += 1
+            drain = buffer.events >= self.drain_events
+        if drain:
+            self._drain(buffer)
+
+    def increment(self, name: str, counter: str, amount: int = 1) -> None:
+        buffer = self._buffer()
+        with buffer.lock:
+            buffer.counters[(name, counter)] = buffer.counters.get((name, counter), 0) + amount
+            buffer.events += 1
+            drain = buffer.events >= self.drain_events
+        if drain:
+            self._drain(buffer)
+
+    def _drain(self, buffer: _Buffer) -> None:
+        with self._lock:
+            self._merge(buffer)
+        self._maybe_flush()
+
+    def _merge(self, buffer: _Buffer) -> None:
+        """Move the contents of buffer into the totals, while the caller holds the lock."""
+        with buffer.lock:
+            histograms, counters = buffer.histograms, buffer.counters
+            buffer.histograms, buffer.counters, buffer.events = {}, {}, 0
+        for key, histogram in histograms.items():
+            total = self.histograms.get(key)
+            if total is None:
+                self.histograms[key] = histogram
+            else:
+                total.merge(histogram)
+        for key, count in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + count
+
+    def _merge_all(self) -> None:
+        """Merge every thread's buffer, while the caller holds the lock."""
+        for buffer in self._buffers:
+            self._merge(buffer)
+        # A finished thread records nothing more.
+        self._buffers = [buffer for buffer in self._buffers if buffer.thread.is_alive()]
+
+    def snapshot(self) -> tuple[dict[tuple[str, str], Histogram], dict[tuple[str, str], int]]:
+        """A consistent copy of the histograms and counters."""
+        with self._lock:
+            self._merge_all()
+            return (
+                {key: histogram.copy() for key, histogram in self.histograms.items()},
+                dict(self.counters),
+            )
+
+    def reset(self) -> None:
+        with self._lock:
+            self._merge_all()
+            self.histograms.clear()
+            self.counters.clear()
+
+    def _maybe_flush(self) -> None:
+        if time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self, logger: Optional[logging.Logger] = None) -> None:
+        logger = logger if logger is not None else perf_logger
+        self._last_flush = time.monotonic()
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        histograms, counters = self.snapshot()
+        if not histograms and not counters:
+            return
+        functions: dict[str, dict[str, Any]] = {}
+        for (name, event), histogram in histograms.items():
+            functions.setdefault(name, {})[event] = histogram.compact()
+        for (name, counter), count in counters.items():
+            functions.setdefault(name, {})[counter] = count
+
+        # json is only needed when logging is enabled.
+        import json  # pylint: disable=import-outside-toplevel
+
+        logger.info(
+            json.dumps(
+                {"event": "metrics", "pid": os.getpid(), "functions": functions},
+                separators=(",", ":"),
+            )
+        )
+
+    def report(self) -> str:
+        """A table of the hits, misses, and time spent per function, for humans.
+
+        ``compute`` is the time in the function itself, on misses.
+        ``saved`` estimates the time which hits saved, at the mean
+        compute time. ``overhead`` is the sum of the caching events;
+        the time spent reading and writing the index (and waiting for
+        its locks) is shared between functions, so it is listed after
+        the table.
+
+        """
+        histograms, counters = self.snapshot()
+        names = sorted(
+            {name for name, _ in histograms if name} | {name for name, _ in counters if name}
+        )
+        width = max([len("function"), *(len(name) for name in names)])
+        width = min(width, 60)
+        columns = ["hits", "misses", "hit%", "compute", "saved", *REPORT_EVENTS, "overhead"]
+        lines = [f"{'function':<{width}s} " + " ".join(f"{column:>11s}" for column in columns)]
+        for name in names:
+            hits = counters.get((name, "hits"), 0)
+            misses = counters.get((name, "misses"), 0)
+            compute = histograms.get((name, "inner_function"), Histogram())
+            saved_ns = hits * compute.total_ns // compute.count if compute.count else 0
+            events_ns = [histograms.get((name, event), Histogram()).total_ns for event in REPORT_EVENTS]
+            cells = [
+                str(hits),
+                str(misses),
+                f"{100 * hits / (hits + misses):.0f}%" if hits + misses else "-",
+                format_duration(compute.total_ns / 1e9),
+                format_duration(saved_ns / 1e9),
+                *(format_duration(event_ns / 1e9) for event_ns in events_ns),
+                format_duration(sum(events_ns) / 1e9),
+            ]
+            lines.append(f"{name if len(name) <= width else ellipsize(name, width):<{width}s} " + " ".join(f"{cell:>11s}" for cell in cells))
+        group_events = [
+            f"{event} {format_duration(histograms[('', event)].total_ns / 1e9)} over {histograms[('', event)].count}"
+            for event in REPORT_GROUP_EVENTS
+            if ("", event) in histograms
+        ]
+        if group_events:
+            lines.append("All functions: " + ", ".join(group_events))
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, destination: Union[None, str, Path, TextIO, logging.Logger] = None) -> None:
+        """Write :py:meth:`report` to a file (path or open), or to a logger at INFO, or to stderr if ``None``."""
+        if isinstance(destination, logging.Logger):
+            if destination.isEnabledFor(logging.INFO):
+                destination.info("charmonium.cache run report:\n%s", self.report())
+        elif isinstance(destination, (str, Path)):
+            Path(destination).write_text(self.report())
+        else:
+            (destination if destination is not None else sys.stderr).write(self.report())
+
+    def report_at_exit(self, destination: Union[None, str, Path, TextIO, logging.Logger] = None) -> None:
+        """Call :py:meth:`write_report` at exit."""
+        atexit.register(self.write_report, destination)
+
+
+def approx_size(obj: Any) -> int:
+    """The size of ``obj`` in bytes; ``nbytes`` for arrays, otherwise shallow, without traversing it."""
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(obj)
+
+
+class CallSampler:
+    """Log the breakdown of some calls, as one line of JSON each, to the ``charmonium.cache.samples`` logger at INFO.
+
+    A call is logged if it is one of every ``every`` calls, or if its
+    overhead (its duration, less the time in the function itself)
+    exceeds ``over`` seconds. Unlike logging every event at DEBUG,
+    this is cheap enough to leave on in production. Calls are only
+    broken down while the logger is enabled for INFO and ``every`` or
+    ``over`` is set.
+
+    """
+
+    # Calls which raise are never finished; forget the oldest past this many.
+    max_active = 10000
+
+    def __init__(
+        self,
+        every: int = 0,
+        over: Optional[float] = None,
+        logger: logging.Logger = sample_logger,
+    ) -> None:
+        self.every = every
+        self.over = over
+        self.logger = logger
+        # call_id -> (sampled, [(event, duration_ns)]) of the calls being broken down.
+        self.active: dict[int, tuple[bool, list[tuple[str, int]]]] = {}
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, call_id: int) -> bool:
+        """Whether to break down this call; if so, call :py:meth:`finish` or :py:meth:`discard` after."""
+        if not (self.every or self.over is not None) or not self.logger.isEnabledFor(logging.INFO):
+            return False
+        sampled = bool(self.every) and next(self._counter) % self.every == 0
+        if not sampled and self.over is None:
+            return False
+        with self._lock:
+            while len(self.active) >= self.max_active:
+                # dicts keep insertion order, so the first key is the oldest call.
+                self.active.pop(next(iter(self.active)), None)
+            self.active[call_id] = (sampled, [])
+        return True
+
+    def event(self, call_id: int, event: str, duration_ns: int) -> None:
+        call = self.active.get(call_id)
+        if call is not None:
+            call[1].append((event, duration_ns))
+
+    def discard(self, call_id: int) -> None:
+        self.active.pop(call_id, None)
+
+    def finish(
+        self,
+        call_id: int,
+        name: str,
+        hit: bool,
+        duration_ns: int,
+        args: Sequence[Any],
+        kwargs: Mapping[str, Any],
+        value_size: Optional[int],
+    ) -> None:
+        call = self.active.pop(call_id, None)
+        if call is None:
+            return
+        sampled, events = call
+        breakdown: dict[str, float] = {}
+        for event, event_ns in events:
+            breakdown[event] = breakdown.get(event, 0) + event_ns / 1e9
+        overhead = duration_ns / 1e9 - breakdown.get("inner_function", 0)
+        slow = self.over is not None and overhead > self.over
+        if not slow and not sampled:
+            return
+        # json is only needed when logging is enabled.
+        import json  # pylint: disable=import-outside-toplevel
+
+        self.logger.info(
+            json.dumps(
+                {
+                    "event": "sampled_call",
+                    "reason": "slow" if slow else "sampled",
+                    "pid": os.getpid(),
+                    "name": name,
+                    "call_id": call_id,
+                    "hit": hit,
+                    "duration": duration_ns / 1e9,
+                    "overhead": overhead,
+                    "events": breakdown,
+                    "arg_sizes": {
+                        **{str(index): approx_size(arg) for index, arg in enumerate(args)},
+                        **{key: approx_size(arg) for key, arg in kwargs.items()},
+                    },
+                    "value_size": value_size,
+                },
+                separators=(",", ":"),
+            )
+        )
+
+
+global_metrics = Metrics()
+atexit.register(global_metrics.flush)
+
+global_sampler = CallSampler(
+    every=int(os.environ.get("CHARMONIUM_CACHE_SAMPLE_EVERY", "0")),
+    over=float(os.environ["CHARMONIUM_CACHE_SAMPLE_OVER"]) if "CHARMONIUM_CACHE_SAMPLE_OVER" in os.environ else None,
+)
+_sample_log = os.environ.get("CHARMONIUM_CACHE_SAMPLE_LOG")
+if _sample_log:
+    sample_logger.setLevel(logging.INFO)
+    sample_logger.addHandler(logging.FileHandler(_sample_log))
+    sample_logger.propagate = False
+
+# "-" for stderr, or a path.
+_report_destination = os.environ.get("CHARMONIUM_CACHE_REPORT")
+if _report_destination:
+    global_metrics.report_at_exit(None if _report_destination == "-" else _report_destination)
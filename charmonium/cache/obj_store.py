@@ -1,18 +1,27 @@
 from __future__ import annotations
 
+import atexit
+import collections
 import warnings
 import dataclasses
-import shutil
-from typing import TYPE_CHECKING, Any, Iterator, Union, TypeVar
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Mapping, Optional, Union, TypeVar, cast
 from pathlib import Path
 
+from .util import parse_size
+
 if TYPE_CHECKING:
     from typing import Protocol
+
+    import concurrent.futures
 else:
     Protocol = object
 
 
 _T = TypeVar("_T")
+_U = TypeVar("_U")
+_V = TypeVar("_V")
 
 
 class ObjStore(Protocol):
@@ -44,6 +53,86 @@ class ObjStore(Protocol):
     def clear(self) -> None:
         ...
 
+    def get_many(self, keys: Iterable[int], default: _T) -> list[Union[bytes, _T]]:
+        """Get many keys at once.
+
+        The default gets one key at a time; stores on a network should
+        override this with batched or parallel requests.
+
+        """
+        return [self.get(key, default) for key in keys]
+
+    def set_many(self, items: Mapping[int, bytes]) -> None:
+        """Set many items at once (see :py:meth:`get_many`)."""
+        for key, val in items.items():
+            self[key] = val
+
+    def delete_many(self, keys: Iterable[int]) -> None:
+        """Delete many keys at once (see :py:meth:`get_many`)."""
+        for key in keys:
+            del self[key]
+
+    def sizes(self) -> dict[int, int]:
+        """The size in bytes of every object.
+
+        The default reads every object; stores which can learn sizes
+        without reading the contents should override this.
+
+        """
+        ret: dict[int, int] = {}
+        for key in self:
+            val = self.get(key, None)
+            if val is not None:
+                ret[key] = len(val)
+        return ret
+
+
+def get_many(obj_store: ObjStore, keys: Iterable[int], default: _T) -> list[Union[bytes, _T]]:
+    """Call ``obj_store.get_many``, falling back to ``get`` for stores which do not subclass ObjStore."""
+    method = getattr(obj_store, "get_many", None)
+    if callable(method):
+        return cast(list[Union[bytes, _T]], method(keys, default))
+    else:
+        return ObjStore.get_many(obj_store, keys, default)
+
+
+def set_many(obj_store: ObjStore, items: Mapping[int, bytes]) -> None:
+    """Call ``obj_store.set_many``, falling back to ``__setitem__``."""
+    method = getattr(obj_store, "set_many", None)
+    if callable(method):
+        method(items)
+    else:
+        ObjStore.set_many(obj_store, items)
+
+
+def delete_many(obj_store: ObjStore, keys: Iterable[int]) -> None:
+    """Call ``obj_store.delete_many``, falling back to ``__delitem__``."""
+    method = getattr(obj_store, "delete_many", None)
+    if callable(method):
+        method(keys)
+    else:
+        ObjStore.delete_many(obj_store, keys)
+
+
+def sizes(obj_store: ObjStore) -> dict[int, int]:
+    """Call ``obj_store.sizes``, falling back to reading every object."""
+    method = getattr(obj_store, "sizes", None)
+    if callable(method):
+        return cast(dict[int, int], method())
+    else:
+        return ObjStore.sizes(obj_store)
+
+
+def _thread_map(func: Callable[[_U], _V], items: Iterable[_U], max_workers: int) -> list[_V]:
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [func(item) for item in items]
+    else:
+        import concurrent.futures  # pylint: disable=import-outside-toplevel
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            return list(executor.map(func, items))
+
 
 @dataclasses.dataclass
 class DirObjStore(ObjStore):
@@ -51,33 +140,42 @@ class DirObjStore(ObjStore):
 
     Each object is a file in the directory.
 
-    Note that this directory must not contain any other files.
+    Note that this directory must not contain any other files. This
+    is checked (and the directory is created) lazily, at the first
+    operation, so constructing a DirObjStore does no I/O.
 
     """
 
     path: Path
     key_bytes: int
+    io_threads: int
 
     def __frozenstate__(self) -> Any:
         return (str(self.path), self.key_bytes)
 
-    def __init__(self, path: Union[Path, str], key_bytes: int = 16) -> None:
+    def __init__(self, path: Union[Path, str], key_bytes: int = 16, io_threads: int = 16) -> None:
         """
         :param path: the directory of the object store.
         :param key_bytes: the number of bytes to use as keys
+        :param io_threads: the number of threads used by the bulk operations (``get_many``, ``set_many``, ``delete_many``). On a network filesystem, each file operation is a round-trip, so these overlap them.
         """
         super().__init__()
         self.path = path if isinstance(path, Path) else Path(path)
         self.key_bytes = key_bytes
-
-        if self.path.exists():
-            if any(
-                not self._is_key(path) and not path.name.startswith(".")
-                for path in self.path.iterdir()
-            ):
-                raise ValueError(f"{self.path.resolve()} contains junk I didn't make.")
-        else:
-            self.path.mkdir(parents=True)
+        self.io_threads = io_threads
+        self._checked = False
+
+    def _check(self) -> None:
+        if not self._checked:
+            if self.path.exists():
+                if any(
+                    not self._is_key(path) and not path.name.startswith(".")
+                    for path in self.path.iterdir()
+                ):
+                    raise ValueError(f"{self.path.resolve()} contains junk I didn't make.")
+            else:
+                self.path.mkdir(parents=True, exist_ok=True)
+            self._checked = True
 
     def _int2str(self, key: int) -> str:
         assert key < (1 << (8 * self.key_bytes))
@@ -89,9 +187,15 @@ class DirObjStore(ObjStore):
         )
 
     def __setitem__(self, key: int, val: bytes) -> None:
-        (self.path / self._int2str(key)).write_bytes(val)
+        self._check()
+        name = self._int2str(key)
+        # Write to a dot-file (which is not a key) and rename it, so readers never see a partial object.
+        tmp = self.path / f".{name}.{os.getpid()}.{threading.get_ident()}"
+        tmp.write_bytes(val)
+        tmp.replace(self.path / name)
 
     def __getitem__(self, key: int) -> bytes:
+        self._check()
         path = self.path / self._int2str(key)
         try:
             return path.read_bytes()
@@ -99,12 +203,14 @@ class DirObjStore(ObjStore):
             raise KeyError(key)
 
     def __delitem__(self, key: int) -> None:
+        self._check()
         try:
             (self.path / self._int2str(key)).unlink()
         except FileNotFoundError:
             pass
 
     def get(self, key: int, default: _T) -> Union[bytes | _T]:
+        self._check()
         path = self.path / self._int2str(key)
         try:
             return path.read_bytes()
@@ -112,17 +218,616 @@ class DirObjStore(ObjStore):
             return default
 
     def __contains__(self, key: int) -> bool:
+        self._check()
         return (self.path / self._int2str(key)).exists()
 
+    def get_many(self, keys: Iterable[int], default: _T) -> list[Union[bytes, _T]]:
+        self._check()
+        return _thread_map(lambda key: self.get(key, default), keys, self.io_threads)
+
+    def set_many(self, items: Mapping[int, bytes]) -> None:
+        self._check()
+        _thread_map(lambda item: self.__setitem__(*item), items.items(), self.io_threads)
+
+    def delete_many(self, keys: Iterable[int]) -> None:
+        self._check()
+        _thread_map(self.__delitem__, keys, self.io_threads)
+
     def __iter__(self) -> Iterator[int]:
+        self._check()
         yield from (
             int(path.name, base=16)
             for path in self.path.iterdir()
             if not path.name.startswith(".") and self._is_key(path)
         )
 
+    def sizes(self) -> dict[int, int]:
+        self._check()
+        ret: dict[int, int] = {}
+        for path in self.path.iterdir():
+            if not path.name.startswith(".") and self._is_key(path):
+                try:
+                    ret[int(path.name, base=16)] = path.stat().st_size
+                except FileNotFoundError:
+                    # Deleted since it was listed.
+                    pass
+        return ret
+
     def clear(self) -> None:
+        if not self.path.exists():
+            return
+        self._checked = False
         if hasattr(self.path, "rmtree"):
             self.path.rmtree()
         else:
+            import shutil  # pylint: disable=import-outside-toplevel
+
             shutil.rmtree(self.path)
+
+
+def _immutable_key(key: int) -> bool:
+    # MemoizedGroup overwrites its index headers, which live at small keys (see MemoizedGroup._shard_key).
+    # Every other object is written once per key (or rewritten with an equivalent value).
+    return key >= (1 << 48)
+
+
+@dataclasses.dataclass
+class TieredObjStore(ObjStore):
+    """Serve hot objects from a small, fast local store in front of a large, slow shared store.
+
+    Reads try the local store first. On a local miss, they read the
+    shared store and promote the object into the local store
+    (read-through). The local store holds at most ``local_size``
+    bytes; the least-recently used objects are dropped from it.
+
+    Writes go to both stores (write-through), or, with
+    ``write_back=True``, only to the local store until
+    :py:meth:`flush`. Pending objects are flushed before they are
+    dropped from the local store, before writing a key which is not
+    cached locally (so a MemoizedGroup's index header never refers to
+    objects that are not in the shared store yet), and at exit.
+
+    The shared store is authoritative: ``__iter__`` lists the shared
+    store plus pending objects, and ``__delitem__`` deletes from both.
+
+    """
+
+    local: ObjStore
+    shared: ObjStore
+    local_size: int
+    write_back: bool
+    local_keys: Callable[[int], bool]
+
+    def __frozenstate__(self) -> Any:
+        return (self.local, self.shared)
+
+    def __init__(
+        self,
+        local: ObjStore,
+        shared: ObjStore,
+        local_size: Union[int, str] = "1 GiB",
+        write_back: bool = False,
+        local_keys: Optional[Callable[[int], bool]] = None,
+    ) -> None:
+        """
+        :param local: the fast store, e.g. a DirObjStore on a local disk. Objects already in it are adopted at the first operation.
+        :param shared: the slow, authoritative store.
+        :param local_size: the byte budget of the local store, as an int or as a string (e.g. "3 GiB").
+        :param write_back: whether writes are deferred until :py:meth:`flush`.
+        :param local_keys: a predicate on keys which may be cached locally. Keys which get overwritten must be excluded. Defaults to every key except MemoizedGroup's index headers.
+        """
+        super().__init__()
+        self.local = local
+        self.shared = shared
+        self.local_size = parse_size(local_size)
+        self.write_back = write_back
+        self.local_keys = local_keys if local_keys is not None else _immutable_key
+        self.__setstate__({})
+        if self.write_back:
+            atexit.register(self.flush)
+
+    def __getstate__(self) -> Any:
+        return {
+            attr: val
+            for attr, val in self.__dict__.items()
+            if attr not in {"_lock", "_lru", "_local_total", "_pending", "_scanned"}
+        }
+
+    def __setstate__(self, state: Any) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        # Map from each locally cached key to its size, from least- to most-recently used.
+        self._lru: collections.OrderedDict[int, int] = collections.OrderedDict()
+        self._local_total = 0
+        # Keys written back to the local store but not yet to the shared store.
+        self._pending: set[int] = set()
+        self._scanned = False
+
+    def _scan(self) -> None:
+        if not self._scanned:
+            for key, size in sizes(self.local).items():
+                if self.local_keys(key):
+                    self._lru[key] = size
+                    self._local_total += size
+            self._scanned = True
+            self._shrink()
+
+    def _shrink(self) -> None:
+        while self._local_total > self.local_size:
+            key, size = self._lru.popitem(last=False)
+            if key in self._pending:
+                self.shared[key] = self.local[key]
+                self._pending.discard(key)
+            del self.local[key]
+            self._local_total -= size
+
+    def _put_local(self, key: int, val: bytes) -> bool:
+        if not self.local_keys(key) or len(val) > self.local_size:
+            return False
+        self.local[key] = val
+        self._local_total += len(val) - self._lru.pop(key, 0)
+        self._lru[key] = len(val)
+        self._shrink()
+        return True
+
+    def flush(self) -> None:
+        """Write pending objects to the shared store."""
+        with self._lock:
+            for key in self._pending:
+                self.shared[key] = self.local[key]
+            self._pending.clear()
+
+    def __setitem__(self, key: int, val: bytes) -> None:
+        with self._lock:
+            self._scan()
+            if self.write_back and self._put_local(key, val):
+                self._pending.add(key)
+                return
+            if not self.local_keys(key):
+                self.flush()
+            self._pending.discard(key)
+        self.shared[key] = val
+        with self._lock:
+            self._put_local(key, val)
+
+    def get(self, key: int, default: _T) -> Union[bytes | _T]:
+        if not self.local_keys(key):
+            return self.shared.get(key, default)
+        with self._lock:
+            self._scan()
+            local_hit = key in self._lru
+            if local_hit:
+                self._lru.move_to_end(key)
+        if local_hit:
+            val = self.local.get(key, None)
+            if val is not None:
+                return val
+            # Dropped from the local store in the meantime (and flushed first, if pending).
+        val = self.shared.get(key, None)
+        if val is None:
+            return default
+        with self._lock:
+            self._put_local(key, val)
+        return val
+
+    def __getitem__(self, key: int) -> bytes:
+        val = self.get(key, None)
+        if val is None:
+            raise KeyError(key)
+        return val
+
+    def __delitem__(self, key: int) -> None:
+        with self._lock:
+            self._scan()
+            if key in self._lru:
+                self._local_total -= self._lru.pop(key)
+                del self.local[key]
+            self._pending.discard(key)
+        del self.shared[key]
+
+    def delete_many(self, keys: Iterable[int]) -> None:
+        keys = list(keys)
+        with self._lock:
+            self._scan()
+            local_keys = [key for key in keys if key in self._lru]
+            for key in local_keys:
+                self._local_total -= self._lru.pop(key)
+                self._pending.discard(key)
+        delete_many(self.local, local_keys)
+        delete_many(self.shared, keys)
+
+    def __contains__(self, key: int) -> bool:
+        with self._lock:
+            self._scan()
+            if key in self._lru:
+                return True
+        return key in self.shared
+
+    def __iter__(self) -> Iterator[int]:
+        with self._lock:
+            self._scan()
+            pending = set(self._pending)
+        yield from pending
+        yield from (key for key in self.shared if key not in pending)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.local.clear()
+            self.shared.clear()
+            self._lru.clear()
+            self._local_total = 0
+            self._pending.clear()
+            self._scanned = True
+
+
+def _s3_error_code(exc: Exception) -> Optional[str]:
+    # botocore.exceptions.ClientError carries the error code in its response.
+    return cast(Optional[str], getattr(exc, "response", {}).get("Error", {}).get("Code"))
+
+
+@dataclasses.dataclass
+class S3ObjStore(ObjStore):
+    """Use a bucket in S3, or in an S3-compatible service such as MinIO, as an object-store.
+
+    Each object is an S3 object named by the prefix and the hex key.
+
+    All operations share one client, and therefore one pool of HTTP
+    connections. Values larger than ``chunk_size`` are uploaded in
+    parts (multipart upload) and downloaded with parallel ranged
+    GETs. :py:meth:`delete_many` deletes up to 1000 objects per
+    request.
+
+    boto3 is imported at the first operation; install it with the
+    ``s3`` extra (``pip install charmonium.cache[s3]``).
+
+    """
+
+    bucket: str
+    prefix: str
+    endpoint_url: Optional[str]
+    chunk_size: int
+    max_concurrency: int
+    client_kwargs: Mapping[str, Any]
+
+    def __frozenstate__(self) -> Any:
+        return (self.bucket, self.prefix, self.endpoint_url)
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        chunk_size: Union[int, str] = "8 MiB",
+        max_concurrency: int = 10,
+        client_kwargs: Optional[Mapping[str, Any]] = None,
+    ) -> None:
+        """
+        :param bucket: the name of the bucket, which must already exist.
+        :param prefix: a prefix for the names of the objects, e.g. ``"cache/"``.
+        :param endpoint_url: the URL of an S3-compatible service (e.g. ``"http://localhost:9000"`` for MinIO). Defaults to AWS.
+        :param chunk_size: the part-size for multipart uploads and ranged downloads.
+        :param max_concurrency: the number of HTTP connections in the pool, and the number of parts transferred in parallel.
+        :param client_kwargs: extra keyword arguments for ``boto3.client("s3", ...)``, e.g. credentials or region.
+        """
+        super().__init__()
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.chunk_size = parse_size(chunk_size)
+        self.max_concurrency = max_concurrency
+        self.client_kwargs = dict(client_kwargs or {})
+        self.__setstate__({})
+
+    def __getstate__(self) -> Any:
+        return {
+            attr: val
+            for attr, val in self.__dict__.items()
+            if attr not in {"_client", "_client_lock", "_executor"}
+        }
+
+    def __setstate__(self, state: Any) -> None:
+        self.__dict__.update(state)
+        self._client: Any = None
+        self._client_lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def _get_client(self) -> Any:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # boto3 is imported on first use, because it is optional and slow to import.
+                    import boto3  # type: ignore # pylint: disable=import-outside-toplevel
+                    import botocore.config  # type: ignore # pylint: disable=import-outside-toplevel
+
+                    self._client = boto3.session.Session().client(
+                        "s3",
+                        endpoint_url=self.endpoint_url,
+                        config=botocore.config.Config(
+                            max_pool_connections=self.max_concurrency
+                        ),
+                        **self.client_kwargs,
+                    )
+        return self._client
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._executor is None:
+            import concurrent.futures  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+            with self._client_lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_concurrency
+                    )
+        return self._executor
+
+    def _int2str(self, key: int) -> str:
+        return f"{self.prefix}{key:032x}"
+
+    def _str2int(self, name: str) -> Optional[int]:
+        suffix = name[len(self.prefix):]
+        if name.startswith(self.prefix) and len(suffix) == 32 and all(
+            letter in "0123456789abcdef" for letter in suffix
+        ):
+            return int(suffix, base=16)
+        else:
+            return None
+
+    def __setitem__(self, key: int, val: bytes) -> None:
+        client = self._get_client()
+        if len(val) <= self.chunk_size:
+            client.put_object(Bucket=self.bucket, Key=self._int2str(key), Body=val)
+        else:
+            import io  # pylint: disable=import-outside-toplevel
+
+            from boto3.s3.transfer import TransferConfig  # type: ignore # pylint: disable=import-outside-toplevel
+
+            client.upload_fileobj(
+                io.BytesIO(val),
+                self.bucket,
+                self._int2str(key),
+                Config=TransferConfig(
+                    multipart_threshold=self.chunk_size,
+                    multipart_chunksize=self.chunk_size,
+                    max_concurrency=self.max_concurrency,
+                ),
+            )
+
+    def _get_range(self, key: int, start: int, stop: int, etag: Optional[str]) -> Any:
+        return self._get_client().get_object(
+            Bucket=self.bucket,
+            Key=self._int2str(key),
+            Range=f"bytes={start}-{stop - 1}",
+            **({"IfMatch": etag} if etag is not None else {}),
+        )
+
+    def get(self, key: int, default: _T, tries: int = 3) -> Union[bytes | _T]:
+        for try_ in range(tries):
+            try:
+                # The first part also tells the total size, so small objects take one request.
+                response = self._get_range(key, 0, self.chunk_size, None)
+                first = cast(bytes, response["Body"].read())
+                total = int(response.get("ContentRange", f"/{len(first)}").rpartition("/")[2])
+                if total <= len(first):
+                    return first
+                # Pin the rest of the parts to the same version of the object.
+                rest = self._get_executor().map(
+                    lambda start: cast(
+                        bytes,
+                        self._get_range(
+                            key, start, min(start + self.chunk_size, total), response["ETag"]
+                        )["Body"].read(),
+                    ),
+                    range(len(first), total, self.chunk_size),
+                )
+                return b"".join([first, *rest])
+            except Exception as exc:  # pylint: disable=broad-except
+                code = _s3_error_code(exc)
+                if code in {"NoSuchKey", "404"}:
+                    return default
+                elif code == "InvalidRange":
+                    # S3 does not permit a range of an empty object.
+                    return b""
+                elif code == "PreconditionFailed" and try_ < tries - 1:
+                    # The object was overwritten between the parts; start over.
+                    continue
+                else:
+                    raise
+        raise AssertionError("unreachable")
+
+    def __getitem__(self, key: int) -> bytes:
+        val = self.get(key, None)
+        if val is None:
+            raise KeyError(key)
+        return val
+
+    def __delitem__(self, key: int) -> None:
+        self._get_client().delete_object(Bucket=self.bucket, Key=self._int2str(key))
+
+    def get_many(self, keys: Iterable[int], default: _T) -> list[Union[bytes, _T]]:
+        """Get keys, ``max_concurrency`` requests at a time."""
+        # Not on self._get_executor(), because get uses that for the parts of large objects.
+        return _thread_map(lambda key: self.get(key, default), keys, self.max_concurrency)
+
+    def set_many(self, items: Mapping[int, bytes]) -> None:
+        """Set items, ``max_concurrency`` requests at a time."""
+        _thread_map(lambda item: self.__setitem__(*item), items.items(), self.max_concurrency)
+
+    def delete_many(self, keys: Iterable[int]) -> None:
+        """Delete keys, 1000 per request."""
+        client = self._get_client()
+        names = [self._int2str(key) for key in keys]
+        for start in range(0, len(names), 1000):
+            response = client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": name} for name in names[start : start + 1000]],
+                    "Quiet": True,
+                },
+            )
+            errors = response.get("Errors", [])
+            if errors:
+                raise OSError(
+                    f"Could not delete {len(errors)} objects from s3://{self.bucket}/{self.prefix}, e.g. {errors[0]}"
+                )
+
+    def __contains__(self, key: int) -> bool:
+        try:
+            self._get_client().head_object(Bucket=self.bucket, Key=self._int2str(key))
+        except Exception as exc:  # pylint: disable=broad-except
+            if _s3_error_code(exc) in {"NoSuchKey", "404"}:
+                return False
+            raise
+        else:
+            return True
+
+    def __iter__(self) -> Iterator[int]:
+        paginator = self._get_client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                key = self._str2int(obj["Key"])
+                if key is not None:
+                    yield key
+
+    def clear(self) -> None:
+        self.delete_many(list(self))
+
+
+@dataclasses.dataclass
+class RedisObjStore(ObjStore):
+    """Use a Redis (or Redis-protocol) server as an object-store.
+
+    Each object is a Redis string named by the prefix and the hex key.
+    For many small objects, this has much lower latency than a shared
+    filesystem. :py:meth:`get_many` uses ``MGET``, and
+    :py:meth:`set_many` and :py:meth:`delete_many` are pipelined.
+
+    redis-py is imported at the first operation; install it with the
+    ``redis`` extra (``pip install charmonium.cache[redis]``).
+
+    """
+
+    url: str
+    prefix: str
+    batch_size: int
+    _client: Any
+
+    def __frozenstate__(self) -> Any:
+        return (self.url, self.prefix)
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "charmonium.cache:",
+        batch_size: int = 1000,
+        client: Any = None,
+    ) -> None:
+        """
+        :param url: the URL of the server, passed to ``redis.Redis.from_url``.
+        :param prefix: a prefix for the names of the objects.
+        :param batch_size: the number of keys per request (or per pipeline) in bulk operations.
+        :param client: a redis-py compatible client to use instead of connecting to ``url`` (e.g. a ``fakeredis.FakeRedis``). It is not pickled.
+        """
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.__setstate__({})
+        self._client = client
+
+    def __getstate__(self) -> Any:
+        return {
+            attr: val
+            for attr, val in self.__dict__.items()
+            if attr not in {"_client", "_client_lock"}
+        }
+
+    def __setstate__(self, state: Any) -> None:
+        self.__dict__.update(state)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self) -> Any:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # redis is imported on first use, because it is optional.
+                    import redis  # pylint: disable=import-outside-toplevel
+
+                    # The client holds a connection pool, which all operations share.
+                    self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def _int2str(self, key: int) -> str:
+        return f"{self.prefix}{key:032x}"
+
+    def _str2int(self, name: Union[bytes, str]) -> Optional[int]:
+        name = name.decode() if isinstance(name, bytes) else name
+        suffix = name[len(self.prefix):]
+        if name.startswith(self.prefix) and len(suffix) == 32 and all(
+            letter in "0123456789abcdef" for letter in suffix
+        ):
+            return int(suffix, base=16)
+        else:
+            return None
+
+    def _batches(self, keys: Iterable[int]) -> Iterator[list[str]]:
+        batch: list[str] = []
+        for key in keys:
+            batch.append(self._int2str(key))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def __setitem__(self, key: int, val: bytes) -> None:
+        self._get_client().set(self._int2str(key), val)
+
+    def get(self, key: int, default: _T) -> Union[bytes | _T]:
+        val = self._get_client().get(self._int2str(key))
+        return cast(bytes, val) if val is not None else default
+
+    def __getitem__(self, key: int) -> bytes:
+        val = self.get(key, None)
+        if val is None:
+            raise KeyError(key)
+        return val
+
+    def __delitem__(self, key: int) -> None:
+        self._get_client().delete(self._int2str(key))
+
+    def get_many(self, keys: Iterable[int], default: _T) -> list[Union[bytes, _T]]:
+        """Get keys, with one ``MGET`` per batch."""
+        client = self._get_client()
+        return [
+            cast(bytes, val) if val is not None else default
+            for batch in self._batches(keys)
+            for val in client.mget(batch)
+        ]
+
+    def set_many(self, items: Mapping[int, bytes]) -> None:
+        """Set items, with one pipeline per batch."""
+        client = self._get_client()
+        for batch in self._batches(items.keys()):
+            pipeline = client.pipeline(transaction=False)
+            for name in batch:
+                pipeline.set(name, items[cast(int, self._str2int(name))])
+            pipeline.execute()
+
+    def delete_many(self, keys: Iterable[int]) -> None:
+        """Delete keys, with one ``UNLINK`` per batch."""
+        client = self._get_client()
+        for batch in self._batches(keys):
+            client.unlink(*batch)
+
+    def __contains__(self, key: int) -> bool:
+        return bool(self._get_client().exists(self._int2str(key)))
+
+    def __iter__(self) -> Iterator[int]:
+        for name in self._get_client().scan_iter(match=f"{self.prefix}*", count=self.batch_size):
+            key = self._str2int(name)
+            if key is not None:
+                yield key
+
+    def clear(self) -> None:
+        self.delete_many(list(self))
@@ -1,4 +1,10 @@
-from typing import TYPE_CHECKING, Any
+from __future__ import annotations
+
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional, Union
 
 if TYPE_CHECKING:
     from typing import Protocol
@@ -15,4 +21,79 @@ class Pickler(Protocol):
         ...
 
 
+class Codec(Protocol):
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    def decompress(self, data: bytes) -> bytes:
+        ...
+
+
+class CompressedPickler(Pickler):
+    """Compress the output of another pickler.
+
+    ``codec`` is anything with ``compress`` and ``decompress``, such as
+    the ``zlib``, ``bz2``, or ``lzma`` modules, or ``lz4.frame``. For
+    example, ``memoize(pickler=CompressedPickler(pickle, zlib))``.
+
+    """
+
+    def __init__(self, pickler: Pickler = pickle, codec: Optional[Codec] = None) -> None:
+        if codec is None:
+            import zlib  # pylint: disable=import-outside-toplevel
+
+            codec = zlib
+        self.pickler = pickler
+        self.codec = codec
+
+    def __repr__(self) -> str:
+        return f"CompressedPickler({getattr(self.pickler, '__name__', self.pickler)!r}, {getattr(self.codec, '__name__', self.codec)!r})"
+
+    def loads(self, buffer: bytes) -> Any:
+        return self.pickler.loads(self.codec.decompress(buffer))
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.codec.compress(self.pickler.dumps(obj))
+
+
+class RecordingPickler(Pickler):
+    """Save the first few values which pass through another pickler, as samples for choosing a pickler.
+
+    Use one directory per function, e.g. ``memoize(pickler=RecordingPickler(".cache-samples/square"))``.
+    Each sample is stored as serialized by ``pickler``. ``benchmark.serializers`` in this repository
+    can then recommend a pickler from these samples.
+
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        pickler: Pickler = pickle,
+        max_samples: int = 16,
+    ) -> None:
+        self.directory = Path(directory)
+        self.pickler = pickler
+        self.max_samples = max_samples
+        self._samples: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def loads(self, buffer: bytes) -> Any:
+        return self.pickler.loads(buffer)
+
+    def dumps(self, obj: Any) -> bytes:
+        buffer = self.pickler.dumps(obj)
+        with self._lock:
+            if self._samples is None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._samples = len(os.listdir(self.directory))
+            record = self._samples < self.max_samples
+            if record:
+                self._samples += 1
+        if record:
+            import uuid  # pylint: disable=import-outside-toplevel
+
+            (self.directory / f"{uuid.uuid4().hex}.sample").write_bytes(buffer)
+        return buffer
+
+
 # TODO: switch this to file-based load/dump
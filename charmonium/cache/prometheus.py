@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterable, Mapping, Optional, Union
+
+from .metrics import Metrics, global_metrics
+
+if TYPE_CHECKING:
+    import http.server
+
+    from .memoize import MemoizedGroup
+
+# Histogram buckets are powers of two nanoseconds; export every other one, from about 1us to about 69s.
+_EXPORTED_BUCKETS = range(10, 37, 2)
+
+_HELP = {
+    "hits": "Calls which were served from the cache.",
+    "misses": "Calls which had to be computed.",
+    "evictions": "Entries evicted by the replacement policy.",
+    "bytes_stored": "Bytes of results written to the object store.",
+    "bytes_read": "Bytes of results read from the object store.",
+    "time_saved": "Time saved by caching, including peer processes which share the index.",
+    "time_cost": "Overhead of caching, including peer processes which share the index.",
+}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items()) + "}"
+
+
+def _metric_name(name: str) -> str:
+    return "".join(char if char.isalnum() or char == "_" else "_" for char in name)
+
+
+class PrometheusExporter:
+    """Export cache metrics in the `Prometheus text format`_.
+
+    This exports the process-wide :py:class:`~charmonium.cache.metrics.Metrics`
+    (hits, misses, evictions, bytes stored and read, per function, and
+    a latency histogram per function and event) and, for each group,
+    the size of its index and the time saved and cost per function.
+
+    Use :py:meth:`write_textfile` for node_exporter's textfile
+    collector, or :py:meth:`serve` for a local HTTP endpoint.
+
+    .. _`Prometheus text format`: https://prometheus.io/docs/instrumenting/exposition_formats/
+
+    """
+
+    def __init__(
+        self,
+        groups: Optional[Mapping[str, MemoizedGroup]] = None,
+        metrics: Metrics = global_metrics,
+        prefix: str = "charmonium_cache",
+    ) -> None:
+        """
+        :param groups: the groups to export, by the value of their ``group`` label.
+        :param metrics: the counters and histograms to export.
+        :param prefix: prepended to every metric name.
+        """
+        self.groups = dict(groups) if groups is not None else {}
+        self.metrics = metrics
+        self.prefix = prefix
+
+    def render(self) -> str:
+        """The current metrics in the Prometheus text format."""
+        histograms, counters = self.metrics.snapshot()
+        lines: list[str] = []
+
+        counter_names = sorted({counter for _, counter in counters})
+        for counter in counter_names:
+            name = f"{self.prefix}_{_metric_name(counter)}_total"
+            lines.append(f"# HELP {name} {_HELP.get(counter, counter)}")
+            lines.append(f"# TYPE {name} counter")
+            for (function, this_counter), count in sorted(counters.items()):
+                if this_counter == counter:
+                    lines.append(f"{name}{_labels(function=function)} {count}")
+
+        events = sorted({event for _, event in histograms})
+        for event in events:
+            name = f"{self.prefix}_{_metric_name(event)}_seconds"
+            lines.append(f"# HELP {name} Duration of {event}.")
+            lines.append(f"# TYPE {name} histogram")
+            for (function, this_event), histogram in sorted(histograms.items()):
+                if this_event != event:
+                    continue
+                cumulative = 0
+                bucket_iter = iter(enumerate(histogram.buckets))
+                for exported in _EXPORTED_BUCKETS:
+                    for bucket, count in bucket_iter:
+                        cumulative += count
+                        if bucket == exported:
+                            break
+                    lines.append(
+                        f"{name}_bucket{_labels(function=function, le=repr((1 << exported) / 1e9))} {cumulative}"
+                    )
+                lines.append(f"{name}_bucket{_labels(function=function, le='+Inf')} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(function=function)} {histogram.total_ns / 1e9}")
+                lines.append(f"{name}_count{_labels(function=function)} {histogram.count}")
+
+        lines.extend(self._render_groups())
+        return "\n".join(lines) + "\n"
+
+    def _render_groups(self) -> Iterable[str]:
+        gauges: dict[str, list[str]] = {
+            "index_entries": [],
+            "index_bytes": [],
+            "size_limit_bytes": [],
+        }
+        time_lines: dict[str, list[str]] = {"time_saved": [], "time_cost": []}
+        for group_name, group in sorted(self.groups.items()):
+            # pylint: disable=protected-access
+            with group._memory_lock:
+                group._drain_pending()
+                entries = list(group._index.items())
+                time_saved = dict(group.time_saved)
+                time_cost = dict(group.time_cost)
+            labels = _labels(group=group_name)
+            gauges["index_entries"].append(f"{self.prefix}_index_entries{labels} {len(entries)}")
+            gauges["index_bytes"].append(
+                f"{self.prefix}_index_bytes{labels} {sum(entry.data_size for _, entry in entries)}"
+            )
+            gauges["size_limit_bytes"].append(f"{self.prefix}_size_limit_bytes{labels} {group._size}")
+            for kind, times in [("time_saved", time_saved), ("time_cost", time_cost)]:
+                for function, duration in sorted(times.items()):
+                    time_lines[kind].append(
+                        f"{self.prefix}_{kind}_seconds{_labels(group=group_name, function=function)} {duration.total_seconds()}"
+                    )
+        if not self.groups:
+            return
+        helps = {
+            "index_entries": "Entries in the index of the group.",
+            "index_bytes": "Bytes of the entries in the index of the group.",
+            "size_limit_bytes": "The size which the group is evicted down to.",
+        }
+        for gauge, lines in gauges.items():
+            yield f"# HELP {self.prefix}_{gauge} {helps[gauge]}"
+            yield f"# TYPE {self.prefix}_{gauge} gauge"
+            yield from lines
+        for kind, lines in time_lines.items():
+            yield f"# HELP {self.prefix}_{kind}_seconds {_HELP[kind]}"
+            yield f"# TYPE {self.prefix}_{kind}_seconds gauge"
+            yield from lines
+
+    def write_textfile(self, path: Union[str, Path]) -> None:
+        """Atomically write the metrics to ``path``, which should end in ``.prom``."""
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(self.render())
+        os.replace(tmp_path, path)
+
+    def write_textfile_periodically(self, path: Union[str, Path], interval: float = 15.0) -> threading.Thread:
+        """Call :py:meth:`write_textfile` every ``interval`` seconds, in a daemon thread, and at exit."""
+
+        def loop() -> None:
+            while True:
+                self.write_textfile(path)
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name="charmonium.cache textfile", daemon=True)
+        thread.start()
+        atexit.register(self.write_textfile, path)
+        return thread
+
+    def serve(self, port: int = 9464, addr: str = "127.0.0.1") -> http.server.ThreadingHTTPServer:
+        """Serve the metrics at ``http://{addr}:{port}/metrics``, in a daemon thread.
+
+        Call ``shutdown()`` on the returned server to stop.
+
+        """
+        import http.server  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                if self.path.split("?")[0] not in {"/", "/metrics"}:
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+                pass
+
+        server = http.server.ThreadingHTTPServer((addr, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(
+            target=server.serve_forever, name="charmonium.cache metrics server", daemon=True
+        ).start()
+        return server
@@ -1,21 +1,83 @@
 from __future__ import annotations
 
 import abc
-import dataclasses
 import datetime
-from typing import TYPE_CHECKING, Any, Mapping, cast
+from typing import TYPE_CHECKING, Any, Callable, Mapping, Optional, cast
 
-import bitmath  # type: ignore
+from .util import parse_size
 
 
-@dataclasses.dataclass
 class Entry:
+    """The index's record of one memoized call.
+
+    ``data_size`` is in bytes; ``function_time`` and
+    ``serialization_time`` are in seconds.
+
+    There is one of these per entry in the index, so it is a slotted
+    class of plain numbers, and it pickles as a flat tuple.
+
+    """
+
+    __slots__ = ("value", "data_size", "function_time", "serialization_time", "obj_store")
+
     value: Any
-    data_size: bitmath.Bitmath
-    function_time: datetime.timedelta
-    serialization_time: datetime.timedelta
+    data_size: int
+    function_time: float
+    serialization_time: float
     obj_store: bool
 
+    def __init__(
+        self,
+        value: Any,
+        data_size: int,
+        function_time: float,
+        serialization_time: float,
+        obj_store: bool,
+    ) -> None:
+        self.value = value
+        self.data_size = data_size
+        self.function_time = function_time
+        self.serialization_time = serialization_time
+        self.obj_store = obj_store
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (
+            Entry,
+            (
+                self.value,
+                self.data_size,
+                self.function_time,
+                self.serialization_time,
+                self.obj_store,
+            ),
+        )
+
+    def __setstate__(self, state: Mapping[str, Any]) -> None:
+        """Load an Entry pickled by a version where it was a dataclass of bitmath and timedeltas."""
+        self.value = state["value"]
+        self.data_size = parse_size(state["data_size"])
+        self.function_time = _seconds(state["function_time"])
+        self.serialization_time = _seconds(state["serialization_time"])
+        self.obj_store = state["obj_store"]
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Entry) and self.__reduce__()[1] == other.__reduce__()[1]
+
+    def __repr__(self) -> str:
+        return (
+            f"Entry(value={self.value!r}, data_size={self.data_size!r}, "
+            f"function_time={self.function_time!r}, serialization_time={self.serialization_time!r}, "
+            f"obj_store={self.obj_store!r})"
+        )
+
+
+def _seconds(duration: Any) -> float:
+    return (
+        duration.total_seconds()
+        if isinstance(duration, datetime.timedelta)
+        else float(duration)
+    )
+
 
 # TODO: test that these methods are called at the right time.
 class ReplacementPolicy:  # pylint: disable=unused-argument
@@ -41,8 +103,35 @@ class ReplacementPolicy:  # pylint: disable=unused-argument
         """
 
     @abc.abstractmethod
-    def evict(self) -> tuple[Any, Entry]:
-        """Select a key, entry pair to evict."""
+    def evict(
+        self, predicate: Optional[Callable[[Any, Entry], bool]] = None, age: bool = True
+    ) -> tuple[Any, Entry]:
+        """Select a key, entry pair to evict.
+
+        :param predicate: If given, only select among key, entry pairs for which this returns True.
+        :param age: Whether this eviction ages the rest of the cache. Evictions which only concern part of the cache (e.g. a function's quota) should not.
+
+        """
+
+    def filter(self, predicate: Callable[[Any, Entry], bool]) -> ReplacementPolicy:
+        """A copy of self, restricted to the key, entry pairs for which predicate is True.
+
+        This is used to persist the part of the policy belonging to
+        one shard of a sharded index.
+
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support sharded indexes"
+        )
+
+    def scores(self) -> Mapping[Any, float]:
+        """The priority of each key; lower scores are evicted sooner.
+
+        This is optional; the ``cache`` command uses it to list the
+        coldest entries.
+
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support scores")
 
     @abc.abstractmethod
     def update(self, other: ReplacementPolicy) -> None:
@@ -69,7 +158,7 @@ class GDSize(ReplacementPolicy):
     def access(self, key: Any, entry: Entry) -> None:
         score = self.inflation + (
             entry.function_time + entry.serialization_time
-        ).total_seconds() / max(entry.data_size.to_Byte().value, 1)
+        ) / max(entry.data_size, 1)
         self._data[key] = (score, entry)
 
     def invalidate(
@@ -77,16 +166,36 @@ class GDSize(ReplacementPolicy):
     ) -> None:  # pylint: disable=unused-argument
         self._data.pop(key, None)
 
-    def evict(self) -> tuple[Any, Entry]:
-        if self._data:
-            self.inflation, key, entry = min(
-                (score, key, entry) for key, (score, entry) in self._data.items()
-            )
+    def evict(
+        self, predicate: Optional[Callable[[Any, Entry], bool]] = None, age: bool = True
+    ) -> tuple[Any, Entry]:
+        candidates = [
+            (score, key, entry)
+            for key, (score, entry) in self._data.items()
+            if predicate is None or predicate(key, entry)
+        ]
+        if candidates:
+            score, key, entry = min(candidates)
+            if age:
+                self.inflation = score
             self._data.pop(key, None)
             return key, entry
         else:
             raise ValueError("No data left to evict")
 
+    def scores(self) -> Mapping[Any, float]:
+        return {key: score for key, (score, _) in self._data.items()}
+
+    def filter(self, predicate: Callable[[Any, Entry], bool]) -> GDSize:
+        ret = GDSize()
+        ret.inflation = self.inflation
+        ret._data = {  # pylint: disable=protected-access
+            key: (score, entry)
+            for key, (score, entry) in self._data.items()
+            if predicate(key, entry)
+        }
+        return ret
+
     def update(self, other: ReplacementPolicy) -> None:
         if isinstance(other, GDSize) or (
             not TYPE_CHECKING and type(other).__name__ == type(self).__name__
@@ -95,7 +204,8 @@ class GDSize(ReplacementPolicy):
             # I need the type(other).__name == type(self).__name__ because when this class is de/serialized, Python forgets that it is equal.
             # However, I don't want the type checker to think too hard about it; it should just know isinstance(other, GDSIze), so I add not TYPE_CHECKING.
             self._data.update(other._data)  # pylint: disable=protected-access
-            self.inflation = other.inflation
+            # Inflation never decreases, so the larger one is more recent.
+            self.inflation = max(self.inflation, other.inflation)
         else:
             raise TypeError(f"Cannot update a {type(self)} from a {type(other)}")
 
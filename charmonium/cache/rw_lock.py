@@ -1,17 +1,23 @@
 from __future__ import annotations
 
 import dataclasses
+import os
+import random
+import threading
+import time
+import weakref
 from pathlib import Path
 from types import TracebackType
-from typing import TYPE_CHECKING, Optional, cast
-
-import fasteners  # type: ignore
+from typing import TYPE_CHECKING, Any, Optional, cast
 
+from .metrics import Metrics, global_metrics
 from .pathlike import PathLikeFrom, pathlike_from
 
 if TYPE_CHECKING:
     from typing import Protocol
 
+    import fasteners  # type: ignore
+
 else:
     Protocol = object
 
@@ -71,23 +77,347 @@ class NaiveRWLock(RWLock):
         return self.lock
 
 
+class _LockTimer:
+    """The statistics of one lock; see :py:class:`TimedLock`."""
+
+    def __init__(self, name: str, metrics: Metrics) -> None:
+        self.name = name
+        self.metrics = metrics
+        self.contenders = 0
+        self._contenders_lock = threading.Lock()
+        _timers.add(self)
+
+    def hold(self, lock: Lock, reentrant: bool = False) -> _TimedHold:
+        return _TimedHold(self, lock, reentrant)
+
+
+_timers: weakref.WeakSet[_LockTimer] = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    # Another thread of the parent may have held it; that thread is gone.
+    for timer in list(_timers):
+        timer._contenders_lock = threading.Lock()  # pylint: disable=protected-access
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class _TimedHold:
+    def __init__(self, timer: _LockTimer, lock: Lock, reentrant: bool) -> None:
+        self.timer = timer
+        self.lock = lock
+        # A reentrant acquisition neither waits for nor blocks other threads.
+        self.contends = not reentrant
+        self.acquired = 0
+
+    def _leave(self) -> None:
+        if self.contends:
+            with self.timer._contenders_lock:  # pylint: disable=protected-access
+                self.timer.contenders -= 1
+
+    def __enter__(self) -> Optional[bool]:
+        timer = self.timer
+        contenders = 0
+        if self.contends:
+            with timer._contenders_lock:  # pylint: disable=protected-access
+                contenders = timer.contenders
+                timer.contenders += 1
+        start = time.perf_counter_ns()
+        try:
+            ret = self.lock.__enter__()
+        except BaseException:
+            self._leave()
+            raise
+        self.acquired = time.perf_counter_ns()
+        timer.metrics.observe("", f"{timer.name}_wait", self.acquired - start)
+        timer.metrics.increment("", f"{timer.name}_acquisitions")
+        if contenders:
+            # Threads of this process which were waiting for or holding the lock when we asked for it.
+            timer.metrics.increment("", f"{timer.name}_contended")
+            timer.metrics.increment("", f"{timer.name}_contenders", contenders)
+        return ret
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> Optional[bool]:
+        timer = self.timer
+        try:
+            return self.lock.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            timer.metrics.observe("", f"{timer.name}_hold", time.perf_counter_ns() - self.acquired)
+            self._leave()
+
+
+class TimedLock(Lock):
+    """Wrap a Lock to record how long it is waited for and held.
+
+    Each acquisition records the events ``{name}_wait`` and
+    ``{name}_hold`` and the counter ``{name}_acquisitions`` in
+    ``metrics`` (:py:data:`~charmonium.cache.metrics.global_metrics`
+    by default), under the function name ``""``. When other threads
+    of this process were already waiting for or holding the lock, it
+    also counts ``{name}_contended``, and adds the number of those
+    threads to ``{name}_contenders``. Waiting on other processes only
+    shows up in the wait time.
+
+    The wrapped lock may be reentrant.
+
+    """
+
+    def __init__(self, lock: Lock, name: str, metrics: Optional[Metrics] = None) -> None:
+        super().__init__()
+        self.lock = lock
+        self._timer = _LockTimer(name, metrics if metrics is not None else global_metrics)
+        self._holds = threading.local()
+
+    def __enter__(self) -> Optional[bool]:
+        if not hasattr(self._holds, "stack"):
+            self._holds.stack = []
+        hold = self._timer.hold(self.lock, reentrant=bool(self._holds.stack))
+        ret = hold.__enter__()
+        self._holds.stack.append(hold)
+        return ret
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> Optional[bool]:
+        return cast(_TimedHold, self._holds.stack.pop()).__exit__(exc_type, exc_val, exc_tb)
+
+
+class TimedRWLock(RWLock):
+    """Wrap an RWLock to time its reader and writer (see :py:class:`TimedLock`).
+
+    The reader is named ``{name}_reader`` and the writer ``{name}_writer``.
+
+    """
+
+    def __init__(self, rw_lock: RWLock, name: str, metrics: Optional[Metrics] = None) -> None:
+        super().__init__()
+        self.rw_lock = rw_lock
+        metrics = metrics if metrics is not None else global_metrics
+        self._reader_timer = _LockTimer(f"{name}_reader", metrics)
+        self._writer_timer = _LockTimer(f"{name}_writer", metrics)
+
+    @property
+    def reader(self) -> Lock:
+        return self._reader_timer.hold(self.rw_lock.reader)
+
+    @property
+    def writer(self) -> Lock:
+        return self._writer_timer.hold(self.rw_lock.writer)
+
+
 # pyright thinks attrs has ambiguous overload
 @dataclasses.dataclass
 class FileRWLock(RWLock):
     path: PathLikeFrom
 
-    _rw_lock: fasteners.InterProcessReaderWriterLock
+    _rw_lock: Optional[fasteners.InterProcessReaderWriterLock]
 
     def __init__(self, path: PathLikeFrom) -> None:
-        """Creates a lockfile at path."""
+        """Creates a lockfile at path (when it is first acquired)."""
         super().__init__()
         self.path = pathlike_from(path)
-        self._rw_lock = fasteners.InterProcessReaderWriterLock(cast(Path, self.path))
+        self._rw_lock = None
+
+    def _get_rw_lock(self) -> fasteners.InterProcessReaderWriterLock:
+        if self._rw_lock is None:
+            # fasteners is imported on first use, to keep `import charmonium.cache` fast.
+            import fasteners  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+            self._rw_lock = fasteners.InterProcessReaderWriterLock(cast(Path, self.path))
+        return self._rw_lock
 
     @property
     def writer(self) -> Lock:
-        return cast(Lock, self._rw_lock.write_lock())
+        return cast(Lock, self._get_rw_lock().write_lock())
 
     @property
     def reader(self) -> Lock:
-        return cast(Lock, self._rw_lock.read_lock())
+        return cast(Lock, self._get_rw_lock().read_lock())
+
+
+class RedisRWLock(RWLock):
+    """RWLock stored in a Redis (or Redis-protocol) server.
+
+    This lets processes on different machines share a MemoizedGroup
+    (e.g. with a :py:class:`~charmonium.cache.RedisObjStore`) without
+    a common filesystem.
+
+    The writer holds a key (set with ``NX``), and the readers are
+    members of a sorted set, scored by when they expire. A writer
+    blocks new readers, and then waits for the current readers to
+    finish. Every hold is a lease, expiring after ``lease`` seconds,
+    so a crashed process does not block the others forever; holds
+    must be shorter than that.
+
+    redis-py is imported at the first acquisition; install it with
+    the ``redis`` extra.
+
+    """
+
+    _client: Any
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        name: str = "charmonium.cache:lock",
+        lease: float = 60,
+        poll: float = 0.01,
+        client: Any = None,
+    ) -> None:
+        """
+        :param url: the URL of the server, passed to ``redis.Redis.from_url``.
+        :param name: the prefix of the Redis keys of this lock.
+        :param lease: the number of seconds after which a hold expires.
+        :param poll: the initial number of seconds to wait between attempts to acquire (this backs off).
+        :param client: a redis-py compatible client to use instead of connecting to ``url``. It is not pickled.
+        """
+        super().__init__()
+        self.url = url
+        self.name = name
+        self.lease = lease
+        self.poll = poll
+        self.__setstate__({})
+        self._client = client
+
+    def __getstate__(self) -> Any:
+        return {
+            attr: val
+            for attr, val in self.__dict__.items()
+            if attr not in {"_client", "_client_lock"}
+        }
+
+    def __setstate__(self, state: Any) -> None:
+        self.__dict__.update(state)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def with_name(self, name: str) -> RedisRWLock:
+        """A lock on the same server, with the same settings and client, under another ``name``."""
+        return RedisRWLock(self.url, name, self.lease, self.poll, client=self._client)
+
+    def _get_client(self) -> Any:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import redis  # pylint: disable=import-outside-toplevel
+
+                    self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    @property
+    def _writer_key(self) -> str:
+        return f"{self.name}:writer"
+
+    @property
+    def _readers_key(self) -> str:
+        return f"{self.name}:readers"
+
+    def _now(self) -> float:
+        # Use the server's clock, so that clients with skewed clocks agree on when leases expire.
+        seconds, microseconds = self._get_client().time()
+        return cast(float, seconds + microseconds / 1e6)
+
+    def _wait(self, attempt: int) -> None:
+        time.sleep(min(self.poll * 2 ** min(attempt, 10), 1) * random.uniform(0.5, 1.5))
+
+    def _acquire_reader(self, token: str) -> None:
+        import redis  # pylint: disable=import-outside-toplevel
+
+        client = self._get_client()
+        attempt = 0
+        while True:
+            with client.pipeline() as pipeline:
+                try:
+                    pipeline.watch(self._writer_key)
+                    if not pipeline.exists(self._writer_key):
+                        pipeline.multi()
+                        pipeline.zadd(self._readers_key, {token: self._now() + self.lease})
+                        pipeline.execute()
+                        return
+                except redis.WatchError:
+                    pass
+            self._wait(attempt)
+            attempt += 1
+
+    def _release_reader(self, token: str) -> None:
+        self._get_client().zrem(self._readers_key, token)
+
+    def _acquire_writer(self, token: str) -> None:
+        client = self._get_client()
+        lease_ms = int(self.lease * 1000)
+        attempt = 0
+        while not client.set(self._writer_key, token, nx=True, px=lease_ms):
+            self._wait(attempt)
+            attempt += 1
+        attempt = 0
+        while True:
+            # Forget readers whose leases expired.
+            client.zremrangebyscore(self._readers_key, "-inf", self._now())
+            if not client.zcard(self._readers_key):
+                return
+            self._wait(attempt)
+            attempt += 1
+
+    def _release_writer(self, token: str) -> None:
+        import redis  # pylint: disable=import-outside-toplevel
+
+        client = self._get_client()
+        with client.pipeline() as pipeline:
+            try:
+                pipeline.watch(self._writer_key)
+                holder = pipeline.get(self._writer_key)
+                if isinstance(holder, bytes):
+                    holder = holder.decode()
+                if holder == token:
+                    pipeline.multi()
+                    pipeline.delete(self._writer_key)
+                    pipeline.execute()
+            except redis.WatchError:
+                # Someone else took the key, so our lease had already expired.
+                pass
+
+    @property
+    def reader(self) -> Lock:
+        return _RedisLockHold(self, writer=False)
+
+    @property
+    def writer(self) -> Lock:
+        return _RedisLockHold(self, writer=True)
+
+
+class _RedisLockHold:
+    def __init__(self, rw_lock: RedisRWLock, writer: bool) -> None:
+        self.rw_lock = rw_lock
+        self.writer = writer
+        self.token = f"{random.getrandbits(128):032x}"
+
+    def __enter__(self) -> Optional[bool]:
+        # pylint: disable=protected-access
+        if self.writer:
+            self.rw_lock._acquire_writer(self.token)
+        else:
+            self.rw_lock._acquire_reader(self.token)
+        return None
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> Optional[bool]:
+        # pylint: disable=protected-access
+        if self.writer:
+            self.rw_lock._release_writer(self.token)
+        else:
+            self.rw_lock._release_reader(self.token)
+        return None
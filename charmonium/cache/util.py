@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import tempfile
 from pathlib import Path
 from typing import TYPE_CHECKING, Any, Callable, Generic, Optional, TypeVar, Union, cast
 
@@ -128,6 +127,8 @@ def temp_path(
     directory: Optional[Union[str, Path]] = None,
 ) -> Path:
     # TODO: Remove this function.
+    import tempfile  # pylint: disable=import-outside-toplevel
+
     temp_dir = Path(
         tempfile.TemporaryDirectory(
             suffix=suffix, prefix=prefix, dir=directory
@@ -145,3 +146,115 @@ def ellipsize(string: str, size: int, ellipsis: str = "...") -> str:
         break_point = (size - len(ellipsis)) // 2
         odd = int((size - len(ellipsis)) % 2)
         return string[: (break_point + odd)] + ellipsis + string[-break_point:]
+
+
+_SIZE_UNITS: dict[str, int] = {
+    "": 1,
+    "b": 1,
+    "byte": 1,
+    "bytes": 1,
+    **{
+        prefix + "b": 1000**power
+        for power, prefix in enumerate(["", "k", "m", "g", "t", "p", "e"])
+        if prefix
+    },
+    **{
+        prefix + "ib": 1024**power
+        for power, prefix in enumerate(["", "k", "m", "g", "t", "p", "e"])
+        if prefix
+    },
+}
+
+
+def parse_size(size: Union[int, str, Any]) -> int:
+    """Parse a size in bytes from an int, a string like ``"3 MiB"``, or a `bitmath.Bitmath`_.
+
+    .. code:: python
+
+        >>> parse_size(123)
+        123
+        >>> parse_size("10KiB")
+        10240
+        >>> parse_size("1.5 MB")
+        1500000
+
+    .. _`bitmath.Bitmath`: https://pypi.org/project/bitmath/
+
+    """
+    if isinstance(size, int):
+        return size
+    elif isinstance(size, str):
+        stripped = size.strip()
+        split = len(stripped)
+        while split > 0 and stripped[split - 1].isalpha():
+            split -= 1
+        number, unit = stripped[:split].strip(), stripped[split:].lower()
+        if unit not in _SIZE_UNITS:
+            raise ValueError(f"Unknown unit {unit!r} in size {size!r}")
+        return int(float(number) * _SIZE_UNITS[unit])
+    elif hasattr(size, "bytes"):
+        # Duck-type bitmath.Bitmath, so we don't have to import it.
+        return int(size.bytes)
+    else:
+        raise TypeError(f"Unable to interpret {size!r} as a size.")
+
+
+def format_size(size: int) -> str:
+    """Format a size in bytes with a binary prefix; the inverse of :py:func:`parse_size`.
+
+    .. code:: python
+
+        >>> format_size(123)
+        '123 B'
+        >>> format_size(10240)
+        '10.0 KiB'
+        >>> parse_size(format_size(3 * 1024**3))
+        3221225472
+
+    """
+    if abs(size) < 1024:
+        return f"{size} B"
+    value = float(size)
+    units = ["KiB", "MiB", "GiB", "TiB", "PiB", "EiB"]
+    for unit in units:
+        value /= 1024
+        if abs(value) < 1024 or unit == units[-1]:
+            break
+    return f"{value:.1f} {unit}"
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration for humans, with the most significant unit.
+
+    .. code:: python
+
+        >>> format_duration(0.0000123)
+        '12.3 us'
+        >>> format_duration(0.5)
+        '500.0 ms'
+        >>> format_duration(12.34)
+        '12.3 s'
+        >>> format_duration(123)
+        '2 min 3 s'
+        >>> format_duration(7380)
+        '2 h 3 min'
+        >>> format_duration(-0.5)
+        '-500.0 ms'
+
+    """
+    if seconds < 0:
+        return "-" + format_duration(-seconds)
+    elif seconds == 0:
+        return "0 s"
+    elif seconds < 1e-6:
+        return f"{seconds * 1e9:.0f} ns"
+    elif seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    elif seconds < 1:
+        return f"{seconds * 1e3:.1f} ms"
+    elif seconds < 60:
+        return f"{seconds:.1f} s"
+    elif seconds < 3600:
+        return f"{int(seconds // 60)} min {int(seconds % 60)} s"
+    else:
+        return f"{int(seconds // 3600)} h {int(seconds % 3600 // 60)} min"
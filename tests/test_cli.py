@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import json
+import pickle
+import sys
+import types
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from charmonium.cache import DirObjStore, FileRWLock, MemoizedGroup, memoize
+from charmonium.cache._cli import Opaque, OpaquePickler, main
+
+
+def run(capsys: pytest.CaptureFixture[str], *argv: str) -> tuple[int, Any]:
+    with pytest.raises(SystemExit) as exc_info:
+        main(["--json", *argv])
+    code = exc_info.value.code
+    assert isinstance(code, int)
+    return code, json.loads(capsys.readouterr().out)
+
+
+def test_opaque_pickler() -> None:
+    module = types.ModuleType("user_module_for_test_cli")
+    exec(  # pylint: disable=exec-used
+        "class Point:\n    def __init__(self, x, y):\n        self.x, self.y = x, y\n",
+        module.__dict__,
+    )
+    sys.modules[module.__name__] = module
+    try:
+        original = pickle.dumps({"point": module.Point(1, [2, 3]), "n": 4})
+    finally:
+        del sys.modules[module.__name__]
+
+    loaded = OpaquePickler().loads(original)
+    assert isinstance(loaded["point"], Opaque)
+    assert loaded["n"] == 4
+    assert module.__name__ not in sys.modules, "Should not import user code"
+
+    round_tripped = OpaquePickler().dumps(loaded)
+    sys.modules[module.__name__] = module
+    try:
+        point = pickle.loads(round_tripped)["point"]
+    finally:
+        del sys.modules[module.__name__]
+    assert (point.x, point.y) == (1, [2, 3])
+
+    reloaded = OpaquePickler().loads(round_tripped)
+    assert repr(reloaded["point"]) == f"<opaque {module.__name__}.Point>"
+    assert module.__name__ not in sys.modules, "Should not import user code, even after the CLI re-pickles it"
+
+
+def test_cli(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    cache_dir = tmp_path / "cache"
+    group = MemoizedGroup(
+        obj_store=DirObjStore(cache_dir),
+        lock=FileRWLock(cache_dir / ".lock"),
+        size="1 MiB",
+    )
+
+    @memoize(group=group)
+    def big(x: int) -> bytes:
+        return bytes(x * 1000)
+
+    for x in range(1, 6):
+        big(x)
+    group.commit()
+
+    code, stats = run(capsys, "--dir", str(cache_dir), "stats")
+    assert code == 0
+    assert stats["entries"] == 5
+    assert stats["functions"][big.name]["entries"] == 5
+
+    code, listing = run(capsys, "--dir", str(cache_dir), "ls", "largest", "-n", "2")
+    assert [item["bytes"] for item in listing] == sorted((item["bytes"] for item in listing), reverse=True)
+    assert len(listing) == 2
+
+    code, listing = run(capsys, "--dir", str(cache_dir), "ls", "coldest")
+    assert len(listing) == 5
+
+    code, result = run(capsys, "--dir", str(cache_dir), "verify", "--deep")
+    assert code == 0 and not result["problems"]
+
+    # Delete an object behind the index's back.
+    obj_store = DirObjStore(cache_dir)
+    victim = next(key for key in obj_store if key >= (1 << 48))
+    del obj_store[victim]
+    code, result = run(capsys, "--dir", str(cache_dir), "verify")
+    assert code == 1 and len(result["problems"]) == 1
+    code, result = run(capsys, "--dir", str(cache_dir), "verify", "--fix")
+    assert code == 0
+    code, stats = run(capsys, "--dir", str(cache_dir), "stats")
+    assert stats["entries"] == 4
+
+    obj_store[(1 << 100) + 1] = b"orphan"
+    code, result = run(capsys, "--dir", str(cache_dir), "remove-orphans")
+    assert result["removed"] == 1
+
+    code, result = run(capsys, "--dir", str(cache_dir), "evict", "5000")
+    assert result["evicted"] >= 1
+    code, stats = run(capsys, "--dir", str(cache_dir), "stats")
+    assert stats["bytes"] <= 5000
+
+    code, result = run(capsys, "--dir", str(cache_dir), "compact")
+    assert code == 0
+    code, stats2 = run(capsys, "--dir", str(cache_dir), "stats")
+    assert stats2["entries"] == stats["entries"]
@@ -29,7 +29,8 @@ def double(infilename: str) -> str:
 
 def test_filecontents() -> None:
     path = temp_path()
-    double.group = MemoizedGroup(obj_store=DirObjStore(path), temporary=True)
+    path.mkdir()
+    double.group = MemoizedGroup(obj_store=DirObjStore(temp_path()), temporary=True)
 
     file1 = cast(str, FileContents(path / "file1"))
 
@@ -53,7 +54,8 @@ def test_filecontents() -> None:
 
 def test_filecontents_empty() -> None:
     path = temp_path()
-    double.group = MemoizedGroup(obj_store=DirObjStore(path), temporary=True)
+    path.mkdir()
+    double.group = MemoizedGroup(obj_store=DirObjStore(temp_path()), temporary=True)
     file2 = cast(str, FileContents(path / "file2"))
     double(file2)
 
@@ -0,0 +1,22 @@
+import subprocess
+import sys
+
+LAZY_MODULES = ["bitmath", "fasteners", "charmonium.freeze", "json", "shutil", "tempfile"]
+
+
+def test_import_time() -> None:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import charmonium.cache"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Each line of `-X importtime` is "import time: self [us] | cumulative | imported package"
+    imported = {
+        line.split("|")[2].strip(): int(line.split("|")[1])
+        for line in proc.stderr.splitlines()
+        if line.startswith("import time:") and "cumulative" not in line
+    }
+    print(f"import charmonium.cache took {imported['charmonium.cache'] / 1e3:.1f}ms")
+    for module in LAZY_MODULES:
+        assert module not in imported, f"{module} should be imported lazily, on first use"
@@ -1,11 +1,18 @@
+import pickle
+from typing import Type, Union
+
 import pytest
 
-from charmonium.cache.index import Index, IndexKeyType
+from charmonium.cache.index import FlatIndex, Index, IndexKeyType
 from charmonium.cache.util import Constant
 
+IndexClass = Union[Type[Index[int, str]], Type[FlatIndex[int, str]]]
+index_classes = pytest.mark.parametrize("index_class", [Index, FlatIndex])
+
 
-def test_index() -> None:
-    index = Index[int, str](
+@index_classes
+def test_index(index_class: IndexClass) -> None:
+    index = index_class(
         (
             IndexKeyType.MATCH,
             IndexKeyType.LOOKUP,
@@ -32,8 +39,9 @@ def test_index() -> None:
     }, "A different match var should invalidate children"
 
 
-def test_index_del() -> None:
-    index = Index[int, str](
+@index_classes
+def test_index_del(index_class: IndexClass) -> None:
+    index = index_class(
         (
             IndexKeyType.MATCH,
             IndexKeyType.LOOKUP,
@@ -48,8 +56,9 @@ def test_index_del() -> None:
     assert set(index.items()) == {((0, 2, 4), "hello1")}, "__delitem__ works"
 
 
-def test_thunk() -> None:
-    index = Index[int, str](
+@index_classes
+def test_thunk(index_class: IndexClass) -> None:
+    index = index_class(
         (
             IndexKeyType.MATCH,
             IndexKeyType.LOOKUP,
@@ -65,8 +74,9 @@ def test_thunk() -> None:
     assert set(index.items()) == {((0, 3, 4), "hello3")}
 
 
-def test_contains() -> None:
-    index = Index[int, str](
+@index_classes
+def test_contains(index_class: IndexClass) -> None:
+    index = index_class(
         (
             IndexKeyType.MATCH,
             IndexKeyType.LOOKUP,
@@ -78,8 +88,9 @@ def test_contains() -> None:
     assert (0, 3, 5) not in index
 
 
-def test_raises_wrong_schema() -> None:
-    index = Index[int, str](
+@index_classes
+def test_raises_wrong_schema(index_class: IndexClass) -> None:
+    index = index_class(
         (
             IndexKeyType.MATCH,
             IndexKeyType.LOOKUP,
@@ -89,13 +100,14 @@ def test_raises_wrong_schema() -> None:
     with pytest.raises(ValueError):
         index[(1, 2)] = "hello5"
 
-    index2 = Index[int, str]((IndexKeyType.MATCH, IndexKeyType.LOOKUP))
+    index2 = index_class((IndexKeyType.MATCH, IndexKeyType.LOOKUP))
     with pytest.raises(ValueError):
         index.update(index2)
 
 
-def test_update() -> None:
-    old = Index[int, str](
+@index_classes
+def test_update(index_class: IndexClass) -> None:
+    old = index_class(
         (
             IndexKeyType.MATCH,
             IndexKeyType.LOOKUP,
@@ -105,7 +117,7 @@ def test_update() -> None:
     old[(1, 2, 3)] = "old"
     old[(1, 3, 3)] = "old"
 
-    new = Index[int, str](old.schema)
+    new = index_class(old.schema)
     new[(1, 2, 3)] = "new"
     new[(1, 4, 3)] = "new"
 
@@ -113,3 +125,78 @@ def test_update() -> None:
     assert old[(1, 2, 3)] == "old", "update() should not overwrite when they conflict"
     assert old[(1, 3, 3)] == "old", "keys not in new are unaffected"
     assert old[(1, 4, 3)] == "new", "keys in new and not in old are brought over to old"
+
+
+@index_classes
+def test_deleter(index_class: IndexClass) -> None:
+    deleted: list[tuple[tuple[int, ...], str]] = []
+    index = index_class(
+        (
+            IndexKeyType.MATCH,
+            IndexKeyType.LOOKUP,
+            IndexKeyType.MATCH,
+        ),
+        deleted.append,
+    )
+    index[(0, 2, 4)] = "hello1"
+    index[(0, 3, 4)] = "hello2"
+    index[(0, 3, 5)] = "hello3"
+    assert deleted == [((0, 3, 4), "hello2")], "A different match var should call the deleter"
+    index[(1, 3, 4)] = "hello4"
+    assert sorted(deleted) == [
+        ((0, 2, 4), "hello1"),
+        ((0, 3, 4), "hello2"),
+        ((0, 3, 5), "hello3"),
+    ], "A different match var should call the deleter on all children"
+    assert set(index.items()) == {((1, 3, 4), "hello4")}
+
+
+def test_flat_index_pickle() -> None:
+    index = FlatIndex[int, str](
+        (
+            IndexKeyType.MATCH,
+            IndexKeyType.LOOKUP,
+            IndexKeyType.MATCH,
+        )
+    )
+    index[(0, 2, 4)] = "hello1"
+    index[(0, 3, 4)] = "hello2"
+    index2 = pickle.loads(pickle.dumps(index))
+    assert set(index2.items()) == set(index.items())
+    index2[(1, 2, 4)] = "hello3"
+    assert set(index2.items()) == {((1, 2, 4), "hello3")}, "Secondary maps should be rebuilt after unpickling"
+
+
+@index_classes
+def test_update_conflict(index_class: IndexClass) -> None:
+    deleted: list[tuple[tuple[int, ...], str]] = []
+    index = index_class(
+        (
+            IndexKeyType.MATCH,
+            IndexKeyType.LOOKUP,
+            IndexKeyType.MATCH,
+        ),
+        deleted.append,
+    )
+    index[(0, 2, 3)] = "old"
+
+    new = index_class(index.schema)
+    new[(1, 2, 3)] = "new"
+    new[(1, 4, 3)] = "new"
+    index.update(new)
+    assert set(index.items()) == {((1, 2, 3), "new"), ((1, 4, 3), "new")}, "other should win a conflict"
+    assert deleted == [((0, 2, 3), "old")], "The replaced entries of self should be passed to the deleter"
+
+
+def test_flat_index_filter() -> None:
+    index = FlatIndex[int, str](
+        (
+            IndexKeyType.MATCH,
+            IndexKeyType.LOOKUP,
+            IndexKeyType.MATCH,
+        )
+    )
+    index[(1, 2, 3)] = "new"
+    filtered = index.filter(lambda keys, val: keys[1] == 4)
+    assert not list(filtered.items())
+    assert set(index.subset([(1, 2, 3), (1, 5, 3)]).items()) == {((1, 2, 3), "new")}
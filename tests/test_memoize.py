@@ -2,13 +2,18 @@ from __future__ import annotations
 
 import logging
 import pickle
-from typing import Any
+from typing import Any, Callable, cast
 import copy
 import logging
+import os
+import sys
+import threading
+import time
 
 import pytest
 
-from charmonium.cache import DEFAULT_FREEZE_CONFIG, DirObjStore, MemoizedGroup, memoize
+from charmonium.cache import DEFAULT_FREEZE_CONFIG, DirObjStore, GDSize, Lock, Memoized, MemoizedGroup, ReplacementPolicy, memoize
+from charmonium.cache.replacement_policies import Entry
 from charmonium.cache.util import temp_path
 
 # import from __init__ because this is an integration test.
@@ -101,6 +106,54 @@ def test_eviction(use_obj_store: bool) -> None:
     assert big_fn.would_hit(3)
 
 
+def test_function_quotas() -> None:
+    group = MemoizedGroup(
+        obj_store=DirObjStore(temp_path()),
+        fine_grain_eviction=True,
+        size="4096B",
+        function_quotas={"big_fn": "1024B"},
+        function_reservations={"small_fn": "512B"},
+        temporary=True,
+    )
+
+    @memoize(group=group, name="big_fn")
+    def big_fn(x: int) -> bytes:
+        return b"\0" * x
+
+    @memoize(group=group, name="small_fn")
+    def small_fn(x: int) -> bytes:
+        return b"\0" * x
+
+    small_fn(100)
+    small_fn(101)
+    big_fn(600)
+    big_fn(601)
+    assert not (big_fn.would_hit(600) and big_fn.would_hit(601)), "big_fn should be held to its quota"
+    assert small_fn.would_hit(100) and small_fn.would_hit(101), "small_fn should not pay for big_fn's quota"
+
+    big_fn(3000)
+    assert small_fn.would_hit(100) and small_fn.would_hit(101), "small_fn's reservation should be respected"
+
+    @memoize(group=group, name="other_fn")
+    def other_fn(x: int) -> bytes:
+        return b"\0" * x
+
+    policy = cast(GDSize, group._replacement_policy)  # pylint: disable=protected-access
+    inflation = policy.inflation
+    for x in range(1500, 1505):
+        other_fn(x)
+    assert small_fn.would_hit(100) and small_fn.would_hit(101), "small_fn's reservation should be respected"
+    assert policy.inflation > inflation, "Evicting from the shared budget should age the cache"
+
+    with pytest.raises(ValueError):
+        MemoizedGroup(
+            obj_store=DirObjStore(temp_path()),
+            size="1024B",
+            function_reservations={"small_fn": "2048B"},
+            temporary=True,
+        )
+
+
 def test_verbose(caplog: pytest.LogCaptureFixture) -> None:
     caplog.set_level(logging.DEBUG, "charmonium.cache.ops")
 
@@ -154,9 +207,9 @@ def test_read_write_cycle() -> None:
     double(2)
 
     # This will be the different copy.
-    double.group._version += 1
+    double.group._shards[0].version += 1
     double.group._index_write(0)  # pylint: disable=protected-access
-    double.group._version -= 1
+    double.group._shards[0].version -= 1
 
     # Call
     double(3)
@@ -169,3 +222,347 @@ def test_read_write_cycle() -> None:
     assert double(2) == 4
     assert double.would_hit(3)
     assert double(3) == 6
+
+
+class CountingRWLock:
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.writes = 0
+
+    @property
+    def reader(self) -> Lock:
+        return self.lock
+
+    @property
+    def writer(self) -> Lock:
+        self.writes += 1
+        return self.lock
+
+
+@pytest.mark.parametrize("persist_access_times", [True, False])
+def test_dirty(persist_access_times: bool) -> None:
+    lock = CountingRWLock()
+
+    @memoize(
+        group=MemoizedGroup(
+            obj_store=DirObjStore(temp_path()),
+            lock=lock,
+            persist_access_times=persist_access_times,
+            temporary=True,
+        ),
+    )
+    def double(x: int) -> int:
+        return x * 2
+
+    double.group.commit()
+    assert lock.writes == 0, "Nothing changed, so nothing should be written"
+
+    double(2)
+    double.group.commit()
+    assert lock.writes == 1
+
+    double(2)
+    double.group.commit()
+    assert lock.writes == (2 if persist_access_times else 1), "A hit only needs a write if access times are persisted"
+
+
+@pytest.mark.parametrize(
+    "group_kwargs",
+    [{"persistence_entries": 2}, {"persistence_interval": 0.05}],
+)
+def test_medium_grain_persistence(group_kwargs: dict[str, Any]) -> None:
+    lock = CountingRWLock()
+
+    @memoize(
+        group=MemoizedGroup(
+            obj_store=DirObjStore(temp_path()),
+            lock=lock,
+            temporary=True,
+            **group_kwargs,
+        ),
+    )
+    def double(x: int) -> int:
+        return x * 2
+
+    double(2)
+    double(3)
+    deadline = time.monotonic() + 5
+    while double.group._dirty and time.monotonic() < deadline:  # pylint: disable=protected-access
+        time.sleep(0.01)
+    assert not double.group._dirty, "The background thread should have committed the index"  # pylint: disable=protected-access
+    assert lock.writes == 1
+
+    if hasattr(os, "fork"):
+        pid = os.fork()
+        if pid == 0:
+            # The child has no persister thread; exit with whether it started one and committed.
+            try:
+                # A parent thread may have been holding the log stream's lock when it forked.
+                logging.disable(logging.CRITICAL)
+                double(4)
+                double(5)
+                deadline = time.monotonic() + 5
+                while double.group._dirty and time.monotonic() < deadline:  # pylint: disable=protected-access
+                    time.sleep(0.01)
+                os._exit(1 if double.group._dirty else 0)  # pylint: disable=protected-access
+            finally:
+                os._exit(2)
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0, "A forked child should persist in the background too"
+
+
+def test_commit_on_excepthook() -> None:
+    obj_store = DirObjStore(temp_path())
+    group = MemoizedGroup(obj_store=obj_store, lock=CountingRWLock(), temporary=True)
+    double = memoize(group=group, name="double")(lambda x: x * 2)
+    double(2)
+    assert group._dirty  # pylint: disable=protected-access
+
+    try:
+        raise RuntimeError("uncaught")
+    except RuntimeError:
+        sys.excepthook(*sys.exc_info())
+    assert not group._dirty, "An uncaught exception should commit the group"  # pylint: disable=protected-access
+    peer_group = MemoizedGroup(obj_store=obj_store, lock=CountingRWLock(), temporary=True)
+    assert memoize(group=peer_group, name="double")(lambda x: x * 2).would_hit(2)
+
+
+def test_sharded_index() -> None:
+    locks = {shard: CountingRWLock() for shard in range(4)}
+    obj_store = DirObjStore(temp_path())
+
+    def make_group() -> MemoizedGroup:
+        return MemoizedGroup(
+            obj_store=obj_store,
+            index_shards=4,
+            shard_lock=locks.__getitem__,
+            temporary=True,
+        )
+
+    group = make_group()
+    names = [f"func{i}" for i in range(20)]
+    name_a = names[0]
+    shard_a = group._shard_of_name(name_a)  # pylint: disable=protected-access
+    name_b = next(
+        name
+        for name in names
+        if group._shard_of_name(name) != shard_a  # pylint: disable=protected-access
+    )
+    shard_b = group._shard_of_name(name_b)  # pylint: disable=protected-access
+
+    def double(x: int) -> int:
+        return x * 2
+
+    def triple(x: int) -> int:
+        return x * 3
+
+    memoize(group=group, name=name_a)(double)(2)
+    group.commit()
+    assert (locks[shard_a].writes, locks[shard_b].writes) == (1, 0)
+
+    memoize(group=group, name=name_b)(triple)(2)
+    group.commit()
+    assert (locks[shard_a].writes, locks[shard_b].writes) == (1, 1), "Only the dirty shard should be written"
+
+    # A peer process only reads the shard of the function it calls.
+    peer_group = make_group()
+    assert memoize(group=peer_group, name=name_a)(double).would_hit(2)
+    assert peer_group._shards[shard_a].loaded  # pylint: disable=protected-access
+    assert not peer_group._shards[shard_b].loaded  # pylint: disable=protected-access
+    assert memoize(group=peer_group, name=name_b)(triple).would_hit(2)
+
+    class UnshardablePolicy(GDSize):
+        def filter(self, predicate: Callable[[Any, Entry], bool]) -> GDSize:
+            return cast(GDSize, ReplacementPolicy.filter(self, predicate))
+
+    with pytest.raises(ValueError):
+        MemoizedGroup(obj_store=obj_store, index_shards=4, replacement_policy=UnshardablePolicy())
+
+
+def test_index_deltas(monkeypatch: pytest.MonkeyPatch) -> None:
+    obj_store = DirObjStore(temp_path())
+
+    def make_group() -> MemoizedGroup:
+        return MemoizedGroup(obj_store=obj_store, lock=CountingRWLock(), index_deltas=2, temporary=True)
+
+    group = make_group()
+    peer_group = make_group()
+
+    def double(x: int) -> int:
+        return x * 2
+
+    memoized_double = memoize(group=group, name="double")(double)
+    peer_double = memoize(group=peer_group, name="double")(double)
+
+    memoized_double(1)
+    group.commit()
+    assert peer_double.would_hit(1)
+
+    memoized_double(2)
+    group.commit()
+    assert len(group._shards[0].deltas) == 1  # pylint: disable=protected-access
+
+    def no_snapshot(snapshot: Any) -> None:
+        raise AssertionError("An up-to-date reader should only read the delta")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(peer_group, "_merge_snapshot", no_snapshot)
+        peer_group.refresh()
+    assert peer_double.would_hit(2)
+
+    memoized_double(3)
+    group.commit()
+    memoized_double(4)
+    group.commit()
+    assert not group._shards[0].deltas, "The third write should compact the deltas"  # pylint: disable=protected-access
+    assert len(list(obj_store)) == 4 + 2, "Old snapshots and deltas should be deleted"
+
+    peer_group.refresh()
+    assert all(peer_double.would_hit(x) for x in range(1, 5))
+
+
+def test_two_groups_same_key() -> None:
+    obj_store = DirObjStore(temp_path())
+    lock = CountingRWLock()
+
+    def double(x: int) -> int:
+        return x * 2
+
+    def make_double(version: int) -> Memoized[[int], int]:
+        group = MemoizedGroup(obj_store=obj_store, lock=lock, temporary=True)
+        return memoize(group=group, name="double", extra_func_state=lambda func: version)(double)
+
+    doubles = [make_double(1), make_double(1)]
+    for memoized_double in doubles:
+        assert memoized_double(2) == 4
+    for memoized_double in doubles:
+        memoized_double.group.commit()
+    assert all(make_double(1).would_hit(2) for _ in range(2)), "Storing the same key twice should keep it"
+
+    # A process running a newer version commits before a stale one.
+    stale, new = doubles[0], make_double(2)
+    new(2)
+    new.group.commit()
+    stale(3)
+    stale.group.commit()
+    assert make_double(2).would_hit(2), "A stale group should not delete a peer's newer entries"
+    assert not make_double(1).would_hit(3)
+
+
+def test_threads() -> None:
+    group = MemoizedGroup(
+        obj_store=DirObjStore(temp_path()),
+        lock=CountingRWLock(),
+        persistence_entries=5,
+        temporary=True,
+    )
+
+    @memoize(group=group)
+    def square(x: int) -> int:
+        return x**2
+
+    errors: list[BaseException] = []
+
+    def worker(offset: int) -> None:
+        try:
+            for i in range(100):
+                x = (i + offset) % 20
+                assert square(x) == x**2
+        except BaseException as exc:  # pylint: disable=broad-except
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    group.commit()
+    assert not group._dirty  # pylint: disable=protected-access
+    assert all(square.would_hit(x) for x in range(20))
+
+
+class UnusableRWLock:
+    @property
+    def reader(self) -> Lock:
+        raise AssertionError("A read_only group should not take the lock")
+
+    @property
+    def writer(self) -> Lock:
+        raise AssertionError("A read_only group should not take the lock")
+
+
+def test_read_only() -> None:
+    obj_store = DirObjStore(temp_path())
+
+    def double(x: int) -> int:
+        return x * 2
+
+    writer_group = MemoizedGroup(obj_store=obj_store, lock=CountingRWLock(), temporary=True)
+    memoize(group=writer_group, name="double")(double)(2)
+    writer_group.commit()
+    contents = {key: obj_store[key] for key in obj_store}
+
+    with pytest.raises(ValueError):
+        MemoizedGroup(obj_store=obj_store, read_only=True, temporary=True)
+    reader_group = MemoizedGroup(obj_store=obj_store, lock=UnusableRWLock(), read_only=True)
+    reader_double = memoize(group=reader_group, name="double")(double)
+    assert reader_double.would_hit(2)
+    assert reader_double(2) == 4
+    assert reader_double(3) == 6
+    assert not reader_double.would_hit(3), "A read_only group should not store misses"
+    reader_group.commit()
+    assert {key: obj_store[key] for key in obj_store} == contents
+
+
+def test_read_only_concurrent_writer() -> None:
+    obj_store = DirObjStore(temp_path())
+    lock = CountingRWLock()
+
+    def double(x: int) -> int:
+        return x * 2
+
+    writer_group = MemoizedGroup(obj_store=obj_store, lock=lock, index_deltas=2, temporary=True)
+    writer_double = memoize(group=writer_group, name="double")(double)
+    writer_double(0)
+    writer_group.commit()
+    reader_group = MemoizedGroup(obj_store=obj_store, lock=lock, read_only=True)
+    reader_double = memoize(group=reader_group, name="double")(double)
+
+    done = threading.Event()
+    errors: list[BaseException] = []
+
+    def writer() -> None:
+        try:
+            for x in range(1, 200):
+                writer_double(x)
+                writer_group.commit()
+        except BaseException as exc:  # pylint: disable=broad-except
+            errors.append(exc)
+        finally:
+            done.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while not done.is_set():
+        reader_group.refresh()
+        assert reader_double.would_hit(0)
+    thread.join()
+    assert not errors
+    reader_group.refresh()
+    assert reader_double.would_hit(199)
+
+
+def test_lazy_group() -> None:
+    obj_store_path = temp_path()
+    group = MemoizedGroup(obj_store=DirObjStore(obj_store_path), temporary=True)
+
+    @memoize(group=group)
+    def double(x: int) -> int:
+        return x * 2
+
+    assert not obj_store_path.exists(), "Defining a memoized function should not touch storage"
+    assert not group._shards[0].loaded  # pylint: disable=protected-access
+    double(2)
+    assert group._shards[0].loaded  # pylint: disable=protected-access
+    assert double.would_hit(2)
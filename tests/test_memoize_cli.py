@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from charmonium.cache import _memoize_cli
+from charmonium.cache._memoize_cli import parse_strace
+from charmonium.cache._cli import main as cache_main
+
+
+def memoize_cli(
+    tmp_path: Path, *argv: str, stdin: bytes = b"", cwd: Optional[Path] = None
+) -> subprocess.CompletedProcess[bytes]:
+    return subprocess.run(
+        [sys.executable, "-m", "charmonium.cache._memoize_cli", "--obj-store", str(tmp_path / "cache"), *argv],
+        input=stdin,
+        capture_output=True,
+        cwd=tmp_path if cwd is None else cwd,
+        # The command runs in another directory, so make sure it imports this charmonium.cache.
+        env={**os.environ, "PYTHONPATH": str(Path(__file__).resolve().parents[1])},
+        check=False,
+    )
+
+
+def test_parse_strace(tmp_path: Path) -> None:
+    trace = [
+        '101 openat(AT_FDCWD, "/etc/ld.so.cache", O_RDONLY|O_CLOEXEC) = 3',
+        '101 openat(AT_FDCWD, "in.txt", O_RDONLY) = 3',
+        '101 openat(AT_FDCWD, "missing.txt", O_RDONLY) = -1 ENOENT (No such file or directory)',
+        '102 openat(AT_FDCWD, "out.txt", O_WRONLY|O_CREAT|O_TRUNC, 0666 <unfinished ...>',
+        '101 creat("other\\\\out.txt", 0644) = 4',
+        "102 <... openat resumed>) = 3",
+    ]
+    reads, writes = parse_strace(trace, tmp_path)
+    assert reads == {Path("/etc/ld.so.cache"), tmp_path / "in.txt"}
+    assert writes == {tmp_path / "out.txt", tmp_path / "other\\out.txt"}
+
+
+def test_memoize_cli(tmp_path: Path) -> None:
+    (tmp_path / "in.txt").write_text("hello\n")
+    script = "cat in.txt > out.txt; echo ran >&2; cat -"
+    argv = ["--no-trace", "--input", "in.txt", "--output", "out.txt", "--", "sh", "-c", script]
+
+    first = memoize_cli(tmp_path, *argv, stdin=b"stdin\n")
+    assert first.returncode == 0, first.stderr
+    assert first.stdout == b"stdin\n"
+    assert (tmp_path / "out.txt").read_text() == "hello\n"
+
+    # A hit restores the output file and replays stdout and stderr.
+    (tmp_path / "out.txt").unlink()
+    second = memoize_cli(tmp_path, "--verbose", *argv, stdin=b"stdin\n")
+    assert second.returncode == 0, second.stderr
+    assert b"memoize: hit" in second.stderr
+    assert second.stdout == b"stdin\n"
+    assert (tmp_path / "out.txt").read_text() == "hello\n"
+
+    # Changing an input misses.
+    (tmp_path / "in.txt").write_text("world\n")
+    third = memoize_cli(tmp_path, "--verbose", *argv, stdin=b"stdin\n")
+    assert b"memoize: miss" in third.stderr
+    assert (tmp_path / "out.txt").read_text() == "world\n"
+
+    # The same relative paths in another directory are other files.
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "in.txt").write_text("world\n")
+    other = memoize_cli(tmp_path, "--verbose", *argv, stdin=b"stdin\n", cwd=tmp_path / "other")
+    assert b"memoize: miss" in other.stderr
+    assert (tmp_path / "other" / "out.txt").read_text() == "world\n"
+
+    # Failures are passed through, and not stored.
+    failed = memoize_cli(tmp_path, "--no-trace", "--", "sh", "-c", "echo no; exit 3")
+    assert (failed.returncode, failed.stdout) == (3, b"no\n")
+
+
+def test_memoize_cli_traced_inputs(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    (tmp_path / "in.txt").write_text("hello\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "stdin", None)
+    # Pretend that strace saw the command read in.txt, which it could not know before the first run.
+    traced: tuple[set[Path], set[Path]] = ({tmp_path / "in.txt"}, set())
+    monkeypatch.setattr(_memoize_cli, "_execute", lambda command, stdin, trace: (0, b"out\n", b"", traced))
+    _memoize_cli.main(["--obj-store", str(tmp_path / "cache"), "--", "true"])
+    assert capsys.readouterr().out == "out\n"
+
+    with pytest.raises(SystemExit):
+        cache_main(["--json", "--dir", str(tmp_path / "cache"), "stats"])
+    assert json.loads(capsys.readouterr().out)["entries"] == 1, "Should only store the result under the traced inputs"
+
+
+@pytest.mark.skipif(not shutil.which("strace"), reason="strace is not installed")
+def test_memoize_cli_trace(tmp_path: Path) -> None:
+    (tmp_path / "in.txt").write_text("hello\n")
+    argv = ["--verbose", "--", "sh", "-c", "cat in.txt > out.txt"]
+    assert b"memoize: miss" in memoize_cli(tmp_path, *argv).stderr
+    assert b"memoize: hit" in memoize_cli(tmp_path, *argv).stderr
+    (tmp_path / "in.txt").write_text("world\n")
+    assert b"memoize: miss" in memoize_cli(tmp_path, *argv).stderr
+    assert (tmp_path / "out.txt").read_text() == "world\n"
@@ -0,0 +1,178 @@
+import json
+import logging
+import sys
+import threading
+import urllib.request
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from charmonium.cache import DirObjStore, MemoizedGroup, PrometheusExporter, memoize
+from charmonium.cache.metrics import CallSampler, Histogram, Metrics, global_metrics, global_sampler
+from charmonium.cache.util import temp_path
+
+
+def test_histogram() -> None:
+    histogram = Histogram()
+    for duration_ns in [1, 3, 1000, 1000, 10**6]:
+        histogram.observe(duration_ns)
+    assert histogram.count == 5
+    assert histogram.total_ns == 1 + 3 + 1000 + 1000 + 10**6
+    assert histogram.max_ns == 10**6
+    # Quantiles are upper bounds, within a factor of 2.
+    assert 1000 <= histogram.quantile(0.5) < 2000
+    assert histogram.quantile(1.0) == 10**6
+    count, total_ns, max_ns, buckets = histogram.compact()
+    assert (count, total_ns, max_ns) == (5, histogram.total_ns, 10**6)
+    assert sum(buckets.values()) == 5
+
+
+def test_metrics_flush(caplog: pytest.LogCaptureFixture) -> None:
+    metrics = Metrics(flush_interval=0, drain_events=1)
+    with caplog.at_level(logging.INFO, logger="charmonium.cache.perf"):
+        metrics.increment("f", "hits")
+        metrics.observe("f", "hash", 1234)
+    records = [
+        json.loads(record.getMessage())
+        for record in caplog.records
+        if record.name == "charmonium.cache.perf" and record.levelno == logging.INFO
+    ]
+    assert records, "Should flush at every drain, since flush_interval is 0"
+    assert records[-1]["functions"]["f"]["hits"] == 1
+    assert records[-1]["functions"]["f"]["hash"][:3] == [1, 1234, 1234]
+
+
+def test_metrics_threads() -> None:
+    metrics = Metrics(drain_events=10)
+
+    def work() -> None:
+        for _ in range(25):
+            metrics.increment("f", "hits")
+            metrics.observe("f", "hash", 1)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    work()
+    histograms, counters = metrics.snapshot()
+    assert counters[("f", "hits")] == 125, "Should merge the undrained buffers of every thread"
+    assert histograms[("f", "hash")].count == 125
+    metrics.reset()
+    assert metrics.snapshot() == ({}, {})
+
+
+def test_memoize_metrics() -> None:
+    @memoize(group=MemoizedGroup(obj_store=DirObjStore(temp_path()), temporary=True))
+    def square(x: int) -> int:
+        return x**2
+
+    global_metrics.reset()
+    square(2)
+    square(2)
+    histograms, counters = global_metrics.snapshot()
+    assert counters[(square.name, "misses")] == 1
+    assert counters[(square.name, "hits")] == 1
+    assert histograms[(square.name, "hash")].count == 2
+    assert histograms[(square.name, "obj_load")].count == 2
+    assert histograms[(square.name, "outer_function")].count == 2
+    assert histograms[(square.name, "serialize")].count == 1
+    assert counters[("", "memory_lock_acquisitions")] >= 1
+    assert ("", "index_lock_reader_wait") in histograms
+
+
+def test_prometheus_exporter(tmp_path: Path) -> None:
+    group = MemoizedGroup(obj_store=DirObjStore(temp_path()), temporary=True)
+
+    @memoize(group=group)
+    def square(x: int) -> int:
+        return x**2
+
+    global_metrics.reset()
+    square(2)
+    square(2)
+    exporter = PrometheusExporter({"test": group})
+    text = exporter.render()
+    assert f'charmonium_cache_hits_total{{function="{square.name}"}} 1' in text
+    assert f'charmonium_cache_misses_total{{function="{square.name}"}} 1' in text
+    assert '# TYPE charmonium_cache_hash_seconds histogram' in text
+    assert f'charmonium_cache_hash_seconds_count{{function="{square.name}"}} 2' in text
+    assert 'charmonium_cache_index_entries{group="test"} 1' in text
+
+    path = tmp_path / "cache.prom"
+    exporter.write_textfile(path)
+    assert path.read_text().startswith("# HELP")
+
+    server = exporter.serve(port=0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert b"charmonium_cache_hits_total" in response.read()
+    finally:
+        server.shutdown()
+
+
+def test_report(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    metrics = Metrics()
+    metrics.increment("module.square", "hits", 3)
+    metrics.increment("module.square", "misses", 1)
+    metrics.observe("module.square", "inner_function", 2 * 10**9)
+    metrics.observe("module.square", "hash", 1500)
+    metrics.observe("", "index_read", 10**6)
+    report = metrics.report()
+    header, row, shared = report.splitlines()
+    assert header.split()[:6] == ["function", "hits", "misses", "hit%", "compute", "saved"]
+    assert row.split()[:10] == ["module.square", "3", "1", "75%", "2.0", "s", "6.0", "s", "1.5", "us"]
+    assert shared == "All functions: index_read 1.0 ms over 1"
+
+    metrics.write_report(tmp_path / "report.txt")
+    assert (tmp_path / "report.txt").read_text() == report
+    with caplog.at_level(logging.INFO, logger="test_report"):
+        metrics.write_report(logging.getLogger("test_report"))
+    assert report in caplog.text
+
+
+def test_call_sampler(caplog: pytest.LogCaptureFixture) -> None:
+    @memoize(group=MemoizedGroup(obj_store=DirObjStore(temp_path()), temporary=True))
+    def payload(data: bytes, x: int) -> bytes:
+        return data * x
+
+    def sampled_calls() -> list[dict[str, Any]]:
+        return [
+            json.loads(record.getMessage())
+            for record in caplog.records
+            if record.name == "charmonium.cache.samples"
+        ]
+
+    every, over = global_sampler.every, global_sampler.over
+    global_sampler.every, global_sampler.over = 2, None
+    try:
+        with caplog.at_level(logging.INFO, logger="charmonium.cache.samples"):
+            for x in range(4):
+                payload(b"abc", x=x)
+            assert len(sampled_calls()) == 2, "Should log one of every two calls"
+            call = sampled_calls()[0]
+            assert call["name"] == payload.name and call["reason"] == "sampled"
+            assert {"hash", "inner_function", "serialize"} <= set(call["events"])
+            assert call["arg_sizes"]["0"] == sys.getsizeof(b"abc") and "x" in call["arg_sizes"]
+            assert call["overhead"] <= call["duration"]
+
+            caplog.clear()
+            global_sampler.every, global_sampler.over = 0, 0.0
+            payload(b"abc", x=1)
+            assert [call["reason"] for call in sampled_calls()] == ["slow"]
+            assert call["hit"] is False and sampled_calls()[0]["hit"] is True
+            assert not global_sampler.active, "Should not keep calls after they finish"
+    finally:
+        global_sampler.every, global_sampler.over = every, over
+
+    assert not CallSampler(every=1).start(0), "Should not break down calls while the logger is disabled"
+
+    sampler = CallSampler(every=1, logger=logging.getLogger("test_call_sampler"))
+    sampler.max_active = 3
+    with caplog.at_level(logging.INFO, logger="test_call_sampler"):
+        for call_id in range(5):
+            assert sampler.start(call_id)
+    assert list(sampler.active) == [2, 3, 4], "Should forget only the oldest unfinished calls"
@@ -2,7 +2,16 @@ import tempfile
 
 import pytest
 
-from charmonium.cache.obj_store import DirObjStore
+from charmonium.cache.obj_store import (
+    DirObjStore,
+    RedisObjStore,
+    S3ObjStore,
+    TieredObjStore,
+    delete_many,
+    get_many,
+    set_many,
+    sizes,
+)
 
 
 def test_obj_store() -> None:
@@ -26,6 +35,126 @@ def test_obj_store() -> None:
         os.clear()
 
 
+def test_bulk() -> None:
+    with tempfile.TemporaryDirectory() as path:
+        obj_store = DirObjStore(path=path, io_threads=4)
+        obj_store.set_many({key: str(key).encode() for key in range(100)})
+        assert obj_store.get_many([5, 50, 500], None) == [b"5", b"50", None]
+        obj_store.delete_many(range(50))
+        assert set(obj_store) == set(range(50, 100))
+        assert obj_store.sizes() == {key: len(str(key)) for key in range(50, 100)}
+
+    # Stores which do not subclass ObjStore fall back to single-key operations.
+    dict_store: dict[int, bytes] = {}
+    set_many(dict_store, {1: b"1", 2: b"2"})  # type: ignore
+    assert get_many(dict_store, [1, 3], None) == [b"1", None]  # type: ignore
+    delete_many(dict_store, [1])  # type: ignore
+    assert sizes(dict_store) == {2: 1}  # type: ignore
+    assert dict_store == {2: b"2"}
+
+
 def test_init() -> None:
+    obj_store = DirObjStore(path=".")
+    # The directory is only checked at the first operation.
     with pytest.raises(ValueError):
-        DirObjStore(path=".")
+        123 in obj_store  # pylint: disable=pointless-statement
+
+
+@pytest.mark.parametrize("write_back", [False, True])
+def test_tiered_obj_store(write_back: bool) -> None:
+    with tempfile.TemporaryDirectory() as local_path, tempfile.TemporaryDirectory() as shared_path:
+        local = DirObjStore(path=local_path)
+        shared = DirObjStore(path=shared_path)
+        big_key = 1 << 100
+        obj_store = TieredObjStore(local, shared, local_size=10, write_back=write_back)
+
+        obj_store[big_key] = b"12345"
+        obj_store[big_key + 1] = b"67890"
+        assert obj_store[big_key] == b"12345"
+        assert set(local) == {big_key, big_key + 1}
+        assert set(obj_store) == {big_key, big_key + 1}
+        assert (big_key in shared) == (not write_back)
+
+        # Exceeds the local budget, so the least-recently used object is dropped (and flushed).
+        obj_store[big_key + 2] = b"abcde"
+        assert set(local) == {big_key, big_key + 2}
+        assert shared[big_key + 1] == b"67890"
+        assert obj_store[big_key + 1] == b"67890", "Should read through from the shared store"
+        assert big_key + 1 in local, "Should promote into the local store"
+
+        # Index headers are never cached locally, and writing one flushes pending objects.
+        obj_store[0] = b"header"
+        assert 0 not in local
+        assert set(shared) == {0, big_key, big_key + 1, big_key + 2}
+
+        del obj_store[big_key]
+        assert big_key not in local and big_key not in shared
+        with pytest.raises(KeyError):
+            obj_store[big_key]  # pylint: disable=pointless-statement
+
+        # A new TieredObjStore adopts the objects already in the local store.
+        local2 = DirObjStore(path=local_path)
+        obj_store2 = TieredObjStore(local2, DirObjStore(path=shared_path), local_size=10)
+        # Adopting only stats the local objects.
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setattr(local2, "get", None)
+            obj_store2._scan()  # pylint: disable=protected-access
+        assert obj_store2._local_total == 10  # pylint: disable=protected-access
+        assert obj_store2[big_key + 2] == b"abcde"
+
+        obj_store.clear()
+        assert not list(obj_store)
+
+
+def test_s3_obj_store() -> None:
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    mock_aws = getattr(moto, "mock_aws", None) or getattr(moto, "mock_s3")
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="bucket")
+        obj_store = S3ObjStore(
+            "bucket",
+            prefix="cache/",
+            chunk_size="5 MiB",
+            client_kwargs={"region_name": "us-east-1"},
+        )
+
+        obj_store[123] = b"123"
+        assert obj_store[123] == b"123"
+        assert 123 in obj_store
+        assert 456 not in obj_store
+        assert obj_store.get(456, None) is None
+
+        # Bigger than a chunk, so multipart upload and ranged download.
+        big = bytes(range(256)) * (12 * 1024 * 4)
+        obj_store[456] = big
+        assert obj_store[456] == big
+
+        obj_store.set_many({1: b"1", 2: b"2"})
+        assert obj_store.get_many([1, 2, 3], None) == [b"1", b"2", None]
+
+        assert set(obj_store) == {1, 2, 123, 456}
+        obj_store.delete_many([1, 2, 123, 456])
+        with pytest.raises(KeyError):
+            obj_store[123]  # pylint: disable=pointless-statement
+        assert not list(obj_store)
+
+
+def test_redis_obj_store() -> None:
+    fakeredis = pytest.importorskip("fakeredis")
+    obj_store = RedisObjStore(client=fakeredis.FakeRedis(), batch_size=2)
+
+    obj_store[123] = b"123"
+    assert obj_store[123] == b"123"
+    assert 123 in obj_store
+    assert 456 not in obj_store
+
+    obj_store.set_many({1: b"1", 2: b"2", 3: b"3"})
+    assert obj_store.get_many([1, 2, 3, 4], None) == [b"1", b"2", b"3", None]
+    assert set(obj_store) == {1, 2, 3, 123}
+
+    obj_store.delete_many([1, 2, 3])
+    assert set(obj_store) == {123}
+    del obj_store[123]
+    with pytest.raises(KeyError):
+        obj_store[123]  # pylint: disable=pointless-statement
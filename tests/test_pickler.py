@@ -0,0 +1,27 @@
+import bz2
+import pickle
+
+from charmonium.cache import CompressedPickler, DirObjStore, MemoizedGroup, RecordingPickler, memoize
+from charmonium.cache.util import temp_path
+
+
+def test_compressed_pickler() -> None:
+    obj = {"data": [1, 2, 3] * 1000}
+    for pickler in [CompressedPickler(), CompressedPickler(pickle, bz2)]:
+        buffer = pickler.dumps(obj)
+        assert len(buffer) < len(pickle.dumps(obj))
+        assert pickler.loads(buffer) == obj
+
+
+def test_recording_pickler() -> None:
+    samples = temp_path()
+    recorder = RecordingPickler(samples, max_samples=2)
+
+    @memoize(group=MemoizedGroup(obj_store=DirObjStore(temp_path()), temporary=True), pickler=recorder)
+    def square(x: int) -> int:
+        return x**2
+
+    for x in range(4):
+        assert square(x) == x**2
+    assert square(3) == 9
+    assert sorted(pickle.loads(path.read_bytes()) for path in samples.iterdir()) == [0, 1]
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import copyreg
+import datetime
+import pickle
+from typing import Any
+
+from charmonium.cache.replacement_policies import Entry, GDSize
+
+
+class OldSize:
+    """Stands in for a bitmath.Bitmath"""
+
+    def __init__(self, n_bytes: int) -> None:
+        self.bytes = n_bytes
+
+
+class OldEntry:
+    """Pickles like the Entry dataclass of previous versions."""
+
+    def __reduce_ex__(self, protocol: Any) -> Any:
+        return (
+            copyreg._reconstructor,  # type: ignore # pylint: disable=protected-access
+            (Entry, object, None),
+            {
+                "value": "hello",
+                "data_size": OldSize(123),
+                "function_time": datetime.timedelta(seconds=1.5),
+                "serialization_time": datetime.timedelta(seconds=0.25),
+                "obj_store": False,
+            },
+        )
+
+
+def test_entry_pickle() -> None:
+    entry = Entry(value=None, data_size=123, function_time=1.5, serialization_time=0.25, obj_store=True)
+    assert pickle.loads(pickle.dumps(entry)) == entry
+    assert not hasattr(entry, "__dict__")
+
+
+def test_entry_backwards_compat() -> None:
+    entry = pickle.loads(pickle.dumps(OldEntry()))
+    assert entry == Entry(value="hello", data_size=123, function_time=1.5, serialization_time=0.25, obj_store=False)
+
+
+def test_gdsize() -> None:
+    policy = GDSize()
+    cheap = Entry(value=None, data_size=100, function_time=0.1, serialization_time=0.0, obj_store=True)
+    expensive = Entry(value=None, data_size=100, function_time=10.0, serialization_time=0.0, obj_store=True)
+    policy.add("cheap", cheap)
+    policy.add("expensive", expensive)
+    assert policy.evict(lambda key, entry: key == "expensive") == ("expensive", expensive)
+    policy.add("expensive", expensive)
+    assert policy.evict() == ("cheap", cheap)
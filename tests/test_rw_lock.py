@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from charmonium.cache.metrics import Metrics
+from charmonium.cache.rw_lock import NaiveRWLock, RedisRWLock, TimedLock, TimedRWLock
+
+
+def test_redis_rw_lock() -> None:
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    lock = RedisRWLock(client=client, poll=0.001)
+    events: list[str] = []
+
+    def writer() -> None:
+        with lock.writer:
+            events.append("writer")
+
+    with lock.reader, lock.reader:
+        # Readers share the lock, and a writer waits for them.
+        thread = threading.Thread(target=writer)
+        thread.start()
+        time.sleep(0.05)
+        events.append("readers")
+    thread.join()
+    assert events == ["readers", "writer"]
+
+    with lock.writer:
+        assert not client.exists("charmonium.cache:lock:readers")
+    assert not client.exists("charmonium.cache:lock:writer")
+
+    sibling = lock.with_name("charmonium.cache:lock.1")
+    assert (sibling.name, sibling.poll) == ("charmonium.cache:lock.1", lock.poll)
+    with lock.writer, sibling.writer:
+        # A sibling is a separate lock on the same server.
+        assert client.exists("charmonium.cache:lock.1:writer")
+
+
+def test_redis_rw_lock_lease() -> None:
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    lock = RedisRWLock(client=client, lease=0.05, poll=0.001)
+    # Simulate a reader which crashed without releasing.
+    lock.reader.__enter__()
+    start = time.monotonic()
+    with lock.writer:
+        pass
+    assert time.monotonic() - start >= 0.04, "The writer should wait for the reader's lease to expire"
+
+
+def test_timed_lock() -> None:
+    metrics = Metrics()
+    lock = TimedLock(threading.RLock(), "test_lock", metrics)
+    with lock:
+        with lock:
+            pass
+
+    holding = threading.Event()
+
+    def hold() -> None:
+        with lock:
+            holding.set()
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait()
+    with lock:
+        pass
+    thread.join()
+
+    histograms, counters = metrics.snapshot()
+    assert counters[("", "test_lock_acquisitions")] == 4
+    assert counters[("", "test_lock_contended")] == 1
+    assert histograms[("", "test_lock_wait")].max_ns >= 0.01e9
+    assert histograms[("", "test_lock_hold")].count == 4
+
+
+def test_timed_rw_lock() -> None:
+    metrics = Metrics()
+    rw_lock = TimedRWLock(NaiveRWLock(threading.Lock()), "test_rw_lock", metrics)
+    with rw_lock.reader:
+        pass
+    with rw_lock.writer:
+        pass
+    _, counters = metrics.snapshot()
+    assert counters[("", "test_rw_lock_reader_acquisitions")] == 1
+    assert counters[("", "test_rw_lock_writer_acquisitions")] == 1